@@ -0,0 +1 @@
+"""Microbenchmarks for Dozer's hot paths. Run a module with `python -m benchmarks.<name>` from the repository root."""
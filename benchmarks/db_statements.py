@@ -0,0 +1,139 @@
+"""Measures the Python-side overhead of DatabaseTable.get_by / delete / update_or_add.
+
+The pool is swapped for one whose connections do nothing, so the numbers are purely the cost of turning a call into
+a statement and its arguments. The "before" column rebuilds the SQL the way DatabaseTable used to on every call.
+
+    python -m benchmarks.db_statements [iterations]
+"""
+import asyncio
+import sys
+import time
+
+from dozer import db
+
+
+class _NullConnection:
+    """Connection that accepts any statement and returns nothing."""
+
+    async def execute(self, statement, *args):
+        return "DELETE 0"
+
+    async def fetch(self, statement, *args):
+        return []
+
+
+class _NullPool:
+    """Pool handing out a single shared _NullConnection."""
+
+    def __init__(self):
+        self._conn = _NullConnection()
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self._conn
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class BenchTable(db.DatabaseTable):
+    """A table shaped like levels_member_xp"""
+    __tablename__ = 'bench_member_xp'
+    __uniques__ = 'guild_id, user_id'
+
+    def __init__(self, guild_id, user_id, total_xp, total_messages, last_given_at):
+        super().__init__()
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.total_xp = total_xp
+        self.total_messages = total_messages
+        self.last_given_at = last_given_at
+
+
+async def legacy_update_or_add(self):
+    """update_or_add as it was before statements were compiled once per column signature"""
+    keys = []
+    values = []
+    for var, value in self.__dict__.items():
+        if value is self.nullify:
+            keys.append(var)
+            values.append(None)
+        elif value is not None:
+            keys.append(var)
+            values.append(value)
+
+    updates = ""
+    for key in keys:
+        if key in self.__uniques__:
+            continue
+        updates += f"{key} = EXCLUDED.{key}"
+        if keys.index(key) == len(keys) - 1:
+            updates += " ;"
+        else:
+            updates += ", \n"
+    async with db.Pool.acquire() as conn:
+        statement = f"""
+        INSERT INTO {self.__tablename__} ({", ".join(keys)})
+        VALUES({','.join(f'${i + 1}' for i in range(len(values)))})
+        ON CONFLICT ({self.__uniques__}) DO UPDATE
+        SET {updates}
+        """
+        await conn.execute(statement, *values)
+
+
+async def legacy_get_by(cls, **filters):
+    """get_by as it was before statements were compiled once per column signature"""
+    async with db.Pool.acquire() as conn:
+        statement = f"SELECT * FROM {cls.__tablename__}"
+        if filters:
+            conditions = " AND ".join(f"{column_name} = ${i + 1}" for (i, column_name) in enumerate(filters))
+            statement = f"{statement} WHERE {conditions};"
+        else:
+            statement += ";"
+        return await conn.fetch(statement, *filters.values())
+
+
+async def legacy_delete(cls, **filters):
+    """delete as it was before statements were compiled once per column signature"""
+    async with db.Pool.acquire() as conn:
+        if filters:
+            conditions = " AND ".join(f"{column_name} = ${i + 1}" for (i, column_name) in enumerate(filters))
+            statement = f"DELETE FROM {cls.__tablename__} WHERE {conditions};"
+        else:
+            statement = f"TRUNCATE {cls.__tablename__};"
+        return await conn.execute(statement, *filters.values())
+
+
+async def _time(iterations, make_call):
+    start = time.perf_counter()
+    for i in range(iterations):
+        await make_call(i)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def run(iterations: int):
+    """Run every scenario and print per-call overhead in microseconds."""
+    db.Pool = _NullPool()
+    row = BenchTable(1, 2, 300, 40, 0)
+    scenarios = [
+        ("update_or_add",
+         lambda i: legacy_update_or_add(row),
+         lambda i: row.update_or_add()),
+        ("get_by(guild_id, user_id)",
+         lambda i: legacy_get_by(BenchTable, guild_id=i, user_id=i),
+         lambda i: BenchTable.get_by(guild_id=i, user_id=i)),
+        ("delete(guild_id, user_id)",
+         lambda i: legacy_delete(BenchTable, guild_id=i, user_id=i),
+         lambda i: BenchTable.delete(guild_id=i, user_id=i)),
+    ]
+    print(f"{'call':<28}{'before (us)':>14}{'after (us)':>14}{'speedup':>10}")
+    for name, before, after in scenarios:
+        before_us = await _time(iterations, before)
+        after_us = await _time(iterations, after)
+        print(f"{name:<28}{before_us:>14.2f}{after_us:>14.2f}{before_us / after_us:>9.2f}x")
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
@@ -0,0 +1,229 @@
+"""Measures how fast the Filter cog checks messages and nicknames as a guild's filter set and message length grow.
+
+Each configuration gets its own guild with a synthetic filter set, a mix of plain words, word-boundary regexes and
+leetspeak character classes, and a corpus of messages of one length, a few of which contain a filtered word. Messages
+go through Filter.check_filters_messages and nicknames through Filter.check_filters_nicknames, using stub Discord
+objects and the in-memory database, so the numbers cover everything from the snapshot lookup to the regex workers.
+The regex time budget is raised well past anything a benchmark pattern needs, so nothing gets quarantined mid-run.
+
+    python -m benchmarks.filter_throughput [messages per configuration] [concurrency]
+"""
+import asyncio
+import random
+import sys
+import time
+
+from dozer import memorydb
+from dozer.cogs.filter import Filter, WordFilter, WordFilterRoleWhitelist
+
+PATTERN_COUNTS = (5, 50, 500)
+MESSAGE_LENGTHS = (("short", 40), ("medium", 300), ("long", 2000))
+HIT_RATE = 0.02  # share of messages containing a filtered word
+WARMUP = 20
+
+_SYLLABLES = ("ba", "ko", "ri", "te", "lu", "mo", "sa", "ne", "di", "pa", "go", "fe", "zu", "shi", "tra", "ple")
+_LEET = {"a": "[a@4]", "e": "[e3]", "i": "[i1!]", "o": "[o0]", "s": "[s$5]", "t": "[t7+]"}
+_LEET_SPELLING = {"a": "4", "e": "3", "i": "1", "o": "0", "s": "5", "t": "7"}
+
+
+class _StubRole:
+    """A role; only its ID is read"""
+
+    def __init__(self, role_id: int):
+        self.id = role_id
+
+
+class _StubChannel:
+    """A channel counting the warnings sent to it"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, content=None, **_kwargs):
+        self.sent += 1
+
+
+class _StubGuild:
+    """A guild with no channels, so quarantine reports go nowhere"""
+
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+
+    def get_channel(self, _channel_id):
+        return None
+
+
+class _StubMember:
+    """A member with a fixed set of roles, counting nickname resets"""
+
+    def __init__(self, member_id: int, guild: _StubGuild, roles: list, nick: str = None):
+        self.id = member_id
+        self.guild = guild
+        self.roles = roles
+        self.nick = nick
+        self.edits = 0
+
+    @property
+    def mention(self):
+        return f"<@{self.id}>"
+
+    async def edit(self, **_kwargs):
+        self.edits += 1
+
+    async def send(self, content=None, **_kwargs):
+        pass
+
+
+class _StubMessage:
+    """A message that remembers whether it was deleted"""
+
+    def __init__(self, author: _StubMember, channel: _StubChannel, content: str):
+        self.author = author
+        self.guild = author.guild
+        self.channel = channel
+        self.content = content
+        self.deleted = False
+
+    async def delete(self):
+        self.deleted = True
+
+
+class _StubBot:
+    """Just enough of Dozer for the Filter cog to run"""
+
+    def __init__(self):
+        self.user = _StubMember(0, None, [])
+        self.loop = asyncio.get_event_loop()
+        self.config = {'filter': {'regex_timeout_ms': 10000, 'regex_workers': 2}}
+
+    async def wait_until_ready(self):
+        pass
+
+    def add_message_hook(self, hook, order, *, gate=False):
+        pass
+
+    def remove_message_hook(self, hook):
+        pass
+
+
+def _word(rng: random.Random) -> str:
+    """A pronounceable nonsense word, so filters and messages share no real vocabulary"""
+    return "".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def make_patterns(rng: random.Random, count: int) -> list:
+    """(pattern, word it was made from) pairs, a third each of plain words, word-boundary regexes and leetspeak"""
+    patterns = []
+    for i in range(count):
+        word = _word(rng) + _word(rng)
+        if i % 3 == 0:
+            patterns.append((word, word))
+        elif i % 3 == 1:
+            patterns.append((rf"\b{word}s?\b", word))
+        else:
+            patterns.append(("".join(_LEET.get(char, char) for char in word), word))
+    return patterns
+
+
+def make_text(rng: random.Random, length: int, filtered_words: list) -> str:
+    """Random words up to length characters, with a filtered word (sometimes in leetspeak) in HIT_RATE of them"""
+    words = []
+    size = 0
+    while size < length:
+        word = _word(rng)
+        words.append(word)
+        size += len(word) + 1
+    if rng.random() < HIT_RATE:
+        hit = rng.choice(filtered_words)
+        if rng.random() < 0.5:
+            hit = "".join(_LEET_SPELLING.get(char, char) for char in hit)
+        words[rng.randrange(len(words))] = hit
+    return " ".join(words)[:length]
+
+
+def _percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def _measure(calls: list, concurrency: int) -> tuple:
+    """Runs every call, at most concurrency at once; returns (calls per second, p99 latency in seconds)"""
+    latencies = []
+    queue = iter(calls)
+
+    async def worker():
+        for call in queue:
+            start = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return len(calls) / (time.perf_counter() - start), _percentile(latencies, 0.99)
+
+
+async def _setup_guild(rng: random.Random, guild_id: int, count: int) -> list:
+    """Stores count filters and a whitelisted role for a guild, returning the words the filters were made from"""
+    patterns = make_patterns(rng, count)
+    for i, (pattern, _) in enumerate(patterns):
+        await WordFilter(guild_id=guild_id, friendly_name=f"filter {i}", pattern=pattern,
+                         filter_id=guild_id * 1000 + i).update_or_add()
+    await WordFilterRoleWhitelist(guild_id=guild_id, role_id=guild_id * 1000).update_or_add()
+    return [word for _, word in patterns]
+
+
+def _members(rng: random.Random, guild: _StubGuild, count: int = 50) -> list:
+    # none of them has the whitelisted role, so every check gets as far as the filters
+    return [_StubMember(guild.id * 1000 + i + 1, guild, [_StubRole(rng.randrange(1, 10 ** 6)) for _ in range(3)])
+            for i in range(count)]
+
+
+async def run(messages: int, concurrency: int):
+    """Run every configuration and print throughput and p99 latency"""
+    memorydb.install(instrumented=False)
+    rng = random.Random(2021)
+    cog = Filter(_StubBot())
+    words_by_guild = {}
+    guild_id = 1
+    for count in PATTERN_COUNTS:
+        for _ in range(len(MESSAGE_LENGTHS) + 1):  # one guild per message length, and one for nicknames
+            words_by_guild[guild_id] = await _setup_guild(rng, guild_id, count)
+            guild_id += 1
+    await cog.preload_snapshots()
+
+    print(f"{'check':<10}{'patterns':>9}{'length':>8}{'msgs/s':>11}{'p99 (ms)':>10}{'hits':>7}")
+    guild_id = 1
+    try:
+        for count in PATTERN_COUNTS:
+            for name, length in MESSAGE_LENGTHS:
+                guild = _StubGuild(guild_id)
+                members = _members(rng, guild)
+                channel = _StubChannel()
+                corpus = [_StubMessage(rng.choice(members), channel, make_text(rng, length, words_by_guild[guild_id]))
+                          for _ in range(messages + WARMUP)]
+                calls = [lambda message=message: cog.check_filters_messages(message) for message in corpus]
+                await _measure(calls[:WARMUP], 1)  # starts the regex workers and compiles the guild's patterns
+                rate, p99 = await _measure(calls[WARMUP:], concurrency)
+                hits = sum(message.deleted for message in corpus[WARMUP:])
+                print(f"{'message':<10}{count:>9}{name:>8}{rate:>11.0f}{p99 * 1000:>10.2f}{hits:>7}")
+                guild_id += 1
+
+            guild = _StubGuild(guild_id)
+            pairs = []
+            for member in _members(rng, guild):
+                for _ in range(messages // 50 + 1):
+                    after = _StubMember(member.id, guild, member.roles, make_text(rng, 32, words_by_guild[guild_id]))
+                    pairs.append((member, after))
+            calls = [lambda pair=pair: cog.check_filters_nicknames(*pair) for pair in pairs[:messages + WARMUP]]
+            await _measure(calls[:WARMUP], 1)
+            rate, p99 = await _measure(calls[WARMUP:], concurrency)
+            hits = sum(after.edits for _, after in pairs[WARMUP:messages + WARMUP])
+            print(f"{'nickname':<10}{count:>9}{32:>8}{rate:>11.0f}{p99 * 1000:>10.2f}{hits:>7}")
+            guild_id += 1
+    finally:
+        cog.cog_unload()
+
+
+if __name__ == '__main__':
+    asyncio.get_event_loop().run_until_complete(run(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+                                                    int(sys.argv[2]) if len(sys.argv) > 2 else 1))
@@ -10,7 +10,7 @@ DOZER_LOGGER = getLogger(__name__)
 
 async def send_log(member):
     """Sends the message for when a user joins or leave a guild"""
-    config = await CustomJoinLeaveMessages.get_by(guild_id=member.guild.id)
+    config = await join_leave_config.query_all(member.guild.id)
     if len(config):
         channel = member.guild.get_channel(config[0].channel_id)
         if channel:
@@ -101,3 +101,6 @@ class CustomJoinLeaveMessages(db.DatabaseTable):
                                f"add if not exists send_on_verify boolean default null;")
 
     __versions__ = [version_1, version_2]
+
+
+join_leave_config = db.GuildConfigStore(CustomJoinLeaveMessages)
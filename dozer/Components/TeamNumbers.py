@@ -5,6 +5,9 @@ class TeamNumbers(db.DatabaseTable):
     """Database operations for tracking team associations."""
     __tablename__ = 'team_numbers'
     __uniques__ = 'user_id, team_number, team_type'
+    __indexes__ = (
+        db.Index("team_type", "team_number"),
+    )
 
     @classmethod
     async def initial_create(cls):
@@ -0,0 +1,160 @@
+"""Holder for the levels cog's journal of XP not yet written to the database, and the table of its checkpoints"""
+import asyncio
+import json
+import os
+import time
+import typing
+from datetime import date, datetime
+from logging import getLogger
+
+from dozer import db
+
+DOZER_LOGGER = getLogger(__name__)
+
+
+class XPJournal:
+    """Append-only log of member XP that hasn't reached the database yet, so a crash or a failed sync loses nothing.
+    Each line holds a member's totals after a change rather than the change itself, so replaying keeps the last line
+    per member and is safe to repeat. A line for a message that earned XP also holds the XP gained and its day; those
+    are deltas, kept per segment on replay, because the daily table is incremented rather than overwritten, and only
+    the segments past the journal checkpoint in the database still need adding. Lines are buffered for up to
+    `write_delay` seconds and written together, to numbered segment files in `path`: a sync seals the segment being
+    written and deletes the sealed segments once the database holds everything in them. Segment numbers start from the
+    clock in microseconds, so they keep increasing across restarts and stay comparable with the checkpoint.
+    """
+    write_delay = 0.1
+
+    def __init__(self, path: str, loop: asyncio.AbstractEventLoop):
+        self.path = path
+        self._loop = loop
+        os.makedirs(path, exist_ok=True)
+        self._sealed = sorted(int(name[:-len(".jsonl")]) for name in os.listdir(path)
+                              if name.endswith(".jsonl") and name[:-len(".jsonl")].isdigit())
+        self._segment = self._sealed[-1] if self._sealed else 0  # the segment being written, or the last one
+        self._file = None
+        self._buffer = []  # lines waiting for the next write
+        self._write_handle = None
+        self._settling = []  # files of sealed segments still to be fsynced and closed
+        self.pending = 0  # lines appended since the last seal
+        self.oldest_pending = None  # time.monotonic() of the first of those
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f"{segment:010d}.jsonl")
+
+    def replay(self) -> typing.Tuple[typing.Dict[typing.Tuple[int, int], tuple], typing.Dict[int, typing.Dict[tuple, int]]]:
+        """Read back every segment left by a previous run, as (total_xp, last_given_at, total_messages) keyed by
+        (guild_id, user_id) and the XP earned per (guild_id, user_id, day) in each segment"""
+        entries = {}
+        daily = {}
+        for segment in self._sealed:
+            segment_daily = daily[segment] = {}
+            with open(self._segment_path(segment)) as f:
+                for line in f:
+                    try:
+                        guild_id, user_id, total_xp, total_messages, last_given_at, *earned = json.loads(line)
+                        if earned:
+                            day, gained = earned
+                            day_key = (guild_id, user_id, date.fromisoformat(day))
+                            segment_daily[day_key] = segment_daily.get(day_key, 0) + gained
+                    except ValueError:  # a line cut short by a crash
+                        DOZER_LOGGER.warning(f"Skipping unreadable line in XP journal segment {segment}")
+                        continue
+                    last_given_at = datetime.fromisoformat(last_given_at) if last_given_at else None
+                    entries[(guild_id, user_id)] = (total_xp, last_given_at, total_messages)
+        return entries, {segment: segment_daily for segment, segment_daily in daily.items() if segment_daily}
+
+    def append(self, guild_id: int, user_id: int, cached_member, day: date = None, gained: int = 0):
+        """Record a member's current totals, and the XP they gained on `day` if the change came from a message"""
+        last_given_at = cached_member.last_given_at.isoformat() if cached_member.last_given_at else None
+        line = [guild_id, user_id, cached_member.total_xp, cached_member.total_messages, last_given_at]
+        if day is not None:
+            line += [day.isoformat(), gained]
+        self._buffer.append(json.dumps(line) + "\n")
+        if self._write_handle is None:
+            self._write_handle = self._loop.call_later(self.write_delay, self.write)
+        if self.oldest_pending is None:
+            self.oldest_pending = time.monotonic()
+        self.pending += 1
+
+    def write(self):
+        """Write the buffered lines to the segment being written and hand them to the OS, so they outlive the process"""
+        if self._write_handle is not None:
+            self._write_handle.cancel()
+            self._write_handle = None
+        if not self._buffer:
+            return
+        if self._file is None:
+            self._segment = max(time.time_ns() // 1000, self._segment + 1)
+            # kept open between syncs so each batch is a single write; seal and close are what close it
+            self._file = open(self._segment_path(self._segment), "a")  # pylint: disable=consider-using-with
+        self._file.write("".join(self._buffer))
+        self._file.flush()
+        self._buffer = []
+
+    def due(self, flush_size: int, flush_interval: float) -> bool:
+        """Whether enough lines have piled up, or the oldest has waited long enough, to warrant a sync"""
+        return self.pending >= flush_size or (
+            self.oldest_pending is not None and time.monotonic() - self.oldest_pending >= flush_interval)
+
+    def seal(self) -> typing.List[int]:
+        """Close the segment being written, and return every segment not yet known to be in the database.
+        `settle` makes the closed segment durable."""
+        self.write()
+        if self._file is not None:
+            self._settling.append(self._file)
+            self._file = None
+            self._sealed.append(self._segment)
+        self.pending = 0
+        self.oldest_pending = None
+        return list(self._sealed)
+
+    async def settle(self):
+        """fsync and close the segments sealed so far, in an executor so the disk doesn't hold up the event loop"""
+        settling, self._settling = self._settling, []
+        for file in settling:
+            await self._loop.run_in_executor(None, self._close_durably, file)
+
+    @staticmethod
+    def _close_durably(file):
+        try:
+            os.fsync(file.fileno())
+        except OSError as e:  # the lines are still in the cache on their way to the database
+            DOZER_LOGGER.warning(f"Failed to fsync XP journal segment {file.name}: {e}")
+        finally:
+            file.close()
+
+    def discard(self, segments: typing.Iterable[int]):
+        """Delete segments whose contents the database now holds"""
+        for segment in segments:
+            self._sealed.remove(segment)
+            os.remove(self._segment_path(segment))
+
+    def retry_later(self):
+        """Count a failed sync as pending again, so the next attempt waits for the usual triggers"""
+        if self.oldest_pending is None:
+            self.oldest_pending = time.monotonic()
+
+    def close(self):
+        """Write out buffered lines and close every open segment; they are replayed by the next journal opened on the
+        same path"""
+        self.write()
+        for file in self._settling:
+            file.close()
+        self._settling = []
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class XPJournalCheckpoint(db.DatabaseTable):
+    """Database table recording the newest segment of each XP journal whose daily XP is in the database"""
+    __tablename__ = "levels_journal_checkpoint"
+    __columns__ = (
+        db.Column("journal", "varchar", primary_key=True),
+        db.Column("segment", "bigint"),
+    )
+
+    def __init__(self, journal: str, segment: int):
+        super().__init__()
+        self.journal = journal
+        self.segment = segment
@@ -8,11 +8,41 @@ import sys
 import discord
 import sentry_sdk
 
-from .db import db_init, db_migrate
+from .db import db_init, db_listen, db_migrate, ConfigCache
+from .querystats import stats as query_stats
 
 config = {
     'prefix': '&', 'developers': [],
     'cache_size': 20000,
+    'config_cache': {
+        'max_size': 5000,
+        'ttl': 600.0
+    },
+    'db_pool': {
+        'min_size': 10,
+        'max_size': 10,
+        'max_inactive_connection_lifetime': 300.0,
+        'statement_cache_size': 100,
+        'sample_interval': 60.0,
+        'acquire_warning_ms': 100
+    },
+    'slow_query_ms': 250,
+    'levels': {
+        'journal_path': 'levels_journal',
+        'flush_size': 1000,
+        'flush_interval': 30.0,
+        'notification_window': 5.0,
+        'cache_max_entries': 50000,
+        'mee6_import': {
+            'requests_per_second': 1.0,
+            'burst': 3,
+            'concurrency': 3
+        }
+    },
+    'filter': {
+        'regex_timeout_ms': 100,
+        'regex_workers': 2
+    },
     'tba': {
         'key': 'Put TBA API key here'
     },
@@ -64,7 +94,15 @@ if config['sentry_url'] != "":
         traces_sample_rate=1.0,
     )
 
-asyncio.get_event_loop().run_until_complete(db_init(config['db_url']))
+db_pool = config['db_pool']
+asyncio.get_event_loop().run_until_complete(db_init(
+    config['db_url'], min_size=db_pool['min_size'], max_size=db_pool['max_size'],
+    max_inactive_connection_lifetime=db_pool['max_inactive_connection_lifetime'],
+    statement_cache_size=db_pool['statement_cache_size'], sample_interval=db_pool['sample_interval']))
+ConfigCache.default_max_size = config['config_cache']['max_size']
+ConfigCache.default_ttl = config['config_cache']['ttl']
+query_stats.slow_query_threshold = config['slow_query_ms'] / 1000 if config['slow_query_ms'] else None
+query_stats.acquire_warning_threshold = db_pool['acquire_warning_ms'] / 1000 if db_pool['acquire_warning_ms'] else None
 
 if 'discord_token' not in config:
     sys.exit('Discord token must be supplied in configuration')
@@ -85,6 +123,7 @@ for ext in os.listdir('dozer/cogs'):
         bot.load_extension('dozer.cogs.' + ext[:-3])  # Remove '.py'
 
 asyncio.get_event_loop().run_until_complete(db_migrate())
+asyncio.get_event_loop().run_until_complete(db_listen(config['db_url']))
 
 bot.run()
 
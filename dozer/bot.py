@@ -11,9 +11,9 @@ from discord.ext import commands
 from discord_slash import SlashCommand
 from sentry_sdk import capture_exception
 
-from . import utils
+from . import db, utils
 from .cogs import _utils
-from .context import DozerContext
+from .context import DozerContext, MessageContext
 
 DOZER_LOGGER = logging.getLogger('dozer')
 DOZER_LOGGER.level = logging.INFO
@@ -31,6 +31,13 @@ if discord.version_info.major < 1:
     sys.exit(1)
 
 
+# Order the message hooks run in. Hooks that can delete the message come first, so the rest never see deleted messages.
+FILTER_HOOK_ORDER = 100
+LINKS_HOOK_ORDER = 200
+LEVELS_HOOK_ORDER = 300
+NEW_MEMBER_HOOK_ORDER = 400
+
+
 class InvalidContext(commands.CheckFailure):
     """
     Check failure raised by the global check for an invalid command context - executed by a bot, exceeding global rate-limit, etc.
@@ -51,12 +58,14 @@ class Dozer(commands.Bot):
             DOZER_LOGGER.level = logging.DEBUG
             DOZER_HANDLER.level = logging.DEBUG
         self._restarting = False
+        self._message_hooks = []  # (order, hook, gate), in the order they run
         self.check(self.global_checks)
 
     async def on_ready(self):
         """Things to run when the bot has initialized and signed in"""
         DOZER_LOGGER.info('Signed in as {}#{} ({})'.format(self.user.name, self.user.discriminator, self.user.id))
         await self.dynamic_prefix.refresh()
+        await db.GuildConfigStore.load_all()
         perms = 0
         for cmd in self.walk_commands():
             perms |= cmd.required_permissions.value
@@ -72,6 +81,43 @@ class Dozer(commands.Bot):
             DOZER_LOGGER.warning("You are running an older version of the discord.py rewrite (with breaking changes)! "
                                  "To upgrade, run `pip install -r requirements.txt --upgrade`")
 
+    def add_message_hook(self, hook, order: int, *, gate: bool = False):
+        """Run `await hook(context)` with a MessageContext for every message, in ascending order of `order`. Gate
+        hooks, the ones that may delete the message, all finish before its command runs; the rest run afterwards."""
+        self._message_hooks.append((order, hook, gate))
+        self._message_hooks.sort(key=lambda entry: entry[0])
+
+    def remove_message_hook(self, hook):
+        """Stop running a hook registered with add_message_hook"""
+        self._message_hooks = [entry for entry in self._message_hooks if entry[1] != hook]
+
+    async def on_message(self, message: discord.Message):
+        """Builds one MessageContext, runs the gate hooks on it in order, processes commands and then runs the other
+        hooks in a task of their own, so a command never waits on them. If a gate hook deletes the message, everything
+        after it is skipped. The command context is only worked out for messages that got past the gate hooks and
+        weren't sent by a bot, since nothing else can invoke a command."""
+        context = MessageContext(message)
+        hooks = self._message_hooks
+        if not await self._run_message_hooks(context, [hook for _, hook, gate in hooks if gate]):
+            return
+        if not message.author.bot:
+            context.command_ctx = await self.get_context(message)
+            await self.invoke(context.command_ctx)
+        others = [hook for _, hook, gate in hooks if not gate]
+        if others:
+            self.loop.create_task(self._run_message_hooks(context, others))
+
+    async def _run_message_hooks(self, context: MessageContext, hooks: list) -> bool:
+        """Runs hooks on a message in order, returning False if one of them deleted it"""
+        for hook in hooks:
+            try:
+                await hook(context)
+            except Exception:  # one cog's failure shouldn't keep the message from the others or from commands
+                await self.on_error(f"message hook {hook.__qualname__}", context.message)
+            if context.deleted:
+                return False
+        return True
+
     async def get_context(self, message: discord.Message, *, cls=DozerContext):
         ctx = await super().get_context(message, cls=cls)
         return ctx
@@ -161,4 +207,5 @@ class Dozer(commands.Bot):
         self._restarting = restart
         await self.logout()
         await self.close()
+        await db.db_close()
         self.loop.stop()
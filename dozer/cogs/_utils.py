@@ -12,8 +12,8 @@ from discord.ext import commands
 from dozer import db
 from dozer.context import DozerContext
 
-__all__ = ['bot_has_permissions', 'command', 'group', 'Cog', 'Reactor', 'Paginator', 'paginate', 'chunk', 'dev_check',
-           'DynamicPrefixEntry']
+__all__ = ['bot_has_permissions', 'command', 'group', 'Cog', 'Reactor', 'Paginator', 'PageProvider', 'paginate', 'chunk',
+           'dev_check', 'DynamicPrefixEntry']
 
 DOZER_LOGGER = logging.getLogger("dozer")
 
@@ -140,7 +140,7 @@ class Reactor:
         self.message = None
 
     async def __aiter__(self):
-        self.message = await self.dest.send(embed=self.pages[self.page])
+        self.message = await self.dest.send(embed=await self.get_page(self.page))
         for emoji in self._reactions:
             await self.message.add_reaction(emoji)
         while True:
@@ -179,6 +179,31 @@ class Reactor:
             return reaction.message.id == self.message.id and member.id == self.caller.id
 
 
+class PageProvider:
+    """
+    Supplies a Paginator's pages on demand, for when building every page up front would be wasteful.
+    Subclasses implement __len__ and render(page), which builds the embed for a page number. Rendered pages are kept,
+    so revisiting a page doesn't render it again.
+    """
+
+    def __init__(self):
+        self._rendered = {}
+
+    def __len__(self):
+        raise NotImplementedError
+
+    async def render(self, page: int) -> discord.Embed:
+        """Build the embed for a page"""
+        raise NotImplementedError
+
+    async def get(self, page: int) -> discord.Embed:
+        """The embed for a page, rendering it the first time it is asked for"""
+        embed = self._rendered.get(page)
+        if embed is None:
+            embed = self._rendered[page] = await self.render(page)
+        return embed
+
+
 class Paginator(Reactor):
     """
     Extends functionality of Reactor for pagination.
@@ -189,7 +214,7 @@ class Paginator(Reactor):
         from ._utils import Reactor
         # in a command
         initial_reactions = [...] # Initial reactions (str or Emoji) to add (in addition to normal pagination reactions)
-        pages = [...] # Embeds to use for each page
+        pages = [...] # Embeds to use for each page, or a PageProvider to render them as they are shown
         paginator = Paginator(ctx, initial_reactions, pages)
         async for reaction in paginator:
             # See Reactor for how to handle reactions
@@ -209,7 +234,10 @@ class Paginator(Reactor):
         ind = all_reactions.index(Ellipsis)
         all_reactions[ind:ind + 1] = self.pagination_reactions
         super().__init__(ctx, all_reactions, auto_remove=auto_remove, timeout=timeout)
-        if pages and isinstance(pages[-1], Mapping):
+        if isinstance(pages, PageProvider):
+            self.pages = pages
+            start %= len(pages)
+        elif pages and isinstance(pages[-1], Mapping):
             named_pages = pages.pop()
             self.pages = dict(enumerate(pages), **named_pages)
         else:
@@ -246,7 +274,16 @@ class Paginator(Reactor):
                 page += self.len_pages
         self.page = page
         if self.message is not None:
-            self.do(self.message.edit(embed=self.pages[self.page]))
+            self.do(self._show_page(page))
+
+    async def get_page(self, page: Union[int, str]) -> discord.Embed:
+        """The embed for a page"""
+        if isinstance(self.pages, PageProvider):
+            return await self.pages.get(page)
+        return self.pages[page]
+
+    async def _show_page(self, page: Union[int, str]):
+        await self.message.edit(embed=await self.get_page(page))
 
     def next(self, amt: int = 1):
         """Goes to the next help page"""
@@ -319,6 +356,7 @@ class PrefixHandler:
     def __init__(self, default_prefix: str):
         self.default_prefix = default_prefix
         self.prefix_cache: Dict[int, DynamicPrefixEntry] = {}
+        DynamicPrefixEntry.add_change_listener(self.on_prefix_change)
 
     def handler(self, bot, message: discord.Message):
         """Process the dynamic prefix for each message"""
@@ -333,33 +371,29 @@ class PrefixHandler:
             self.prefix_cache[prefix.guild_id] = prefix.prefix
         DOZER_LOGGER.info(f"{len(prefixes)} prefixes loaded from database")
 
+    async def on_prefix_change(self, columns: dict):
+        """Reload the prefix of a guild whose prefix another instance changed"""
+        guild_id = columns.get("guild_id")
+        if guild_id is None:
+            self.prefix_cache.clear()
+            await self.refresh()
+            return
+        prefixes = await DynamicPrefixEntry.get_by(guild_id=guild_id)
+        if prefixes:
+            self.prefix_cache[guild_id] = prefixes[0].prefix
+        else:
+            self.prefix_cache.pop(guild_id, None)
+
 
 class DynamicPrefixEntry(db.DatabaseTable):
     """Holds the custom prefixes for guilds"""
     __tablename__ = 'dynamic_prefixes'
-    __uniques__ = ['guild_id']
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-                CREATE TABLE {cls.__tablename__} (
-                guild_id bigint NOT NULL,
-                prefix text NOT NULL,
-                PRIMARY KEY (guild_id)
-                )""")
+    __columns__ = (
+        db.Column("guild_id", "bigint", primary_key=True),
+        db.Column("prefix", "text"),
+    )
 
     def __init__(self, guild_id: int, prefix: str):
         super().__init__()
         self.guild_id = guild_id
         self.prefix = prefix
-
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = DynamicPrefixEntry(guild_id=result.get("guild_id"), prefix=result.get("prefix"))
-            result_list.append(obj)
-        return result_list
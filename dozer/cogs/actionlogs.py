@@ -16,9 +16,10 @@ from dozer.context import DozerContext
 
 from ._utils import *
 from .general import blurple
-from .moderation import GuildNewMember
+from .moderation import new_member_config
 from .. import db
-from ..Components.CustomJoinLeaveMessages import CustomJoinLeaveMessages, format_join_leave, send_log
+from ..Components.CustomJoinLeaveMessages import CustomJoinLeaveMessages, format_join_leave, send_log, \
+    join_leave_config
 
 DOZER_LOGGER = logging.getLogger(__name__)
 
@@ -55,7 +56,7 @@ class Actionlog(Cog):
     @Cog.listener('on_member_join')
     async def on_member_join(self, member):
         """Logs that a member joined, with optional custom message"""
-        nm_config = await GuildNewMember.get_by(guild_id=member.guild.id)
+        nm_config = await new_member_config.query_all(member.guild.id)
         if len(nm_config) == 0:
             await send_log(member)
         else:
@@ -70,7 +71,7 @@ class Actionlog(Cog):
     @Cog.listener('on_member_remove')
     async def on_member_remove(self, member):
         """Logs that a member left."""
-        config = await CustomJoinLeaveMessages.get_by(guild_id=member.guild.id)
+        config = await join_leave_config.query_all(member.guild.id)
         if len(config):
             channel = member.guild.get_channel(config[0].channel_id)
             if channel:
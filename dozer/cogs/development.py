@@ -9,6 +9,7 @@ import rstcloth
 from discord.ext.commands import NotOwner
 
 from dozer.context import DozerContext
+from dozer.querystats import stats as query_stats
 from ._utils import *
 
 DOZER_LOGGER = logging.getLogger("dozer")
@@ -120,6 +121,53 @@ class Development(Cog):
     `{prefix}su cooldude#1234 {prefix}ping` - simulate cooldude sending `{prefix}ping`
     """
 
+    @group(invoke_without_command=True)
+    async def querystats(self, ctx: DozerContext, count: int = 10):
+        """Shows the database statements with the most total time spent in them since startup or the last reset."""
+        lines = [f"{'total':>9} {'calls':>7} {'mean':>7} {'p99':>7} {'rows':>8}  statement"]
+        for statement, stats in query_stats.top(count):
+            lines.append(f"{stats.total * 1000:>7.0f}ms {stats.count:>7} {stats.mean * 1000:>5.1f}ms "
+                         f"{stats.percentile(0.99) * 1000:>5.0f}ms {stats.rows:>8}  {statement[:60]}")
+        wait = query_stats.acquire_wait
+        lines.append(f"\nPool: {query_stats.in_use}/{query_stats.pool_max_size} in use, {query_stats.waiting} waiting; "
+                     f"{wait.count} acquires, mean wait {wait.mean * 1000:.1f}ms, "
+                     f"p99 {wait.percentile(0.99) * 1000:.0f}ms, max {wait.max * 1000:.0f}ms")
+        if query_stats.pool_samples:
+            peak = max(sample.peak_in_use for sample in query_stats.pool_samples)
+            lines.append(f"Peak in use over the last {len(query_stats.pool_samples)} samples: {peak}")
+        busiest = sorted(query_stats.tables.items(), key=lambda item: item[1].total, reverse=True)[:5]
+        lines.append("Busiest tables: " + ", ".join(f"{table} ({stats.total * 1000:.0f}ms)" for table, stats in busiest))
+        for page in chunk(lines, 15):
+            await ctx.send("```\n" + "\n".join(page) + "\n```")
+
+    querystats.example_usage = """
+    `{prefix}querystats` - shows the 10 database statements with the most total time
+    `{prefix}querystats 25` - shows the top 25
+    """
+
+    @querystats.command(name="reset")
+    async def querystats_reset(self, ctx: DozerContext):
+        """Clears the recorded database statement statistics."""
+        query_stats.reset()
+        await ctx.send("Query statistics reset.")
+
+    querystats_reset.example_usage = """
+    `{prefix}querystats reset` - starts collecting statement statistics afresh
+    """
+
+    @command()
+    async def xpcache(self, ctx: DozerContext):
+        """Shows the size and hit rate of the levels XP cache."""
+        levels = ctx.bot.get_cog("Levels")
+        if levels is None:
+            await ctx.send("The levels cog is not loaded.")
+            return
+        await ctx.send(f"```\n{levels.cache_stats()}\n```")
+
+    xpcache.example_usage = """
+    `{prefix}xpcache` - shows how many XP records are cached and how often lookups hit the cache
+    """
+
 
 def load_function(code: str, globals_, locals_):
     """Loads the user-evaluted code as a function so it can be executed."""
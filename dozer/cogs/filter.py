@@ -1,110 +1,687 @@
 """Establish a system of filters that allow run-time specified filters to applied to all messages in a guild,
 with whitelisted role exceptions."""
 
+import asyncio
+import itertools
+import logging
+import multiprocessing
 import re
+import sys
+import typing
+from collections import OrderedDict, deque
+from types import MappingProxyType
+
+if sys.version_info >= (3, 11):
+    from re import _constants as sre_constants, _parser as sre_parse
+else:
+    import sre_constants  # pylint: disable=deprecated-module  # re only exposes its parser under these names before 3.11
+    import sre_parse  # pylint: disable=deprecated-module
 
 import discord
 from discord.ext import commands
 from discord.ext.commands import guild_only, has_permissions
 
-from dozer.context import DozerContext
+from dozer.bot import FILTER_HOOK_ORDER
+from dozer.context import DozerContext, MessageContext
 from ._utils import *
+from .moderation import modlog_config
 from .. import db
 
+DOZER_LOGGER = logging.getLogger(__name__)
+
+_REGEX_SYNTAX = frozenset(".^$*+?{}[]\\|()")
+_INLINE_FLAGS_RE = re.compile(r"^\(\?[aiLmsux]+\)")
+
+
+class _AhoCorasick:
+    """Aho-Corasick automaton finding which of a set of literal words occur in a text in one pass over it"""
+
+    def __init__(self, words: typing.Dict[str, typing.Set[int]]):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [frozenset()]
+        for word, ids in words.items():
+            state = 0
+            for char in word:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = self._goto[state][char] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(frozenset())
+                state = next_state
+            self._out[state] |= ids
+        # Breadth-first, so each state's failure link is finished before its children need it
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._out[next_state] |= self._out[self._fail[next_state]]
+
+    def search(self, text: str) -> typing.Set[int]:
+        """IDs of every word found in text"""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found |= out[state]
+        return found
+
+
+_matcher_keys = itertools.count()
+
+
+class FilterMatcher:
+    """A guild's enabled filters compiled into as few matchers as possible, so checking a message doesn't take one
+    search per filter. Plain words go into an Aho-Corasick automaton, and other patterns are joined into one alternation;
+    only when that alternation matches are its patterns searched one by one, to tell exactly which filters matched.
+    Patterns that can't share an alternation (inline flags, group references, named groups) are searched separately.
+    Like the filters themselves, matching ignores case. The regex patterns are only compiled by the first call to
+    matches, which happens in the regex workers; the bot's own process only needs the plain words.
+    """
+
+    def __init__(self, patterns: typing.Dict[int, str]):
+        self.filter_ids = frozenset(patterns)
+        self.key = next(_matcher_keys)  # tells the regex workers which matcher to search with
+        literals = {}
+        regexes = {}
+        for filter_id, pattern in patterns.items():
+            if pattern and not _REGEX_SYNTAX.intersection(pattern):
+                literals.setdefault(pattern.lower(), set()).add(filter_id)
+            else:
+                regexes[filter_id] = pattern
+        self._literals = _AhoCorasick(literals) if literals else None
+        self.regex_patterns = tuple(sorted(regexes.items()))
+        self._patterns = None  # filter_id: compiled pattern, for everything that isn't a plain word
+        self._separate = []  # (filter_id, compiled pattern) that can't go in the alternation
+        self._combined = None
+        self._combined_ids = []
+
+    def _compile(self):
+        self._patterns = {}
+        combinable = []
+        for filter_id, pattern in self.regex_patterns:
+            compiled = self._patterns[filter_id] = re.compile(pattern, re.IGNORECASE)
+            # in the alternation, group numbers and names would refer to other filters' groups
+            if _INLINE_FLAGS_RE.match(pattern) or compiled.groupindex or _refers_to_groups(sre_parse.parse(pattern)):
+                self._separate.append((filter_id, compiled))
+            else:
+                combinable.append((filter_id, pattern))
+        self._combined_ids = [filter_id for filter_id, _ in combinable]
+        if combinable:
+            self._combined = re.compile("|".join(f"(?:{pattern})" for _, pattern in combinable), re.IGNORECASE)
+
+    def __len__(self):
+        return len(self.filter_ids)
+
+    def literal_matches(self, text: str) -> typing.Set[int]:
+        """IDs of the plain-word filters that match text. These run in linear time, so they are safe to check inline."""
+        return self._literals.search(text.lower()) if self._literals else set()
+
+    def matches(self, text: str) -> typing.List[int]:
+        """IDs of the filters that match text, in ascending order"""
+        if self._patterns is None:
+            self._compile()
+        found = self.literal_matches(text)
+        if self._combined is not None and self._combined.search(text) is not None:
+            found.update(filter_id for filter_id in self._combined_ids if self._patterns[filter_id].search(text))
+        found.update(filter_id for filter_id, compiled in self._separate if compiled.search(text))
+        return sorted(found)
+
+
+_REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+_ASSERTS = (sre_constants.ASSERT, sre_constants.ASSERT_NOT)
+
+
+def _refers_to_groups(subpattern) -> bool:
+    """Whether a parsed pattern contains a backreference or a conditional like `(?(1)b|c)`"""
+    for op, av in subpattern:
+        if op in (sre_constants.GROUPREF, sre_constants.GROUPREF_EXISTS):
+            return True
+        if op in _REPEATS:
+            nested = [av[2]]
+        elif op is sre_constants.SUBPATTERN:
+            nested = [av[-1]]
+        elif op is sre_constants.BRANCH:
+            nested = av[1]
+        elif op in _ASSERTS:
+            nested = [av[1]]
+        else:
+            nested = []
+        if any(_refers_to_groups(child) for child in nested):
+            return True
+    return False
+
+# Character sets are frozensets holding code points, plus these markers for "some characters above U+00FF of this
+# kind": word characters, whitespace, and everything else. Below U+0100 every character is listed.
+_HIGH_WORD, _HIGH_SPACE, _HIGH_OTHER = "w", "s", "o"
+_HIGH = frozenset((_HIGH_WORD, _HIGH_SPACE, _HIGH_OTHER))
+_UNIVERSE = frozenset(range(256)) | _HIGH
+# category -> (characters it matches, markers it covers completely, which a negated class can then leave out)
+_CATEGORIES = {getattr(sre_constants, name): (frozenset(c for c in range(256) if re.match(regex, chr(c))) | high, covers)
+               for name, regex, high, covers in (
+                   ("CATEGORY_DIGIT", r"\d", {_HIGH_WORD}, set()),
+                   ("CATEGORY_NOT_DIGIT", r"\D", _HIGH, {_HIGH_SPACE, _HIGH_OTHER}),
+                   ("CATEGORY_SPACE", r"\s", {_HIGH_SPACE}, {_HIGH_SPACE}),
+                   ("CATEGORY_NOT_SPACE", r"\S", {_HIGH_WORD, _HIGH_OTHER}, {_HIGH_WORD, _HIGH_OTHER}),
+                   ("CATEGORY_WORD", r"\w", {_HIGH_WORD}, {_HIGH_WORD}),
+                   ("CATEGORY_NOT_WORD", r"\W", {_HIGH_SPACE, _HIGH_OTHER}, {_HIGH_SPACE, _HIGH_OTHER}),
+                   ("CATEGORY_LINEBREAK", r"\n", set(), set()),
+                   ("CATEGORY_NOT_LINEBREAK", r".", _HIGH, _HIGH))}
+
+
+def exponential_risk(pattern: str) -> typing.Optional[str]:
+    r"""Why pattern would likely backtrack exponentially on some input, or None if it looks safe. Inside an unbounded
+    repeat, it looks for a repeat of varying length that can be followed by more of what it repeats, like the `a+` in
+    `(a+)+` or the `\w+` in `(\s*\w+)*`, and for alternatives that can begin the same way, like `(\d+x|\d)*`.
+    Patterns such as `[a-z]+(\s[a-z]+)*` pass, since each repetition can only start where the last one stopped.
+    """
+    return _find_risk(sre_parse.parse(pattern, re.IGNORECASE), None)
+
+
+def _find_risk(subpattern, follow: typing.Optional[frozenset]) -> typing.Optional[str]:
+    """Walks a parsed pattern for exponential_risk. follow is the characters that can come right after subpattern
+    when it sits inside an unbounded repeat (the start of the next repetition included), and None otherwise."""
+    items = list(subpattern)
+    for i, (op, av) in enumerate(items):
+        after = None
+        if follow is not None:
+            after, nullable = _first(items[i + 1:])
+            after = after | follow if nullable else after
+        if op in _REPEATS:
+            low, high, body = av
+            if after is not None and low != high and _overlap(_first(body)[0], after):
+                return "it repeats something of varying length that can be followed by more of the same"
+            if high == sre_constants.MAXREPEAT:
+                after = (after or frozenset()) | _first(body)[0]
+            elif after is not None and high > 1:
+                after = after | _first(body)[0]
+            risk = _find_risk(body, after)
+        elif op is sre_constants.BRANCH:
+            if after is not None and _branches_overlap(av[1], after):
+                return "it repeats alternatives that can begin with the same text"
+            risk = next(filter(None, (_find_risk(branch, after) for branch in av[1])), None)
+        elif op is sre_constants.SUBPATTERN:
+            risk = _find_risk(av[-1], after)
+        elif op in _ASSERTS:
+            risk = _find_risk(av[1], None)  # matched on its own, whatever surrounds it
+        elif op is sre_constants.GROUPREF_EXISTS:
+            risk = _find_risk(av[1], after) or (_find_risk(av[2], after) if av[2] is not None else None)
+        else:
+            continue
+        if risk:
+            return risk
+    return None
+
+
+def _branches_overlap(branches, follow: frozenset) -> bool:
+    """Whether two of the alternatives could start matching at the same character. An alternative that can match
+    nothing starts with whatever follows the branch, which is how `(a|aa)+` shows up once the parser has hoisted the
+    shared `a` out into `a(|a)`."""
+    seen = frozenset()
+    for branch in branches:
+        first, nullable = _first(branch)
+        first = first | follow if nullable else first
+        if _overlap(seen, first):
+            return True
+        seen |= first
+    return False
+
+
+def _high_kind(char: int) -> str:
+    if re.match(r"\w", chr(char)):
+        return _HIGH_WORD
+    return _HIGH_SPACE if chr(char).isspace() else _HIGH_OTHER
+
+
+def _overlap(chars: frozenset, other: frozenset) -> bool:
+    """Whether some character is in both sets"""
+    if chars & other:
+        return True
+    return any(_high_kind(c) in other for c in chars if isinstance(c, int) and c > 255) or \
+        any(_high_kind(c) in chars for c in other if isinstance(c, int) and c > 255)
+
+
+def _fold(chars: typing.Iterable) -> frozenset:
+    """chars with their other cases added, since filters ignore case"""
+    folded = set(chars)
+    for c in chars:
+        if isinstance(c, int):
+            folded.update(ord(variant) for variant in (chr(c).lower(), chr(c).upper()) if len(variant) == 1)
+    return frozenset(folded)
+
+
+def _class_chars(items) -> frozenset:
+    """The characters a [...] class matches"""
+    chars = set()
+    covered = set()  # markers whose every character is in the class
+    negate = False
+    for op, av in items:
+        if op is sre_constants.NEGATE:
+            negate = True
+        elif op is sre_constants.LITERAL:
+            chars.add(av)
+        elif op is sre_constants.RANGE:
+            chars.update(range(av[0], min(av[1], 255) + 1))
+            if av[1] > 255:
+                chars |= _HIGH
+        elif op is sre_constants.CATEGORY and av in _CATEGORIES:
+            category_chars, category_covers = _CATEGORIES[av]
+            chars |= category_chars
+            covered |= category_covers
+        else:
+            chars |= _UNIVERSE
+            covered |= _HIGH
+    chars = _fold(chars)
+    if negate:
+        return frozenset(range(256)) - chars | (_HIGH - covered)
+    return chars
+
+
+def _first(subpattern) -> typing.Tuple[frozenset, bool]:
+    """The characters a match of subpattern can start with, and whether it can match nothing at all"""
+    first = frozenset()
+    for op, av in subpattern:
+        if op is sre_constants.LITERAL:
+            return first | _fold([av]), False
+        if op in (sre_constants.NOT_LITERAL, sre_constants.ANY):
+            return first | _UNIVERSE, False
+        if op is sre_constants.IN:
+            return first | _class_chars(av), False
+        if op in _REPEATS:
+            chars, nullable = _first(av[2])
+            nullable = nullable or av[0] == 0
+        elif op is sre_constants.SUBPATTERN:
+            chars, nullable = _first(av[-1])
+        elif op is sre_constants.BRANCH:
+            starts = [_first(branch) for branch in av[1]]
+            chars = frozenset().union(*(chars for chars, _ in starts))
+            nullable = any(nullable for _, nullable in starts)
+        elif op is sre_constants.GROUPREF_EXISTS:
+            chars, nullable = _first(av[1])
+            other, other_nullable = _first(av[2]) if av[2] is not None else (frozenset(), True)
+            chars, nullable = chars | other, nullable or other_nullable
+        elif op is sre_constants.AT or op in _ASSERTS:
+            continue  # anchors and lookarounds match no characters
+        else:  # a backreference, which could be anything
+            chars, nullable = _UNIVERSE, True
+        first |= chars
+        if not nullable:
+            return first, False
+    return first, True
+
+
+class RegexPoolReset(Exception):
+    """A search was lost because its worker was stopped, by RegexPool.close or after the search overran"""
+
+
+# Compiled matchers each worker process keeps, by matcher key, most recently used last. The parent keeps a copy of
+# the keys for each worker, updated the same way, so it knows when a search has to carry its patterns along.
+_WORKER_CACHE_SIZE = 128
+
+
+def _remember(matchers: OrderedDict, key, matcher=None) -> bool:
+    """Mark key as most recently used, adding it if it's new; returns whether it was already there"""
+    if key in matchers:
+        matchers.move_to_end(key)
+        return True
+    matchers[key] = matcher
+    if len(matchers) > _WORKER_CACHE_SIZE:
+        matchers.popitem(last=False)
+    return False
+
+
+def _worker_main(conn):
+    """Runs in a worker process: answers (key, patterns or None, text) requests with (error, matching filter IDs)"""
+    conn.send(None)  # the bot's modules are imported, so searches from here on are timed fairly
+    matchers = OrderedDict()
+    while True:
+        try:
+            key, patterns, text = conn.recv()
+        except EOFError:
+            return
+        try:
+            if patterns is not None:
+                _remember(matchers, key, FilterMatcher(dict(patterns)))
+            else:
+                _remember(matchers, key)
+            conn.send((None, matchers[key].matches(text)))
+        except Exception as e:  # sent back to the search that caused it, rather than ending the worker
+            conn.send((e, None))
+
+
+class _RegexWorker:
+    """One worker process, and the pipe to it. It runs one search at a time; the blocking pipe calls happen in the
+    event loop's executor."""
+
+    def __init__(self):
+        context = multiprocessing.get_context("spawn")
+        self._conn, child = context.Pipe()
+        self._process = context.Process(target=_worker_main, args=(child,), daemon=True)
+        self._process.start()
+        child.close()
+        self._known = OrderedDict()  # keys of the matchers the worker holds
+        self.ready = asyncio.get_event_loop().run_in_executor(None, self._receive)
+
+    def _receive(self):
+        try:
+            return self._conn.recv()
+        except (EOFError, OSError):
+            raise RegexPoolReset() from None
+
+    def _request(self, message):
+        try:
+            self._conn.send(message)
+        except OSError:
+            raise RegexPoolReset() from None
+        return self._receive()
+
+    async def search(self, key, patterns: typing.Tuple[typing.Tuple[int, str], ...], text: str) -> typing.List[int]:
+        """IDs of the (filter_id, pattern) pairs matching text; the patterns only cross the pipe if the worker hasn't
+        seen key yet"""
+        message = (key, None if _remember(self._known, key) else patterns, text)
+        error, result = await asyncio.get_event_loop().run_in_executor(None, self._request, message)
+        if error is not None:
+            self._known.pop(key, None)  # the worker may not have kept a matcher for it
+            raise error
+        return result
+
+    def stop(self):
+        """Terminate the process, failing the search it was running"""
+        self._process.terminate()
+        # a worker stopped before anything waited for it to start fails to start, which nothing needs to hear about
+        self.ready.add_done_callback(lambda ready: ready.cancelled() or ready.exception())
+        # joining waits for the process to exit, which shouldn't hold up the event loop
+        asyncio.get_event_loop().run_in_executor(None, self._process.join)
+
+
+class RegexPool:
+    """Searches text with regex filters in worker processes, each search limited to timeout seconds. A search waits
+    for an idle worker and is timed from when it gets one, so the timeout covers only the search itself. A search
+    can't be interrupted inside the bot's own process, so when one overruns, the worker running it is terminated and
+    replaced; the other workers and their searches carry on.
+
+    Searches name their patterns with a key, which must change whenever the patterns do, so that each worker is only
+    sent a set of patterns the first time it searches with them.
+    """
+
+    def __init__(self, workers: int, timeout: float):
+        self.workers = workers
+        self.timeout = timeout
+        self._idle = None  # workers not running a search, started on first use
+        self._free_workers = None  # semaphore counting them, created inside the event loop it belongs to
+        self._running = set()
+
+    def _spawn(self) -> _RegexWorker:
+        worker = _RegexWorker()
+        self._running.add(worker)
+        return worker
+
+    async def run(self, key, patterns: typing.Tuple[typing.Tuple[int, str], ...], text: str) -> typing.List[int]:
+        """IDs of the (filter_id, pattern) pairs matching text. Raises asyncio.TimeoutError if the search overran,
+        or RegexPoolReset if the pool was closed."""
+        if self._idle is None:
+            self._idle = deque(self._spawn() for _ in range(self.workers))
+            self._free_workers = asyncio.Semaphore(self.workers)
+        idle = self._idle
+        async with self._free_workers:
+            worker = idle.popleft()
+            try:
+                await asyncio.shield(worker.ready)
+                return await asyncio.wait_for(worker.search(key, patterns, text), self.timeout)
+            except (asyncio.TimeoutError, RegexPoolReset):  # overran, or the process died
+                self._running.discard(worker)
+                worker.stop()
+                if self._idle is idle:
+                    worker = self._spawn()
+                raise
+            finally:
+                idle.append(worker)
+
+    def close(self):
+        """Terminate the workers for good, failing whatever they were running"""
+        running, self._running, self._idle = self._running, set(), None
+        for worker in running:
+            worker.stop()
+
+
+class FilterSnapshot:
+    """Everything needed to check one guild's messages: its compiled filters, whitelisted role IDs and settings.
+    A snapshot is never changed once built; when any of them changes, the guild's whole snapshot is replaced, so a
+    message is always checked against one consistent state.
+    """
+    __slots__ = ("matcher", "whitelist", "settings")
+
+    def __init__(self, filters: list, whitelist: list, settings: list):
+        self.matcher = FilterMatcher({wordfilter.filter_id: wordfilter.pattern for wordfilter in filters})
+        self.whitelist = frozenset(entry.role_id for entry in whitelist)
+        self.settings = MappingProxyType({setting.setting_type: setting.value for setting in settings})
+
+    @property
+    def dm(self) -> bool:
+        """Whether filter lists are sent by DM rather than in the channel"""
+        return self.settings.get("dm", "1") == "1"
+
+    def exempts(self, role_ids: typing.AbstractSet[int]) -> bool:
+        """Whether any of a member's role IDs is whitelisted"""
+        return not self.whitelist.isdisjoint(role_ids)
+
+
+_EMPTY_SNAPSHOT = FilterSnapshot([], [], [])
+
 
 class Filter(Cog):
-    """The filters need to be compiled each time they're run, but we don't want to compile every filter
-    Every time it's run, or all of them at once when the bot starts. So the first time that filter is run,
-    the compiled object is placed in here. This dict is actually a dict full of dicts, with each parent dict's key
-    being the guild ID for easy accessing.
+    """Every guild's filter state is loaded into a FilterSnapshot when the bot starts, and rebuilt whenever a filter
+    command or another instance changes it, so checking a message never waits on the database.
     """
-    filter_dict = {}
 
     def __init__(self, bot: commands.Bot):
         super().__init__(bot)
-        self.word_filter_setting = db.ConfigCache(WordFilterSetting)
-        self.word_filter_role_whitelist = db.ConfigCache(WordFilterRoleWhitelist)
+        self.snapshots = {}  # dct[guild_id] = FilterSnapshot(...), only for guilds with any filter state
+        self._generations = {}  # dct[guild_id] = number of the latest rebuild of that guild's snapshot
+        self.loaded = False  # whether preload_snapshots has read every guild's state
+        self._loaded_guilds = set()  # guilds whose snapshot was read on its own before that
+        self._guild_loads = {}  # dct[guild_id] = task reading that guild's snapshot before preloading is done
+        for table in (WordFilter, WordFilterSetting, WordFilterRoleWhitelist):
+            table.add_change_listener(self.on_filters_change)
+        filter_config = bot.config['filter']
+        self.regex_pool = RegexPool(filter_config['regex_workers'], filter_config['regex_timeout_ms'] / 1000)
+        self._investigating = set()  # (guild_id, matcher key) of filters being timed one by one
+        bot.loop.create_task(self.preload_snapshots())
+        bot.add_message_hook(self.filter_message, FILTER_HOOK_ORDER, gate=True)
+
+    def cog_unload(self):
+        """Stop checking messages, listening for filter changes from other instances and running the regex workers as
+        the cog is unloaded."""
+        self.bot.remove_message_hook(self.filter_message)
+        for table in (WordFilter, WordFilterSetting, WordFilterRoleWhitelist):
+            table.remove_change_listener(self.on_filters_change)
+        self.regex_pool.close()
 
     """Helper Functions"""
 
-    async def check_dm_filter(self, ctx: DozerContext, embed: discord.Embed):
-        """Send an embed, if the setting in the DB allows for it"""
-        results = await WordFilterSetting.get_by(guild_id=ctx.guild.id, setting_type="dm")
-        if results:
-            result = results[0].value
-        else:
-            result = "1"
+    async def snapshot(self, guild_id: int) -> FilterSnapshot:
+        """The guild's current filter state. Until every guild's state is preloaded, a guild's is read on its own the
+        first time it is needed, so messages are never checked against filters that just haven't loaded yet."""
+        if not self.loaded and guild_id not in self._loaded_guilds:
+            load = self._guild_loads.get(guild_id)
+            if load is None:
+                load = self._guild_loads[guild_id] = self.bot.loop.create_task(self.refresh(guild_id))
+                load.add_done_callback(lambda _: self._guild_loads.pop(guild_id, None))
+            await asyncio.shield(load)
+        return self.snapshots.get(guild_id, _EMPTY_SNAPSHOT)
 
-        if result == "1":
+    async def check_dm_filter(self, ctx: DozerContext, embed: discord.Embed):
+        """Send an embed, if the guild's settings allow for it"""
+        if (await self.snapshot(ctx.guild.id)).dm:
             await ctx.author.send(embed=embed)
             await ctx.message.add_reaction("📬")
         else:
             await ctx.send(embed=embed)
 
-    async def load_filters(self, guild_id: int):
-        """Load all filters for a selected guild """
-        results = await WordFilter.get_by(guild_id=guild_id, enabled=True)
-        self.filter_dict[guild_id] = {}
-        for wordfilter in results:
-            self.filter_dict[guild_id][wordfilter.filter_id] = re.compile(wordfilter.pattern, re.IGNORECASE)
-
-    async def check_filters_messages(self, message: discord.Message):
-        """Check all the filters for a certain message (with it's guild)"""
-        if message.author.id == self.bot.user.id or not hasattr(message.author, 'roles'):
+    async def find_matches(self, guild: discord.Guild, filters: FilterMatcher, text: str) -> typing.List[int]:
+        """IDs of the filters matching text, in ascending order. Regex filters are searched in the worker pool; if that
+        overruns its time budget, the text is let through and the patterns responsible are tracked down."""
+        found = filters.literal_matches(text)
+        # while a guild's filters are being timed one by one, its regex filters are skipped rather than allowed to
+        # overrun on every message
+        if filters.regex_patterns and (guild.id, filters.key) not in self._investigating:
+            try:
+                found.update(await self.regex_pool.run(filters.key, filters.regex_patterns, text))
+            except RegexPoolReset:
+                pass  # the cog is being unloaded
+            except asyncio.TimeoutError:
+                DOZER_LOGGER.warning(f"Filters for guild {guild.id} took longer than "
+                                     f"{self.regex_pool.timeout * 1000:.0f}ms to check {len(text)} characters")
+                self._investigating.add((guild.id, filters.key))
+                self.bot.loop.create_task(self.quarantine_runaways(guild, filters, text))
+        return sorted(found)
+
+    async def quarantine_runaways(self, guild: discord.Guild, filters: FilterMatcher, text: str):
+        """Time each of a guild's regex filters against text that overran the budget, and disable the ones that
+        overrun on their own. They run in a single-worker pool of their own, so the guild's other messages and other
+        guilds' searches don't wait on them; the caller marks the guild as under investigation until this is done."""
+        probe = RegexPool(1, self.regex_pool.timeout)
+        runaways = []
+        try:
+            for filter_id, pattern in filters.regex_patterns:
+                try:
+                    await probe.run(filter_id, ((filter_id, pattern),), text)
+                except asyncio.TimeoutError:
+                    runaways.append((filter_id, pattern))
+        finally:
+            probe.close()
+            self._investigating.discard((guild.id, filters.key))
+        if not runaways:
+            DOZER_LOGGER.warning(f"No single filter for guild {guild.id} overran on its own; leaving them enabled")
             return
-
-        roles = await self.word_filter_role_whitelist.query_all(guild_id=message.guild.id)
-        whitelisted_ids = set(role.role_id for role in roles)
-        if any(x.id in whitelisted_ids for x in message.author.roles):
+        for filter_id, _ in runaways:
+            for result in await WordFilter.get_by(filter_id=filter_id):
+                result.enabled = False
+                await result.update_or_add()
+        await self.refresh(guild.id)
+        DOZER_LOGGER.warning(f"Disabled runaway filters {[filter_id for filter_id, _ in runaways]} for guild {guild.id}")
+        await self.report_quarantine(guild, runaways)
+
+    async def report_quarantine(self, guild: discord.Guild, runaways: typing.List[typing.Tuple[int, str]]):
+        """Tell a guild's mod log which of its filters were disabled for being too slow"""
+        modlog = await modlog_config.query_one(guild.id)
+        channel = guild.get_channel(modlog.modlog_channel) if modlog is not None and modlog.modlog_channel else None
+        if channel is None:
             return
+        embed = discord.Embed(title="Filters disabled", color=discord.Color.red())
+        embed.description = f"These filters took longer than {self.regex_pool.timeout * 1000:.0f}ms to check a " \
+                            f"message, so they have been disabled to keep the bot responsive. Use `filter edit` " \
+                            f"to give them a simpler pattern, which also re-enables them."
+        for filter_id, pattern in runaways[:25]:
+            embed.add_field(name=f"ID {filter_id}", value=f"`{pattern[:1000]}`", inline=False)
         try:
-            filters = self.filter_dict[message.guild.id]
-        except KeyError:
-            await self.load_filters(message.guild.id)
-            filters = self.filter_dict[message.guild.id]
+            await channel.send(embed=embed)
+        except discord.HTTPException:
+            DOZER_LOGGER.warning(f"Couldn't report disabled filters to the mod log of guild {guild.id}")
+
+    async def preload_snapshots(self):
+        """Build every guild's snapshot, with one read of each table, retrying until the read succeeds"""
+        await self.bot.wait_until_ready()
+        delay = 1
+        while True:
+            try:
+                await self._load_snapshots()
+                return
+            except Exception as e:
+                DOZER_LOGGER.error(f"Failed to load filter state, retrying in {delay}s; Reason: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    async def _load_snapshots(self):
+        generations = dict(self._generations)
+        filters, whitelists, settings = await asyncio.gather(
+            WordFilter.get_by(enabled=True), WordFilterRoleWhitelist.get_by(), WordFilterSetting.get_by())
+        by_guild = {}
+        for index, rows in enumerate((filters, whitelists, settings)):
+            for row in rows:
+                by_guild.setdefault(row.guild_id, ([], [], []))[index].append(row)
+        snapshots = {guild_id: FilterSnapshot(*rows) for guild_id, rows in by_guild.items()}
+        for guild_id, generation in self._generations.items():
+            if generations.get(guild_id) != generation:  # rebuilt while this was loading; that rebuild is newer
+                snapshots[guild_id] = self.snapshots.get(guild_id, _EMPTY_SNAPSHOT)
+        self.snapshots = snapshots
+        self.loaded = True
+        DOZER_LOGGER.info(f"Loaded filter state for {len(snapshots)} guilds")
+
+    async def refresh(self, guild_id: int):
+        """Rebuild a guild's snapshot from the database and swap it in. When rebuilds overlap, the last one started
+        wins, so a slow read can't put back state that a later change replaced."""
+        generation = self._generations[guild_id] = self._generations.get(guild_id, 0) + 1
+        filters, whitelist, settings = await asyncio.gather(
+            WordFilter.get_by(guild_id=guild_id, enabled=True), WordFilterRoleWhitelist.get_by(guild_id=guild_id),
+            WordFilterSetting.get_by(guild_id=guild_id))
+        if self._generations[guild_id] != generation:
+            return
+        self._loaded_guilds.add(guild_id)
+        if filters or whitelist or settings:
+            self.snapshots[guild_id] = FilterSnapshot(filters, whitelist, settings)
+        else:
+            self.snapshots.pop(guild_id, None)
+
+    def on_filters_change(self, columns: dict):
+        """Rebuild the snapshot of a guild whose filter state another instance changed"""
+        guild_id = columns.get("guild_id")
+        if guild_id is None:
+            self.bot.loop.create_task(self.preload_snapshots())
+        else:
+            self.bot.loop.create_task(self.refresh(guild_id))
+
+    async def check_filters_messages(self, message: discord.Message, role_ids: typing.AbstractSet[int] = None) -> bool:
+        """Check all the filters for a certain message (with it's guild), returning whether it was deleted. role_ids
+        are the author's role IDs, if the caller already has them."""
+        if message.author.id == self.bot.user.id or not hasattr(message.author, 'roles'):
+            return False
+        snapshot = await self.snapshot(message.guild.id)
+        if not snapshot.matcher:
+            return False
+        if snapshot.exempts({role.id for role in message.author.roles} if role_ids is None else role_ids):
+            return False
         deleted = False
-        for wordid, wordfilter in filters.items():
-            if wordfilter.search(message.content) is not None:
-                await message.channel.send(f"{message.author.mention}, Banned word detected!", delete_after=5.0)
-                if not deleted:
-                    await message.delete()
-                    deleted = True
+        for _ in await self.find_matches(message.guild, snapshot.matcher, message.content):
+            await message.channel.send(f"{message.author.mention}, Banned word detected!", delete_after=5.0)
+            if not deleted:
+                await message.delete()
+                deleted = True
+        return deleted
 
     async def check_filters_nicknames(self, member_before: discord.Member, member_after: discord.Member):
         """Check all filters for a members nickname change"""
-        if member_after.id == self.bot.user.id or not hasattr(member_after, 'roles'):
-            return
-        roles = await self.word_filter_role_whitelist.query_all(guild_id=member_after.guild.id)
-        whitelisted_ids = set(role.role_id for role in roles)
-        if any(x.id in whitelisted_ids for x in member_after.roles):
+        if member_after.id == self.bot.user.id or not hasattr(member_after, 'roles') or member_after.nick is None:
             return
-        try:
-            filters = self.filter_dict[member_after.guild.id]
-        except KeyError:
-            await self.load_filters(member_after.guild.id)
-            filters = self.filter_dict[member_after.guild.id]
-        reverted = False
-        if member_after.nick is None:
+        snapshot = await self.snapshot(member_after.guild.id)
+        if not snapshot.matcher or snapshot.exempts({role.id for role in member_after.roles}):
             return
-        for wordid, wordfilter in filters.items():
-            if wordfilter.search(member_after.nick) is not None:
-                if not reverted:
-                    try:
-                        await member_after.edit(nick=member_before.nick)
-                        await member_after.send(f"{member_after.mention}, your nickname in **{member_after.guild}** "
-                                                f"contained a banned word and has been reset to your previous nickname")
-                    except discord.Forbidden:
-                        await member_after.send(f"{member_after.mention}, your nickname in **{member_after.guild}** "
-                                                f"contains a banned word but because your permissions outrank dozer "
-                                                f"it was not reset")
-                    reverted = True
+        if await self.find_matches(member_after.guild, snapshot.matcher, member_after.nick):
+            try:
+                await member_after.edit(nick=member_before.nick)
+                await member_after.send(f"{member_after.mention}, your nickname in **{member_after.guild}** "
+                                        f"contained a banned word and has been reset to your previous nickname")
+            except discord.Forbidden:
+                await member_after.send(f"{member_after.mention}, your nickname in **{member_after.guild}** "
+                                        f"contains a banned word but because your permissions outrank dozer "
+                                        f"it was not reset")
 
     """Event Handlers"""
 
-    @Cog.listener('on_message')
-    async def on_message(self, message: discord.Message):
-        """Send the message handler out"""
-        await self.check_filters_messages(message)
+    async def filter_message(self, context: MessageContext):
+        """Message hook: check each new message against the filters, before any other hook sees it"""
+        if await self.check_filters_messages(context.message, context.role_ids):
+            context.deleted = True
 
     @Cog.listener('on_message_edit')
     async def on_message_edit(self, _: discord.Message, after: discord.Message):
@@ -162,6 +739,10 @@ class Filter(Cog):
         except re.error as err:
             await ctx.send("Invalid RegEx! ```{}```".format(err.msg))
             return
+        risk = exponential_risk(pattern)
+        if risk:
+            await ctx.send(f"That pattern could take exponentially long to check, because {risk}. Please simplify it.")
+            return
         new_filter = WordFilter(guild_id=ctx.guild.id, pattern=pattern, friendly_name=friendly_name or pattern)
         await new_filter.update_or_add()
         embed = discord.Embed()
@@ -169,7 +750,7 @@ class Filter(Cog):
         embed.description = "A new filter with the name `{}` was added.".format(friendly_name or pattern)
         embed.add_field(name="Pattern", value="`{}`".format(pattern))
         await ctx.send(embed=embed)
-        await self.load_filters(ctx.guild.id)
+        await self.refresh(ctx.guild.id)
 
     add.example_usage = "`{prefix}filter add Swear` - Makes it so that \"Swear\" will be filtered"
 
@@ -183,6 +764,10 @@ class Filter(Cog):
         except re.error as err:
             await ctx.send("Invalid RegEx! ```{}```".format(err.msg))
             return
+        risk = exponential_risk(pattern)
+        if risk:
+            await ctx.send(f"That pattern could take exponentially long to check, because {risk}. Please simplify it.")
+            return
         results = await WordFilter.get_by(guild_id=ctx.guild.id)
         found = False
         result = None
@@ -200,7 +785,7 @@ class Filter(Cog):
             enabled_change = True
         result.pattern = pattern
         await result.update_or_add()
-        await self.load_filters(ctx.guild.id)
+        await self.refresh(ctx.guild.id)
         embed = discord.Embed(title="Updated filter {}".format(result.friendly_name or result.pattern))
         embed.description = "Filter ID {} has been updated.".format(result.filter_id)
         embed.add_field(name="Old Pattern", value=old_pattern)
@@ -230,7 +815,7 @@ class Filter(Cog):
         result.enabled = False
         await result.update_or_add()
         await ctx.send("Filter with name `{}` deleted.".format(result.friendly_name))
-        await self.load_filters(ctx.guild.id)
+        await self.refresh(ctx.guild.id)
 
     remove.example_usage = "`{prefix}filter remove 7` - Disables filter with ID 7"
 
@@ -250,7 +835,7 @@ class Filter(Cog):
             before_setting = None
         result = WordFilterSetting(guild_id=ctx.guild.id, setting_type="dm", value=config)
         await result.update_or_add()
-        self.word_filter_setting.invalidate_entry(guild_id=ctx.guild.id, setting_type="dm")
+        await self.refresh(ctx.guild.id)
         await ctx.send(
             "The DM setting for this guild has been changed from {} to {}.".format(before_setting == "1",
                                                                                    result.value == "1"))
@@ -285,7 +870,7 @@ class Filter(Cog):
             return
         whitelist_entry = WordFilterRoleWhitelist(role_id=role.id, guild_id=ctx.guild.id)
         await whitelist_entry.update_or_add()
-        self.word_filter_role_whitelist.invalidate_entry(guild_id=ctx.guild.id)
+        await self.refresh(ctx.guild.id)
         await ctx.send("Whitelisted `{}` for this guild.".format(role.name))
 
     whitelist_add.example_usage = "`{prefix}filter whitelist add Moderators` - Makes it so that Moderators will not be caught by the filter."
@@ -299,8 +884,8 @@ class Filter(Cog):
         if len(result) == 0:
             await ctx.send("That role is not whitelisted.")
             return
-        await WordFilterRoleWhitelist.delete(role_id=role.id)
-        self.word_filter_role_whitelist.invalidate_entry(guild_id=ctx.guild.id)
+        await WordFilterRoleWhitelist.delete(guild_id=ctx.guild.id, role_id=role.id)
+        await self.refresh(ctx.guild.id)
         await ctx.send("The role `{}` is no longer whitelisted.".format(role.name))
 
     whitelist_remove.example_usage = "`{prefix}filter whitelist remove Admins` - Makes it so that Admins are caught by the filter again."
@@ -318,20 +903,13 @@ def setup(bot):
 class WordFilter(db.DatabaseTable):
     """Object for each filter"""
     __tablename__ = 'word_filters'
-    __uniques__ = ['filter_id']
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            filter_id serial PRIMARY KEY NOT NULL,
-            enabled boolean default true NOT NULL,
-            guild_id bigint NOT NULL,
-            friendly_name varchar null,
-            pattern varchar NOT NULL
-            )""")
+    __columns__ = (
+        db.Column("filter_id", "serial", primary_key=True),
+        db.Column("enabled", "boolean", default="true"),
+        db.Column("guild_id", "bigint"),
+        db.Column("friendly_name", "varchar", nullable=True),
+        db.Column("pattern", "varchar"),
+    )
 
     def __init__(self, guild_id: int, friendly_name: str, pattern: str, enabled: bool = True, filter_id: int = None):
         super().__init__()
@@ -341,34 +919,16 @@ class WordFilter(db.DatabaseTable):
         self.friendly_name = friendly_name
         self.pattern = pattern
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = WordFilter(guild_id=result.get("guild_id"), friendly_name=result.get("friendly_name"),
-                             pattern=result.get("pattern"), enabled=result.get("enabled"),
-                             filter_id=result.get("filter_id"))
-            result_list.append(obj)
-        return result_list
-
 
 class WordFilterSetting(db.DatabaseTable):
     """Each filter-related setting"""
     __tablename__ = 'word_filter_settings'
-    __uniques__ = ['id']
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            id serial PRIMARY KEY NOT NULL,
-            setting_type varchar NOT NULL,
-            guild_id bigint NOT NULL,
-            value varchar NOT NULL
-            )""")
+    __columns__ = (
+        db.Column("id", "serial", primary_key=True),
+        db.Column("setting_type", "varchar"),
+        db.Column("guild_id", "bigint"),
+        db.Column("value", "varchar"),
+    )
 
     def __init__(self, guild_id: int, setting_type: str, value: str):
         super().__init__()
@@ -376,42 +936,16 @@ class WordFilterSetting(db.DatabaseTable):
         self.setting_type = setting_type
         self.value = value
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = WordFilterSetting(guild_id=result.get("guild_id"), setting_type=result.get("setting_type"),
-                                    value=result.get('value'))
-            result_list.append(obj)
-        return result_list
-
 
 class WordFilterRoleWhitelist(db.DatabaseTable):
     """Object for each whitelisted role"""
     __tablename__ = 'word_filter_role_whitelist'
-    __uniques__ = ['role_id']
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            guild_id bigint NOT NULL,
-            role_id bigint PRIMARY KEY NOT NULL 
-            )""")
+    __columns__ = (
+        db.Column("guild_id", "bigint"),
+        db.Column("role_id", "bigint", primary_key=True),
+    )
 
     def __init__(self, guild_id: int, role_id: int):
         super().__init__()
         self.role_id = role_id
         self.guild_id = guild_id
-
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = WordFilterRoleWhitelist(guild_id=result.get("guild_id"), role_id=result.get("role_id"))
-            result_list.append(obj)
-        return result_list
@@ -1,15 +1,18 @@
 """Records members' XP and level."""
 
 import asyncio
-import functools
-
-
+import bisect
 import itertools
+import json
 import logging
 import math
+import os
 import random
+import sys
+import time
 import typing
-from datetime import timedelta, timezone, datetime
+from collections import OrderedDict
+from datetime import date, timedelta, timezone, datetime
 
 import aiohttp
 import discord
@@ -18,8 +21,9 @@ from discord.ext.commands import guild_only, has_permissions, BadArgument
 from discord.ext.tasks import loop
 from discord_slash import cog_ext, SlashContext
 
-from dozer.bot import Dozer
-from dozer.context import DozerContext
+from dozer.bot import Dozer, LEVELS_HOOK_ORDER
+from dozer.context import DozerContext, MessageContext
+from ..Components.XPJournal import XPJournal, XPJournalCheckpoint
 from ._utils import *
 
 blurple = discord.Color.blurple()
@@ -28,57 +32,115 @@ from .. import db
 DOZER_LOGGER = logging.getLogger(__name__)
 
 ADD_LIMIT = 2147483647
-LEVEL_SET_LIMIT = 100000
-LEVEL_CALC_LIMIT = 1000000
+MAX_TOTAL_XP = 2 ** 63 - 1  # total_xp is a bigint column
+MESSAGE_LIMIT = 2000  # characters in one Discord message
+LEADERBOARD_WINDOWS = {"week": 7, "month": 30}  # days of earned XP each windowed leaderboard covers
+DAILY_RETENTION_DAYS = 40  # days of per-day XP kept before being merged into months; must cover the longest window
+
+
+def _integer_cbrt(n: int) -> int:
+    """The largest integer whose cube is at most n, for any non-negative n"""
+    if n < 2:
+        return n
+    root = 1 << -(-n.bit_length() // 3)  # a power of two at least as large as the cube root
+    while True:
+        smaller = (2 * root + n // (root * root)) // 3
+        if smaller >= root:
+            return root
+        root = smaller
 
 
 class Levels(Cog):
     """Commands and event handlers for managing levels and XP."""
 
-    cache_size = 750
-
     def __init__(self, bot: Dozer):
         super().__init__(bot)
         self._loop = bot.loop
         self.guild_settings = {}
         self._level_roles = {}
-        self._xp_cache = {}  # dct[(guild_id, user_id)] = MemberXPCache(...)
+        self._level_thresholds = {}  # dct[guild_id] = LevelRoleThresholds(...) built from self._level_roles
+        self._role_edits = set()  # (guild_id, user_id) of members whose level roles are being edited
+        self._level_ups = {}  # dct[channel] = {user_id: (mention, level)} waiting to be announced there
+        self._daily_xp = {}  # dct[(guild_id, user_id, day)] = XP earned from messages that day and not yet synced
+        # dct[segment] = {(guild_id, user_id, day): XP} replayed from the journal, which a crash may have left behind
+        # after the database got it; the journal checkpoint tells which
+        self._replayed_daily = {}
+        self._xp_cache = OrderedDict()  # dct[(guild_id, user_id)] = MemberXPCache(...), least recently used first
+        self._pending_loads = {}  # dct[(guild_id, user_id)] = future of a cache miss waiting for the next batch load
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+        # dct[guild_id] = RankIndex(...), built the first time a guild's ranks are needed, least recently used first
+        self._rank_indexes = OrderedDict()
+        self._rank_index_builds = {}  # dct[guild_id] = task building that guild's RankIndex
+        levels_config = bot.config['levels']
+        self.flush_size = levels_config['flush_size']
+        self.flush_interval = levels_config['flush_interval']
+        self.notification_window = levels_config['notification_window']
+        self.cache_max_entries = levels_config['cache_max_entries']
+        mee6_config = levels_config['mee6_import']
+        self.mee6_concurrency = mee6_config['concurrency']
+        # Shared by every import, so running several at once can't exceed the rate Mee6 tolerates
+        self._mee6_bucket = TokenBucket(mee6_config['requests_per_second'], mee6_config['burst'])
+        self._journal = XPJournal(levels_config['journal_path'], self._loop)
+        replayed, self._replayed_daily = self._journal.replay()
+        self._xp_cache.update((key, MemberXPCache(*entry, dirty=True)) for key, entry in replayed.items())
+        if self._xp_cache:
+            DOZER_LOGGER.info(f"Replayed {len(self._xp_cache)} unsynced XP record(s) from the journal")
+        self._sync_lock = asyncio.Lock()
+        GuildXPSettings.add_change_listener(self.on_guild_settings_change)
+        XPRole.add_change_listener(self.on_level_roles_change)
         self._loop.create_task(self.preload_cache())
         self.session = aiohttp.ClientSession(loop=bot.loop)
         self.sync_task.start()
+        self.compact_task.start()
+        bot.add_message_hook(self.give_message_xp, LEVELS_HOOK_ORDER)
+
+    # https://github.com/Mee6/Mee6-documentation/blob/9d98a8fe8ab494fd85ec27750592fc9f8ef82472/docs/levels_xp.md
+    # > The formula to calculate how many xp you need for the next level is 5 * (lvl ^ 2) + 50 * lvl + 100 with
+    # > your current level as lvl
+    # Summing that over every level below L gives the total in closed form:
+    #   5 * (L - 1) * L * (2L - 1) / 6 + 25 * L * (L - 1) + 100 * L
+    # (L - 1) * L * (2L - 1) is always divisible by 6, so integer arithmetic keeps it exact for any level.
 
     @staticmethod
-    @functools.lru_cache(cache_size)
-    def total_xp_for_level(level: int):
+    def total_xp_for_level(level: int) -> int:
         """Compute the total XP required to reach the given level.
         All members at this level have at least this much XP.
         """
-        # https://github.com/Mee6/Mee6-documentation/blob/9d98a8fe8ab494fd85ec27750592fc9f8ef82472/docs/levels_xp.md
-        # > The formula to calculate how many xp you need for the next level is 5 * (lvl ^ 2) + 50 * lvl + 100 with
-        # > your current level as lvl
-        if level >= LEVEL_CALC_LIMIT:  # If the level gets too big, dozer will hang trying to calculate the level. A better way needs to
-            DOZER_LOGGER.critical(
-                "Member XP exceeded maximum calculation limit")  # be found to calculate level's but this is the best for now
-            return LEVEL_CALC_LIMIT
-        needed = 0
-        for lvl in range(level):
-            needed += 5 * (lvl ** 2) + 50 * lvl + 100
-        return needed
+        if level <= 0:
+            return 0
+        return 5 * (level - 1) * level * (2 * level - 1) // 6 + 25 * level * (level - 1) + 100 * level
 
     @staticmethod
-    @functools.lru_cache(cache_size)
-    def level_for_total_xp(xp: int):
+    def level_for_total_xp(xp: int) -> int:
         """Compute the level of a member with the given amount of total XP.
         All members with this much XP are at or above this level.
         """
-        # https://github.com/Mee6/Mee6-documentation/blob/9d98a8fe8ab494fd85ec27750592fc9f8ef82472/docs/levels_xp.md
-        # > The formula to calculate how many xp you need for the next level is 5 * (lvl ^ 2) + 50 * lvl + 100 with
-        # > your current level as lvl
-        lvl = 0
-        while xp >= 0 and lvl <= LEVEL_CALC_LIMIT:  # The same limitation is applied here
-            xp -= 5 * lvl ** 2 + 50 * lvl + 100
-            lvl += 1
-        return lvl - 1
+        if xp < 0:
+            return -1
+        # The cubic term dominates, so cbrt(3 * xp / 5) is an upper bound that's at most a few levels off
+        level = _integer_cbrt(3 * xp // 5) + 1
+        while Levels.total_xp_for_level(level) > xp:
+            level -= 1
+        while Levels.total_xp_for_level(level + 1) <= xp:
+            level += 1
+        return level
+
+    @staticmethod
+    def levels_for_total_xp(xps: typing.Sequence[int]) -> typing.List[int]:
+        """level_for_total_xp for many XP values at once, such as a page of the leaderboard.
+        Members on one page tend to share a handful of levels, so the level thresholds spanning the page are computed
+        once and each member is placed among them with a binary search."""
+        if not xps:
+            return []
+        low = Levels.level_for_total_xp(min(xps))
+        high = Levels.level_for_total_xp(max(xps))
+        if high - low > len(xps):
+            return [Levels.level_for_total_xp(xp) for xp in xps]
+        # thresholds[i] is the total XP needed for level low + i + 1
+        thresholds = [Levels.total_xp_for_level(level) for level in range(low + 1, high + 1)]
+        return [low + bisect.bisect_right(thresholds, xp) for xp in xps]
 
     async def preload_cache(self):
         """Load all guild settings from the database."""
@@ -106,47 +168,65 @@ class Levels(Cog):
                 self._level_roles[role.guild_id].append(role)
             else:
                 self._level_roles[role.guild_id] = [role]
+        self._level_thresholds = {guild_id: LevelRoleThresholds(roles) for guild_id, roles in self._level_roles.items()}
 
-    async def check_new_roles(self, guild: discord.Guild, member: discord.Member, cached_member, guild_settings):
-        """Check and see if a member has qualified to get a new role"""
-        current_level = self.level_for_total_xp(cached_member.total_xp)
-        unsorted = self._level_roles.get(guild.id)
+    async def on_guild_settings_change(self, columns: dict):
+        """Reload the settings of a guild whose settings another instance changed"""
+        guild_id = columns.get("guild_id")
+        if guild_id is None:
+            await self.update_server_settings_cache()
+            return
+        records = await GuildXPSettings.get_by(guild_id=guild_id)
+        if records:
+            self.guild_settings[guild_id] = records[0]
+        else:
+            self.guild_settings.pop(guild_id, None)
 
-        if unsorted:
-            roles = sorted(unsorted, key=lambda entry: entry.level)
-            add_roles = []
-            del_roles = []
-            # Find roles that the member hasn't earned yet
-            to_undo = [level_role for level_role in roles if level_role.level > current_level]
-            # Find all roles that the member has earned
-            to_do = [level_role for level_role in roles if level_role.level <= current_level]
-            # Determine if we should add all roles or just top role
-            to_add = to_do if guild_settings.keep_old_roles or not len(to_do) else [to_do[-1]]
-
-            for level_role in to_add:
-                # Go through all roles that should be added and see if the member already has those roles
-                add_role = guild.get_role(level_role.role_id)
-                if add_role not in member.roles:
-                    add_roles.append(add_role)
-
-            if not guild_settings.keep_old_roles:  # Check if a guild wants all old roles removed
-                for level_role in to_do[:-1]:
-                    # Go through all roles that should be removed and make sure the member already has those roles
-                    del_role = guild.get_role(level_role.role_id)
-                    if del_role in member.roles:
-                        del_roles.append(del_role)
-
-            for level_role in to_undo:
-                # Go through all roles the member shouldn't have, and make sure they don't have them
-                del_role = guild.get_role(level_role.role_id)
-                if del_role in member.roles:
-                    del_roles.append(del_role)
-
-            try:
+    async def on_level_roles_change(self, columns: dict):
+        """Reload the level roles of a guild whose level roles another instance changed"""
+        guild_id = columns.get("guild_id")
+        if guild_id is None:  # e.g. removerolelevel deletes by role ID alone
+            await self.update_level_role_cache()
+            return
+        level_roles = await XPRole.get_by(guild_id=guild_id)
+        if level_roles:
+            self._level_roles[guild_id] = level_roles
+            self._level_thresholds[guild_id] = LevelRoleThresholds(level_roles)
+        else:
+            self._level_roles.pop(guild_id, None)
+            self._level_thresholds.pop(guild_id, None)
+
+    async def check_new_roles(self, guild: discord.Guild, member: discord.Member, cached_member, guild_settings,
+                              role_ids: typing.AbstractSet[int]):
+        """Check and see if a member's level roles match their level, and add or remove the ones that don't.
+        role_ids are the IDs of the roles the member has."""
+        thresholds = self._level_thresholds.get(guild.id)
+        if thresholds is None:
+            return
+        wanted = thresholds.wanted(self.level_for_total_xp(cached_member.total_xp), guild_settings.keep_old_roles)
+        held = thresholds.role_ids & role_ids
+        if held == wanted:
+            return
+        # Roles that were deleted from the guild can't be added, so they don't count as drift
+        add_roles = [role for role in map(guild.get_role, wanted - held) if role is not None]
+        if not add_roles and held <= wanted:
+            return
+        key = (guild.id, member.id)
+        if key in self._role_edits:  # member.roles is stale until the edit already in flight is reflected
+            return
+        stale = [role for role in map(guild.get_role, held - wanted) if role is not None]
+        self._role_edits.add(key)
+        try:
+            # Each role is added or removed on its own, rather than the whole role list being replaced, so role changes
+            # made by anyone else while this runs are kept
+            if add_roles:
                 await member.add_roles(*add_roles, reason="Level Up")
-                await member.remove_roles(*del_roles, reason="Level Up")
-            except discord.Forbidden:
-                DOZER_LOGGER.debug(f"Unable to add roles to {member} in guild {guild} Reason: Forbidden")
+            if stale:
+                await member.remove_roles(*stale, reason="Level Up")
+        except discord.Forbidden:
+            DOZER_LOGGER.debug(f"Unable to add roles to {member} in guild {guild} Reason: Forbidden")
+        finally:
+            self._role_edits.discard(key)
 
     async def check_level_up(self, guild: discord.Guild, member: discord.Member, old_xp: int, new_xp: int):
         """Check and see if a member has ranked up, and then send a message if enabled"""
@@ -157,22 +237,127 @@ class Levels(Cog):
             if settings.lvl_up_msgs:
                 channel = guild.get_channel(settings.lvl_up_msgs)
                 if channel:
-                    await channel.send(f"{member.mention}, you have reached level {new_level}!")
+                    self._queue_level_up(channel, member, new_level)
+
+    def _queue_level_up(self, channel: discord.TextChannel, member: discord.Member, level: int):
+        """Buffer a level-up notification; a channel's buffer is sent `notification_window` seconds after it was started"""
+        pending = self._level_ups.get(channel)
+        if pending is None:
+            pending = self._level_ups[channel] = {}
+            self._loop.call_later(self.notification_window, lambda: self._loop.create_task(self._send_level_ups(channel)))
+        pending[member.id] = (member.mention, level)  # a member leveling twice in one window is announced once
+
+    async def _send_level_ups(self, channel: discord.TextChannel):
+        """Send a channel's buffered level-ups in as few messages as fit within Discord's length limit"""
+        pending = self._level_ups.pop(channel, {})
+        content = ""
+        try:
+            for mention, level in pending.values():
+                line = f"{mention}, you have reached level {level}!"
+                if content and len(content) + 1 + len(line) > MESSAGE_LIMIT:
+                    await channel.send(content)
+                    content = ""
+                content = f"{content}\n{line}" if content else line
+            if content:
+                await channel.send(content)
+        except discord.HTTPException as e:
+            DOZER_LOGGER.debug(f"Unable to send level-up notifications to {channel} in guild {channel.guild} Reason: {e}")
 
     async def load_member(self, guild_id: int, member_id: int):
-        """Check to see if a member is in the level cache and if not load from the database"""
-        cached_member = self._xp_cache.get((guild_id, member_id))
-        if cached_member is None:
-            DOZER_LOGGER.debug("Cache miss: guild_id=%d, user_id=%d", guild_id, member_id)
-            records = await MemberXP.get_by(guild_id=guild_id, user_id=member_id)
-            if records:
-                DOZER_LOGGER.debug("Loading from database")
-                cached_member = MemberXPCache.from_record(records[0])
-            else:
-                DOZER_LOGGER.debug("Creating from scratch")
-                cached_member = MemberXPCache(0, datetime.now(tz=timezone.utc), 0, True)
-            self._xp_cache[(guild_id, member_id)] = cached_member
-        return cached_member
+        """Check to see if a member is in the level cache and if not load from the database.
+        Misses from the same tick are loaded together by `_load_pending`."""
+        key = (guild_id, member_id)
+        cached_member = self._xp_cache.get(key)
+        if cached_member is not None:
+            self.cache_hits += 1
+            self._xp_cache.move_to_end(key)
+            return cached_member
+        self.cache_misses += 1
+        future = self._pending_loads.get(key)
+        if future is None:
+            if not self._pending_loads:
+                self._loop.create_task(self._load_pending())
+            future = self._pending_loads[key] = self._loop.create_future()
+        return await asyncio.shield(future)
+
+    async def _load_pending(self):
+        """Load every member that missed the cache since the last batch, one query per guild"""
+        pending, self._pending_loads = self._pending_loads, {}
+        by_guild = {}
+        for guild_id, user_id in pending:
+            by_guild.setdefault(guild_id, []).append(user_id)
+        try:
+            for guild_id, user_ids in by_guild.items():
+                DOZER_LOGGER.debug("Cache miss: guild_id=%d, %d user(s)", guild_id, len(user_ids))
+                records = await db.Pool.fetch(f"SELECT * FROM {MemberXP.__tablename__} "
+                                              f"WHERE guild_id = $1 AND user_id = ANY($2::bigint[]);", guild_id, user_ids)
+                found = {record['user_id']: record for record in records}
+                for user_id in user_ids:
+                    cached_member = self._xp_cache.get((guild_id, user_id))
+                    if cached_member is None:  # nothing else put the member in the cache while the query ran
+                        record = found.get(user_id)
+                        if record:
+                            cached_member = MemberXPCache(record['total_xp'], record['last_given_at'],
+                                                          record['total_messages'], False)
+                        else:
+                            cached_member = MemberXPCache(0, datetime.now(tz=timezone.utc), 0, True)
+                            self._xp_changed(guild_id, user_id, cached_member)
+                        self._xp_cache[(guild_id, user_id)] = cached_member
+                    pending.pop((guild_id, user_id)).set_result(cached_member)
+        except Exception as e:
+            for future in pending.values():
+                future.set_exception(e)
+            raise
+        self._evict_to_budget()
+
+    def _xp_changed(self, guild_id: int, member_id: int, cached_member, day: date = None, gained: int = 0):
+        """Journal a member's changed cache entry, along with any XP they gained from a message on `day`, and keep
+        their guild's rank index (if it has been built) in step"""
+        index = self._rank_indexes.get(guild_id)
+        if index is not None:
+            index.update(member_id, cached_member.total_xp)
+        self._journal.append(guild_id, member_id, cached_member, day, gained)
+        if self._journal.pending >= self.flush_size and not self._sync_lock.locked():
+            self._loop.create_task(self.sync_to_database())
+
+    async def _rank_index(self, guild_id: int) -> "RankIndex":
+        """A guild's rank index, built from the database on first use and rebuilt once it is older than
+        `RankIndex.max_age` to pick up changes made outside this process"""
+        index = self._rank_indexes.get(guild_id)
+        if index is not None and time.monotonic() - index.built_at < RankIndex.max_age:
+            self._rank_indexes.move_to_end(guild_id)
+            return index
+        build = self._rank_index_builds.get(guild_id)
+        if build is None:
+            build = self._rank_index_builds[guild_id] = self._loop.create_task(self._build_rank_index(guild_id))
+            build.add_done_callback(lambda _: self._rank_index_builds.pop(guild_id, None))
+        return await asyncio.shield(build)
+
+    async def _build_rank_index(self, guild_id: int) -> "RankIndex":
+        records = await db.Pool.fetch(f"SELECT user_id, total_xp FROM {MemberXP.__tablename__} WHERE guild_id = $1;",
+                                      guild_id)
+        index = RankIndex((record['user_id'], record['total_xp']) for record in records)
+        # The cache is ahead of the database until the next sync, so its values win
+        for (cached_guild_id, user_id), cached_member in self._xp_cache.items():
+            if cached_guild_id == guild_id:
+                index.update(user_id, cached_member.total_xp)
+        self._rank_indexes[guild_id] = index
+        self._rank_indexes.move_to_end(guild_id)
+        DOZER_LOGGER.debug(f"Built rank index for guild {guild_id} with {len(index)} member(s)")
+        return index
+
+    async def _window_index(self, guild_id: int, days: int) -> "RankIndex":
+        """A rank index of the XP a guild's members earned from messages over the last `days` days, today included"""
+        since = datetime.now(tz=timezone.utc).date() - timedelta(days=days - 1)
+        records = await db.Pool.fetch(f"""
+            SELECT user_id, sum(xp)::bigint AS xp FROM {MemberXPDaily.__tablename__}
+            WHERE guild_id = $1 AND day >= $2 GROUP BY user_id;
+        """, guild_id, since)
+        totals = {record['user_id']: record['xp'] for record in records}
+        for (daily_guild_id, user_id, day), xp in self._daily_xp.items():  # earned since the last sync
+            if daily_guild_id == guild_id and day >= since:
+                totals[user_id] = totals.get(user_id, 0) + xp
+        return RankIndex(totals.items())
 
     async def sync_member(self, guild_id: int, member_id: int):
         """Sync an individual member to the database"""
@@ -187,57 +372,169 @@ class Levels(Cog):
             return False
 
     async def sync_to_database(self):
-        """Sync dirty records to the database, and evict others from the cache."""
-
+        """Write dirty records and the XP earned per day to the database, and drop the journal segments they came from.
+        If the write fails the records stay dirty and the segments stay on disk, so the next sync retries them."""
+        async with self._sync_lock:
+            # Sealing and collecting happen before the first yield point, so every line in the sealed segments is
+            # covered by the values collected here
+            segments = self._journal.seal()
+            daily, self._daily_xp = self._daily_xp, {}
+            to_write = {}  # records to write to the database
+            for (guild_id, user_id), cached_member in self._xp_cache.items():
+                if cached_member.dirty:
+                    to_write[(guild_id, user_id)] = MemberXP(guild_id, user_id, cached_member.total_xp,
+                                                             cached_member.total_messages, cached_member.last_given_at)
+                    cached_member.dirty = False
+            await self._journal.settle()
+
+            if to_write:
+                try:
+                    await MemberXP.bulk_upsert(to_write.values())
+                except Exception as e:
+                    DOZER_LOGGER.error(f"Failed to sync levels cache to db, will retry; Reason:{e}")
+                    for key in to_write:
+                        cached_member = self._xp_cache.get(key)
+                        if cached_member is not None:
+                            cached_member.dirty = True
+                    self._journal.retry_later()
+                    self._restore_daily_xp(daily)
+                    return
+                DOZER_LOGGER.debug(f"Inserted/updated {len(to_write)} record(s)")
+            else:
+                DOZER_LOGGER.debug("Sync task skipped, nothing to do")
+
+            if daily or self._replayed_daily:
+                try:
+                    await self._write_daily_xp(daily, max(segments))
+                except Exception as e:
+                    # the segments also hold the daily XP, so they stay until it is written too
+                    DOZER_LOGGER.error(f"Failed to sync daily XP to db, will retry; Reason:{e}")
+                    self._journal.retry_later()
+                    self._restore_daily_xp(daily)
+                    return
+            self._journal.discard(segments)
+
+    async def _write_daily_xp(self, daily: dict, segment: int):
+        """Add the XP earned per day to the database and move the journal checkpoint up to `segment`, in one transaction.
+        Replayed XP is only added from segments past the checkpoint: the ones at or below it were written by a sync
+        that went through but crashed before deleting them."""
+        journal = os.path.abspath(self._journal.path)
+        async with db.Pool.acquire() as conn:
+            async with conn.transaction():
+                checkpoint = await conn.fetchrow(f"SELECT * FROM {XPJournalCheckpoint.__tablename__} WHERE journal = $1;",
+                                                 journal)
+                totals = dict(daily)
+                for replayed_segment, replayed in self._replayed_daily.items():
+                    if checkpoint is None or replayed_segment > checkpoint['segment']:
+                        for key, xp in replayed.items():
+                            totals[key] = totals.get(key, 0) + xp
+                await MemberXPDaily.bulk_increment((MemberXPDaily(guild_id, user_id, day, xp)
+                                                    for (guild_id, user_id, day), xp in totals.items()), conn)
+                await conn.execute(f"""
+                    INSERT INTO {XPJournalCheckpoint.__tablename__} (journal, segment) VALUES ($1, $2)
+                    ON CONFLICT (journal) DO UPDATE SET segment = EXCLUDED.segment;
+                """, journal, segment)
+        self._replayed_daily = {}
+
+    def _restore_daily_xp(self, daily: dict):
+        """Put back per-day XP that failed to sync, adding to whatever was earned while the sync ran"""
+        for key, xp in daily.items():
+            self._daily_xp[key] = self._daily_xp.get(key, 0) + xp
+
+    def _evict_clean(self, guild_id: int):
+        """Evict all of a guild's records that haven't changed since they were last synced from the cache"""
+        if self._sync_lock.locked():  # records being written are marked clean but may have to be retried
+            return
         # Deleting from a dict while iterating will error, so collect the keys up front and iterate that
-        # Note that all mutation of `self._xp_cache` happens before the first yield point to prevent race conditions
-        keys = list(self._xp_cache.keys())
-        to_write = []  # records to write to the database
-        evicted = 0
-        for (guild_id, user_id) in keys:
-            cached_member = self._xp_cache[(guild_id, user_id)]
-            if not cached_member.dirty:
-                # Evict records that haven't changed since last run from cache to conserve memory
-                del self._xp_cache[(guild_id, user_id)]
-                evicted += 1
-                continue
-            to_write.append(
-                (guild_id, user_id, cached_member.total_xp, cached_member.total_messages, cached_member.last_given_at))
-            cached_member.dirty = False
-
-        if not to_write:
-            DOZER_LOGGER.debug("Sync task skipped, nothing to do")
+        keys = [key for key, cached_member in self._xp_cache.items() if not cached_member.dirty and key[0] == guild_id]
+        for key in keys:
+            del self._xp_cache[key]
+        self.cache_evictions += len(keys)
+
+    def _evict_to_budget(self):
+        """Drop rank indexes due for a rebuild, then evict the least recently used rank indexes and clean records until
+        the cache and the indexes together are within `cache_max_entries`. Indexes go first: each is rebuilt with one
+        query, while evicted records come back one cache miss at a time."""
+        now = time.monotonic()
+        for guild_id in [guild_id for guild_id, index in self._rank_indexes.items()
+                         if now - index.built_at >= RankIndex.max_age]:
+            del self._rank_indexes[guild_id]
+        excess = len(self._xp_cache) + sum(len(index) for index in self._rank_indexes.values()) - self.cache_max_entries
+        while excess > 0 and self._rank_indexes:
+            guild_id, index = self._rank_indexes.popitem(last=False)
+            excess -= len(index)
+            DOZER_LOGGER.debug(f"Evicted the rank index of guild {guild_id}")
+        if excess <= 0 or self._sync_lock.locked():  # records being written are marked clean but may be retried
             return
-        # Query written manually to insert all records at once
-        try:
-            async with db.Pool.acquire() as conn:
-                await conn.executemany(
-                    f"INSERT INTO {MemberXP.__tablename__} (guild_id, user_id, total_xp, total_messages, last_given_at)"
-                    f" VALUES ($1, $2, $3, $4, $5) ON CONFLICT ({MemberXP.__uniques__}) DO UPDATE"
-                    f" SET total_xp = EXCLUDED.total_xp, total_messages = EXCLUDED.total_messages, last_given_at = "
-                    f"EXCLUDED.last_given_at",
-                    to_write)
-            DOZER_LOGGER.debug(f"Inserted/updated {len(to_write)} record(s); Evicted {evicted} records(s)")
-        except Exception as e:
-            DOZER_LOGGER.error(f"Failed to sync levels cache to db, Reason:{e}")
-
-    @loop(minutes=2.5)
+        keys = []
+        for key, cached_member in self._xp_cache.items():  # least recently used first
+            if not cached_member.dirty:
+                keys.append(key)
+                if len(keys) == excess:
+                    break
+        for key in keys:
+            del self._xp_cache[key]
+        self.cache_evictions += len(keys)
+        DOZER_LOGGER.debug(f"Evicted {len(keys)} record(s)")
+
+    def cache_stats(self) -> str:
+        """A summary of the XP cache's size and hit rate"""
+        lookups = self.cache_hits + self.cache_misses
+        hit_rate = self.cache_hits / lookups if lookups else 0
+        # a rough per-entry cost: the entry, its key tuple, and the datetime it holds
+        entry_bytes = sys.getsizeof(MemberXPCache(0, datetime.now(tz=timezone.utc), 0, False)) + \
+            sys.getsizeof((0, 0)) + sys.getsizeof(datetime.now(tz=timezone.utc))
+        dirty = sum(1 for cached_member in self._xp_cache.values() if cached_member.dirty)
+        indexed = sum(len(index) for index in self._rank_indexes.values())
+        return (f"{len(self._xp_cache) + indexed}/{self.cache_max_entries} entries ({dirty} dirty, "
+                f"~{len(self._xp_cache) * entry_bytes // 1024} KiB, {indexed} in {len(self._rank_indexes)} rank indexes); "
+                f"{hit_rate:.1%} hit rate over {lookups} lookups; {self.cache_evictions} evicted")
+
+    @loop(seconds=5)
     async def sync_task(self):
-        """Sync dirty records to the database, and evict others from the cache.
-        This function merely wraps `sync_to_database` into a periodic task.
-        """
-        # @loop(...) assumes that getattr(self, func.__name__) is the task, so this needs to be a new function instead
-        # of `sync_task = loop(minutes=1)(sync_to_database)`
-        await self.sync_to_database()
+        """Sync dirty records to the database once enough have been journaled or the oldest has waited
+        `flush_interval` seconds, then trim the cache back to its budget."""
+        if self._journal.due(self.flush_size, self.flush_interval):
+            await self.sync_to_database()
+        self._evict_to_budget()
+
+    @loop(hours=24)
+    async def compact_task(self):
+        """Merge per-day XP older than `DAILY_RETENTION_DAYS` into per-month totals, so the daily table stays bounded."""
+        cutoff = datetime.now(tz=timezone.utc).date() - timedelta(days=DAILY_RETENTION_DAYS)
+        async with db.Pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(f"""
+                    INSERT INTO {MemberXPMonthly.__tablename__} (guild_id, user_id, month, xp)
+                    SELECT guild_id, user_id, date_trunc('month', day)::date, sum(xp)::bigint
+                    FROM {MemberXPDaily.__tablename__} WHERE day < $1 GROUP BY 1, 2, 3
+                    ON CONFLICT (guild_id, user_id, month) DO UPDATE SET xp = {MemberXPMonthly.__tablename__}.xp + EXCLUDED.xp;
+                """, cutoff)
+                result = await conn.execute(f"DELETE FROM {MemberXPDaily.__tablename__} WHERE day < $1;", cutoff)
+        DOZER_LOGGER.info(f"Compacted daily XP before {cutoff} into months ({result})")
+
+    @compact_task.before_loop
+    async def before_compact(self):
+        """Wait for the bot to be ready before compacting daily XP."""
+        await self.bot.wait_until_ready()
 
     @sync_task.before_loop
     async def before_sync(self):
         """Do preparation work before starting the periodic timer to sync XP with the database."""
         await self.bot.wait_until_ready()
+        if any(cached_member.dirty for cached_member in self._xp_cache.values()):
+            await self.sync_to_database()  # write back whatever the journal replayed
 
     def cog_unload(self):
         """Detach from the running bot and cancel long-running code as the cog is unloaded."""
+        self.bot.remove_message_hook(self.give_message_xp)
         self.sync_task.stop()
+        self.compact_task.stop()
+        self._journal.close()
+        for channel in list(self._level_ups):  # don't drop announcements still waiting on their window
+            self._loop.create_task(self._send_level_ups(channel))
+        GuildXPSettings.remove_change_listener(self.on_guild_settings_change)
+        XPRole.remove_change_listener(self.on_level_roles_change)
 
     def _ensure_sync_running(self):
         task = self.sync_task.get_task()
@@ -253,7 +550,8 @@ class Levels(Cog):
         finally:
             self.sync_task.start()
 
-    def _fmt_member(self, guild: discord.Guild, user_id: int):
+    def fmt_member(self, guild: discord.Guild, user_id: int):
+        """A member's mention, or their name or ID if they can't be mentioned"""
         member = guild.get_member(user_id)
         if member:
             if member.status == discord.Status.offline:
@@ -263,13 +561,13 @@ class Levels(Cog):
         else:  # Still try to see if the bot can find the user to get their name
             user = self.bot.get_user(user_id)
             if user:
-                return user
+                return str(user)
             else:  # If the bot can't get the user's name then return the user's id
                 return f"({user_id})"
 
-    @Cog.listener('on_message')
-    async def give_message_xp(self, message: discord.Message):
-        """Handle giving XP to a user for a message."""
+    async def give_message_xp(self, context: MessageContext):
+        """Message hook: handle giving XP to a user for a message."""
+        message = context.message
         if message.author.bot or not message.guild:
             return
         guild_settings = self.guild_settings.get(message.guild.id)
@@ -277,64 +575,119 @@ class Levels(Cog):
             return
 
         cached_member = await self.load_member(message.guild.id, message.author.id)
-        await self.check_new_roles(message.guild, message.author, cached_member, guild_settings)
         old_xp = cached_member.total_xp
 
         timestamp = message.created_at.replace(tzinfo=timezone.utc)
+        day, gained = None, 0
         if cached_member.last_given_at is None or timestamp - cached_member.last_given_at > timedelta(
                 seconds=guild_settings.xp_cooldown):
-            cached_member.total_xp += random.randint(guild_settings.xp_min, guild_settings.xp_max)
+            gained = random.randint(guild_settings.xp_min, guild_settings.xp_max)
+            cached_member.total_xp += gained
             cached_member.last_given_at = timestamp
+            day = timestamp.date()
+            day_key = (message.guild.id, message.author.id, day)
+            self._daily_xp[day_key] = self._daily_xp.get(day_key, 0) + gained
         cached_member.total_messages += 1
         cached_member.dirty = True
+        self._xp_changed(message.guild.id, message.author.id, cached_member, day, gained)
 
+        await self.check_new_roles(message.guild, message.author, cached_member, guild_settings, context.role_ids)
         await self.check_level_up(message.guild, message.author, old_xp, cached_member.total_xp)
 
     @command(aliases=["mee6sync"])
     @guild_only()  # Prevent command from being executed in a DM
-    @discord.ext.commands.max_concurrency(1,
-                                          wait=False)  # Only allows one instance of this command to run at a time globally
+    @discord.ext.commands.max_concurrency(1, per=discord.ext.commands.BucketType.guild,
+                                          wait=False)  # One import per guild; all imports share one rate limit
     @discord.ext.commands.cooldown(rate=1, per=900,
                                    type=discord.ext.commands.BucketType.guild)  # A cooldown of 15 minutes per guild to prevent spam
     @has_permissions(administrator=True)
     async def meesyncs(self, ctx: DozerContext):
         """Function to scrap ranking data from the mee6 api and save it to the database"""
         guild_id = ctx.guild.id
-        progress_template = "Currently syncing from Mee6 API please wait... Page: {page}"
         DOZER_LOGGER.info(
             f"Syncing Mee6 level data for {ctx.guild.member_count} members from guild {ctx.guild}({guild_id})")
 
         if self.guild_settings.get(guild_id):
             self.guild_settings[guild_id].enabled = False
 
-        await self.sync_to_database()  # We sync the database twice so that the entire cache gets flushed
-        await self.sync_to_database()  # This is to prevent cache entries from overwriting the new synced data
-
-        msg = await ctx.send(progress_template.format(page="N/A"))
-        for page in itertools.count():
-            async with self.session.get(
-                    f"https://mee6.xyz/api/plugins/levels/leaderboard/{guild_id}?page={page}") as response:
-                data = await response.json()
-                if data.get("players") and len(data["players"]) > 0:
-                    for user in data["players"]:
-                        ent = MemberXP(
-                            guild_id=int(guild_id),
-                            user_id=int(user["id"]),
-                            total_xp=int(user["xp"]),
-                            total_messages=int(user["message_count"]),
-                            last_given_at=ctx.message.created_at.replace(tzinfo=timezone.utc)
-                        )
-                        await ent.update_or_add()
-                    if page % 2:
-                        await msg.edit(content=progress_template.format(page=page))
-                else:
-                    break
-            await asyncio.sleep(1.25)  # Slow down api calls as to not anger cloudflare
+        await self.sync_to_database()  # Flush the guild's cache and then drop it
+        self._evict_clean(guild_id)  # This is to prevent cache entries from overwriting the new synced data
 
-        await self.update_server_settings_cache()  # We refresh the settings cache to return the settings back to previous values
-        await msg.edit(content="Levels data successfully synced from Mee6")
+        checkpoint = await Mee6ImportCheckpoint.get_by(guild_id=guild_id)
+        start_page = checkpoint[0].next_page if checkpoint else 0
+        msg = await ctx.send(f"Currently syncing from Mee6 API please wait... "
+                             f"{f'Resuming from page {start_page}' if start_page else 'Page: N/A'}")
+        try:
+            pages, players, elapsed = await self._import_mee6(guild_id, start_page, msg,
+                                                              ctx.message.created_at.replace(tzinfo=timezone.utc))
+        finally:
+            self._rank_indexes.pop(guild_id, None)  # The imported XP replaced what the index was built from
+            await self.update_server_settings_cache()  # We refresh the settings cache to return the settings back to previous values
+        await Mee6ImportCheckpoint.delete(guild_id=guild_id)
+        await msg.edit(content=f"Levels data successfully synced from Mee6 ({players} members from {pages} pages "
+                               f"in {elapsed:.0f}s)")
         DOZER_LOGGER.info(f"Successfully synced Mee6 data for guild {ctx.guild}({guild_id})")
 
+    async def _import_mee6(self, guild_id: int, start_page: int, msg: discord.Message, last_given_at: datetime):
+        """Import a guild's Mee6 leaderboard from start_page on, fetching up to `mee6_concurrency` pages at once.
+        After each page is written, the first page not yet written is saved so an interrupted import can resume there.
+        Returns the number of pages and players imported and the seconds taken."""
+        next_page = start_page
+        end_page = None  # the first empty page, once one has been seen
+        written = set()  # pages written past the checkpoint
+        checkpoint = start_page
+        players_imported = 0
+        started = last_progress = time.monotonic()
+
+        async def fetch(page: int) -> list:
+            while True:
+                await self._mee6_bucket.acquire()
+                async with self.session.get(
+                        f"https://mee6.xyz/api/plugins/levels/leaderboard/{guild_id}?page={page}") as response:
+                    if response.status == 429:  # Back off as to not anger cloudflare
+                        await asyncio.sleep(float(response.headers.get("Retry-After", 5)))
+                        continue
+                    response.raise_for_status()
+                    data = await response.json()
+                return data.get("players") or []
+
+        async def worker():
+            nonlocal next_page, end_page, checkpoint, players_imported, last_progress
+            while end_page is None or next_page < end_page:
+                page = next_page
+                next_page += 1
+                players = await fetch(page)
+                if not players:
+                    end_page = page if end_page is None else min(end_page, page)
+                    return
+                await MemberXP.bulk_upsert(MemberXP(
+                    guild_id=int(guild_id),
+                    user_id=int(user["id"]),
+                    total_xp=int(user["xp"]),
+                    total_messages=int(user["message_count"]),
+                    last_given_at=last_given_at
+                ) for user in players)
+                players_imported += len(players)
+                written.add(page)
+                if page == checkpoint:
+                    while checkpoint in written:
+                        written.remove(checkpoint)
+                        checkpoint += 1
+                    await Mee6ImportCheckpoint(guild_id=guild_id, next_page=checkpoint).update_or_add()
+                if time.monotonic() - last_progress >= 5:
+                    last_progress = time.monotonic()
+                    rate = players_imported / (last_progress - started)
+                    await msg.edit(content=f"Currently syncing from Mee6 API please wait... Page: {checkpoint} "
+                                           f"({players_imported} members, {rate:.0f} members/s)")
+
+        workers = [asyncio.ensure_future(worker()) for _ in range(self.mee6_concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+        return checkpoint - start_page, players_imported, time.monotonic() - started
+
     meesyncs.example_usage = """
     `{prefix}meesyncs`: Sync ranking data from the mee6 API to dozer's database
     """
@@ -387,12 +740,13 @@ class Levels(Cog):
     @has_permissions(manage_messages=True)
     async def setlevel(self, ctx: DozerContext, member: discord.Member, level: int):
         """Changes a members level to requested level"""
-        if level >= LEVEL_SET_LIMIT:  # Make sure level doesn't get close to LEVEL_CALC_LIMIT
+        xp = self.total_xp_for_level(level)
+        if xp > MAX_TOTAL_XP:
             raise BadArgument("Requested level is too high!")
         entry = await self.load_member(ctx.guild.id, member.id)
-        xp = self.total_xp_for_level(level)
         DOZER_LOGGER.debug(f"Adjusting xp for user {member.id} to {xp}")
         entry.total_xp = xp
+        self._xp_changed(ctx.guild.id, member.id, entry)
         await self.sync_member(ctx.guild.id, member.id)  # Sync just this member to the db
         e = discord.Embed(color=blurple)
         e.add_field(name='Success!', value=f"I set {member}'s level to {level}")
@@ -408,6 +762,7 @@ class Levels(Cog):
             raise BadArgument("You cannot change a members xp more than the 32bit limit will allow!")
         entry = await self.load_member(ctx.guild.id, member.id)
         entry.total_xp += xp_amount
+        self._xp_changed(ctx.guild.id, member.id, entry)
         await self.sync_member(ctx.guild.id, member.id)
         e = discord.Embed(color=blurple)
         e.add_field(name='Success!', value=f"I adjusted {member}'s xp by {xp_amount} points")
@@ -423,6 +778,8 @@ class Levels(Cog):
         give = await self.load_member(ctx.guild.id, give_member.id)
         self._xp_cache[(ctx.guild.id, take_member.id)] = give
         self._xp_cache[(ctx.guild.id, give_member.id)] = take
+        self._xp_changed(ctx.guild.id, take_member.id, give)
+        self._xp_changed(ctx.guild.id, give_member.id, take)
         await self.sync_member(ctx.guild.id, take_member.id)
         await self.sync_member(ctx.guild.id, give_member.id)
         e = discord.Embed(color=blurple)
@@ -441,6 +798,8 @@ class Levels(Cog):
         give.total_messages += take.total_messages
         take.total_xp = 0
         take.total_messages = 0
+        self._xp_changed(ctx.guild.id, give_member.id, give)
+        self._xp_changed(ctx.guild.id, take_member.id, take)
         await self.sync_member(ctx.guild.id, give_member.id)
         await self.sync_member(ctx.guild.id, take_member.id)
         e = discord.Embed(color=blurple)
@@ -658,29 +1017,19 @@ class Levels(Cog):
         if guild_settings is None or not guild_settings.enabled:
             embed.description = "Levels are not enabled in this server"
         else:
+            index = await self._rank_index(ctx.guild.id)
             cache_record = await self.load_member(ctx.guild.id,
                                                   member.id)  # Grab member from cache to make sure we have the most up to date values
 
-            # Make Postgres compute the rank for us (need WITH-query so rank() sees records for every user)
-            db_record = await db.Pool.fetchrow(f"""
-                WITH ranked_xp AS (
-                    SELECT user_id, rank() OVER (ORDER BY total_xp DESC, user_id) FROM {MemberXP.__tablename__}
-                    WHERE guild_id = $1
-                ) SELECT rank FROM ranked_xp WHERE user_id = $2;
-            """, ctx.guild.id, member.id)
-
             total_xp = cache_record.total_xp
-            db_count = await db.Pool.fetchval(
-                f"""SELECT count(*) FROM {MemberXP.__tablename__} WHERE guild_id = $1; """, ctx.guild.id)
             # Prevents 1/1 in servers of ~100 and 50/40 in shrunk servers
-            count = ctx.guild.member_count if ctx.guild.member_count > db_count else db_count
+            count = max(ctx.guild.member_count, len(index))
             level = self.level_for_total_xp(total_xp)
             level_floor = self.total_xp_for_level(level)
             level_xp = self.total_xp_for_level(level + 1) - level_floor
 
-            if db_record:  # If member does not exist in the db, then return rank as the lowest rank
-                rank = db_record.get("rank")
-            else:
+            rank = index.rank(member.id)
+            if rank is None:  # If member has no XP record, then return rank as the lowest rank
                 rank = count
 
             embed.description = (f"Level {level}, {total_xp - level_floor}/{level_xp} XP to level up ({total_xp} total)\n"
@@ -701,38 +1050,28 @@ class Levels(Cog):
 
     @command(aliases=["ranks", "leaderboard"])
     @guild_only()
-    async def levels(self, ctx: DozerContext, start: typing.Optional[discord.Member]):
-        """Show the XP leaderboard for this server. Leaderboard refreshes every 5 minutes or so"""
-
-        # Order by total_xp needs a tiebreaker, otherwise all records with equal XP will have the same rank
-        # This causes rankings like #1, #1, #1, #4, #4, #6, ...
-        # user_id is arbitrary, chosen because it is guaranteed to be unique between two records in the same guild
-        records = await db.Pool.fetch(f"""
-                    SELECT user_id, total_xp, rank() OVER (ORDER BY total_xp DESC, user_id) FROM {MemberXP.__tablename__}
-                    WHERE guild_id = $1 ORDER BY rank;
-                """, ctx.guild.id)
+    async def levels(self, ctx: DozerContext, start: typing.Optional[discord.Member], *, window: str = None):
+        """Show the XP leaderboard for this server, or with `--window week|month` the XP earned over the last week or month"""
+        if window is not None:
+            window = window.strip()
+            if window.startswith("--window"):
+                window = window[len("--window"):].strip()
+            if window not in LEADERBOARD_WINDOWS:
+                raise BadArgument(f"The leaderboard window must be one of: {', '.join(LEADERBOARD_WINDOWS)}")
+            index = await self._window_index(ctx.guild.id, LEADERBOARD_WINDOWS[window])
+        else:
+            index = await self._rank_index(ctx.guild.id)
 
         start_point = 0
 
         if start:
-            target_filter = filter(lambda record: record['user_id'] == start.id, records)
-            targets = list(target_filter)
-            if len(targets):
-                target = targets[0]
-                start_point = int(target['rank'] / 10)
-            else:
-                return BadArgument("User was not found in the leaderboard")
+            rank = index.rank(start.id)
+            if rank is None:
+                raise BadArgument("User was not found in the leaderboard")
+            start_point = (rank - 1) // 10
 
-        if len(records):
-            embeds = []
-            for page_num, page in enumerate(chunk(records, 10)):
-                embed = discord.Embed(title=f"Rankings for {ctx.guild}", color=discord.Color.blue())
-                embed.description = '\n'.join(f"#{rank}: {escape_markdown(self._fmt_member(ctx.guild, user_id))}"
-                                              f" (lvl {self.level_for_total_xp(total_xp)}, {total_xp} XP)"
-                                              for (user_id, total_xp, rank) in page)
-                embed.set_footer(text=f"Page {page_num + 1} of {math.ceil(len(records) / 10)}")
-                embeds.append(embed)
-            await paginate(ctx, embeds, start=start_point)
+        if len(index):
+            await paginate(ctx, LeaderboardPages(self, ctx.guild, index, window), start=start_point)
         else:
             embed = discord.Embed(title=f"Rankings for {ctx.guild}", color=discord.Color.red())
             embed.description = f"Rankings currently unavailable for {ctx.guild}"
@@ -742,25 +1081,49 @@ class Levels(Cog):
     levels.example_usage = """
     `{prefix}levels`: show the XP leaderboard
     `{prefix}levels SnowPlow[>]#5196`: Jump to Snowplow's position on the leaderboard
+    `{prefix}levels --window week`: show who earned the most XP over the last week
     """
 
 
+class LeaderboardPages(PageProvider):
+    """A guild's leaderboard, ten members a page, each page sliced from a rank index when it is first shown.
+    With a window, the index holds the XP earned over that window, and levels aren't shown."""
+
+    def __init__(self, cog: Levels, guild: discord.Guild, index: "RankIndex", window: str = None):
+        super().__init__()
+        self.cog = cog
+        self.guild = guild
+        self.index = index
+        self.window = window
+        self.page_count = math.ceil(len(index) / 10)  # fixed when opened, so the footer doesn't shift under the reader
+
+    def __len__(self):
+        return self.page_count
+
+    async def render(self, page: int) -> discord.Embed:
+        entries = self.index.slice(page * 10, page * 10 + 10)
+        if self.window:
+            embed = discord.Embed(title=f"Rankings for {self.guild} this {self.window}", color=discord.Color.blue())
+            embed.description = '\n'.join(f"#{rank}: {escape_markdown(self.cog.fmt_member(self.guild, user_id))} ({xp} XP)"
+                                          for (user_id, xp, rank) in entries)
+        else:
+            embed = discord.Embed(title=f"Rankings for {self.guild}", color=discord.Color.blue())
+            page_levels = self.cog.levels_for_total_xp([total_xp for (_, total_xp, _) in entries])
+            embed.description = '\n'.join(f"#{rank}: {escape_markdown(self.cog.fmt_member(self.guild, user_id))}"
+                                          f" (lvl {level}, {total_xp} XP)"
+                                          for (user_id, total_xp, rank), level in zip(entries, page_levels))
+        embed.set_footer(text=f"Page {page + 1} of {self.page_count}")
+        return embed
+
+
 class XPRole(db.DatabaseTable):
     """Database table mapping a guild and user to their XP and related values."""
     __tablename__ = "roles_levels_xp"
-    __uniques__ = "guild_id, role_id"
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-                CREATE TABLE {cls.__tablename__} (
-                guild_id bigint NOT NULL,
-                role_id bigint NOT NULL,
-                level int NOT NULL,
-                PRIMARY KEY (guild_id, role_id)
-                )""")
+    __columns__ = (
+        db.Column("guild_id", "bigint", primary_key=True),
+        db.Column("role_id", "bigint", primary_key=True),
+        db.Column("level", "int"),
+    )
 
     def __init__(self, guild_id: int, role_id: int, level: int):
         super().__init__()
@@ -768,35 +1131,21 @@ class XPRole(db.DatabaseTable):
         self.role_id = role_id
         self.level = level
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = XPRole(guild_id=result.get("guild_id"), role_id=result.get("role_id"),
-                         level=result.get("level"))
-            result_list.append(obj)
-        return result_list
-
 
 class MemberXP(db.DatabaseTable):
     """Database table mapping a guild and user to their XP and related values."""
     __tablename__ = "levels_member_xp"
-    __uniques__ = "guild_id, user_id"
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            guild_id bigint NOT NULL,
-            user_id bigint NOT NULL,
-            total_xp bigint NOT NULL,
-            total_messages int NOT NULL,
-            last_given_at timestamptz NOT NULL,
-            PRIMARY KEY (guild_id, user_id)
-            )""")
+    __columns__ = (
+        db.Column("guild_id", "bigint", primary_key=True),
+        db.Column("user_id", "bigint", primary_key=True),
+        db.Column("total_xp", "bigint"),
+        db.Column("total_messages", "int"),
+        db.Column("last_given_at", "timestamptz"),
+    )
+    __indexes__ = (
+        # leaderboards and ranks order a guild's members by XP
+        db.Index("guild_id", "total_xp DESC"),
+    )
 
     def __init__(self, guild_id: int, user_id: int, total_xp: int, total_messages: int, last_given_at: datetime.time):
         super().__init__()
@@ -806,16 +1155,47 @@ class MemberXP(db.DatabaseTable):
         self.total_messages = total_messages
         self.last_given_at = last_given_at
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = MemberXP(guild_id=result.get("guild_id"), user_id=result.get("user_id"),
-                           total_xp=result.get("total_xp"), total_messages=result.get("total_messages"),
-                           last_given_at=result.get("last_given_at"))
-            result_list.append(obj)
-        return result_list
+
+class MemberXPDaily(db.DatabaseTable):
+    """Database table of the XP each member of a guild earned from messages on each day (UTC)"""
+    __tablename__ = "levels_member_xp_daily"
+    __columns__ = (
+        db.Column("guild_id", "bigint", primary_key=True),
+        db.Column("user_id", "bigint", primary_key=True),
+        db.Column("day", "date", primary_key=True),
+        db.Column("xp", "bigint"),
+    )
+    __indexes__ = (
+        # windowed leaderboards sum a guild's recent days; compaction finds old days
+        db.Index("guild_id", "day"),
+        db.Index("day"),
+    )
+
+    def __init__(self, guild_id: int, user_id: int, day: date, xp: int):
+        super().__init__()
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.day = day
+        self.xp = xp
+
+
+class MemberXPMonthly(db.DatabaseTable):
+    """Database table of the XP each member of a guild earned from messages in each month, compacted from
+    `MemberXPDaily` once the days are older than any leaderboard window"""
+    __tablename__ = "levels_member_xp_monthly"
+    __columns__ = (
+        db.Column("guild_id", "bigint", primary_key=True),
+        db.Column("user_id", "bigint", primary_key=True),
+        db.Column("month", "date", primary_key=True),  # the first day of the month
+        db.Column("xp", "bigint"),
+    )
+
+    def __init__(self, guild_id: int, user_id: int, month: date, xp: int):
+        super().__init__()
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.month = month
+        self.xp = xp
 
 
 class MemberXPCache:
@@ -824,6 +1204,8 @@ class MemberXPCache:
         whether the record has been changed since it was loaded from the database or created.
     """
 
+    __slots__ = ('total_xp', 'total_messages', 'last_given_at', 'dirty')
+
     def __init__(self, total_xp: int, last_given_at: datetime, total_messages: int, dirty: bool):
         self.total_xp = total_xp
         self.total_messages = total_messages
@@ -831,7 +1213,7 @@ class MemberXPCache:
         self.dirty = dirty
 
     def __repr__(self):
-        return f"<MemberXPCache total_xp={self.total_xp!r} last_given_at={self.last_given_at!r} total_messages={self.last_given_at!r}" \
+        return f"<MemberXPCache total_xp={self.total_xp!r} last_given_at={self.last_given_at!r} total_messages={self.total_messages!r}" \
                f" dirty={self.dirty!r}>"
 
     @classmethod
@@ -840,25 +1222,187 @@ class MemberXPCache:
         return cls(record.total_xp, record.last_given_at, record.total_messages, False)
 
 
+class Mee6ImportCheckpoint(db.DatabaseTable):
+    """Database table recording how far an unfinished Mee6 import of a guild got"""
+    __tablename__ = "levels_mee6_import"
+    __columns__ = (
+        db.Column("guild_id", "bigint", primary_key=True),
+        db.Column("next_page", "int"),
+    )
+
+    def __init__(self, guild_id: int, next_page: int):
+        super().__init__()
+        self.guild_id = guild_id
+        self.next_page = next_page
+
+
+class TokenBucket:
+    """Rate limiter allowing `rate` acquisitions per second on average, in bursts of up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        async with self._lock:  # waiters are served in order
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class LevelRoleThresholds:
+    """A guild's level roles sorted by level, with the set of role IDs a member should hold after earning each number
+    of them precomputed for both settings of keep_old_roles, so checking a member is a bisect and a set comparison."""
+    __slots__ = ('levels', 'role_ids', '_kept', '_top')
+
+    def __init__(self, level_roles: typing.Iterable["XPRole"]):
+        ordered = sorted(level_roles, key=lambda entry: entry.level)
+        self.levels = [level_role.level for level_role in ordered]
+        self.role_ids = frozenset(level_role.role_id for level_role in ordered)
+        self._kept = [frozenset(level_role.role_id for level_role in ordered[:earned]) for earned in range(len(ordered) + 1)]
+        self._top = [frozenset()] + [frozenset((level_role.role_id,)) for level_role in ordered]
+
+    def wanted(self, level: int, keep_old_roles: bool) -> typing.FrozenSet[int]:
+        """The level role IDs a member at this level should hold"""
+        earned = bisect.bisect_right(self.levels, level)
+        return self._kept[earned] if keep_old_roles else self._top[earned]
+
+
+class RankIndex:
+    """Order-statistic index of one guild's members by XP, highest first with ties broken by user ID like the
+    leaderboard's `rank() OVER (ORDER BY total_xp DESC, user_id)`.
+    Keys live in sorted buckets of at most `bucket_size`, with a Fenwick tree over the bucket sizes, so finding a
+    member's rank or the start of a page is a couple of binary searches plus an O(log n) prefix sum.
+    """
+    bucket_size = 1000
+    max_age = 3600  # seconds before the index is rebuilt from the database
+
+    def __init__(self, entries: typing.Iterable[typing.Tuple[int, int]] = ()):
+        self._xp: typing.Dict[int, int] = dict(entries)  # user_id -> total_xp
+        keys = sorted((-total_xp, user_id) for user_id, total_xp in self._xp.items())
+        self._buckets = [keys[i:i + self.bucket_size] for i in range(0, len(keys), self.bucket_size)] or [[]]
+        self._rebuild()
+        self.built_at = time.monotonic()
+
+    def _rebuild(self):
+        """Recompute the bucket maxima and the Fenwick tree after buckets were split or removed"""
+        self._maxes = [bucket[-1] for bucket in self._buckets if bucket]
+        self._tree = [0] * (len(self._buckets) + 1)
+        for i, bucket in enumerate(self._buckets):
+            self._tree_add(i, len(bucket))
+
+    def _tree_add(self, bucket: int, delta: int):
+        i = bucket + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _before(self, bucket: int) -> int:
+        """Number of members in the buckets before the given one"""
+        total = 0
+        while bucket > 0:
+            total += self._tree[bucket]
+            bucket -= bucket & -bucket
+        return total
+
+    def _bucket_for(self, key: tuple) -> int:
+        return min(bisect.bisect_left(self._maxes, key), len(self._buckets) - 1)
+
+    def __len__(self):
+        return len(self._xp)
+
+    def __contains__(self, user_id: int):
+        return user_id in self._xp
+
+    def update(self, user_id: int, total_xp: int):
+        """Place a member at their new XP total"""
+        old_xp = self._xp.get(user_id)
+        if old_xp == total_xp:
+            return
+        if old_xp is not None:
+            self._remove((-old_xp, user_id))
+        self._xp[user_id] = total_xp
+        key = (-total_xp, user_id)
+        i = self._bucket_for(key)
+        bucket = self._buckets[i]
+        bisect.insort(bucket, key)
+        self._tree_add(i, 1)
+        if len(bucket) > 2 * self.bucket_size:
+            self._buckets[i:i + 1] = [bucket[:self.bucket_size], bucket[self.bucket_size:]]
+            self._rebuild()
+        elif len(self._maxes) <= i:
+            self._maxes.append(bucket[-1])
+        else:
+            self._maxes[i] = bucket[-1]
+
+    def _remove(self, key: tuple):
+        i = self._bucket_for(key)
+        bucket = self._buckets[i]
+        del bucket[bisect.bisect_left(bucket, key)]
+        self._tree_add(i, -1)
+        if not bucket and len(self._buckets) > 1:
+            del self._buckets[i]
+            self._rebuild()
+        elif bucket:
+            self._maxes[i] = bucket[-1]
+        else:
+            self._maxes = []
+
+    def rank(self, user_id: int) -> typing.Optional[int]:
+        """A member's 1-based position, or None if they have no XP record"""
+        total_xp = self._xp.get(user_id)
+        if total_xp is None:
+            return None
+        key = (-total_xp, user_id)
+        i = self._bucket_for(key)
+        return self._before(i) + bisect.bisect_left(self._buckets[i], key) + 1
+
+    def slice(self, start: int, stop: int) -> typing.List[typing.Tuple[int, int, int]]:
+        """(user_id, total_xp, rank) for the members ranked start + 1 through stop"""
+        start, stop = max(start, 0), min(stop, len(self._xp))
+        entries = []
+        if start >= stop:
+            return entries
+        # find the bucket holding position `start` by walking down the Fenwick tree
+        i, remaining, step = 0, start, 1 << (len(self._buckets).bit_length())
+        while step:
+            if i + step < len(self._tree) and self._tree[i + step] <= remaining:
+                i += step
+                remaining -= self._tree[i]
+            step >>= 1
+        rank = start + 1
+        for bucket in itertools.islice(self._buckets, i, None):
+            for negative_xp, user_id in bucket[remaining:]:
+                entries.append((user_id, -negative_xp, rank))
+                rank += 1
+                if rank > stop:
+                    return entries
+            remaining = 0
+        return entries
+
+
 class GuildXPSettings(db.DatabaseTable):
     """Database table containing per-guild settings related to XP gain."""
     __tablename__ = "levels_guild_settings"
-    __uniques__ = "guild_id"
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            guild_id bigint PRIMARY KEY NOT NULL,
-            xp_min int NOT NULL,
-            xp_max int NOT NULL,
-            xp_cooldown int NOT NULL,
-            entropy_value int NOT NULL,
-            lvl_up_msgs bigint NOT NULL,
-            enabled boolean NOT NULL
-            )""")
+    __columns__ = (
+        db.Column("guild_id", "bigint", primary_key=True),
+        db.Column("xp_min", "int"),
+        db.Column("xp_max", "int"),
+        db.Column("xp_cooldown", "int"),
+        db.Column("entropy_value", "int"),
+        db.Column("lvl_up_msgs", "bigint", nullable=True),
+        db.Column("enabled", "boolean"),
+        db.Column("keep_old_roles", "boolean", default="TRUE"),
+    )
 
     def __init__(self, guild_id: int, xp_min: int, xp_max: int, xp_cooldown: int, entropy_value: int, enabled: bool,
                  lvl_up_msgs: bool, keep_old_roles: bool):
@@ -872,19 +1416,6 @@ class GuildXPSettings(db.DatabaseTable):
         self.lvl_up_msgs = lvl_up_msgs
         self.keep_old_roles = keep_old_roles
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = GuildXPSettings(guild_id=result.get("guild_id"), xp_min=result.get("xp_min"),
-                                  xp_max=result.get("xp_max"),
-                                  xp_cooldown=result.get("xp_cooldown"), entropy_value=result.get("entropy_value"),
-                                  enabled=result.get("enabled"),
-                                  lvl_up_msgs=result.get("lvl_up_msgs"), keep_old_roles=result.get("keep_old_roles"))
-            result_list.append(obj)
-        return result_list
-
     async def version_1(self):
         """DB migration v1"""
         async with db.Pool.acquire() as conn:
@@ -13,11 +13,12 @@ from discord.ext import tasks, commands
 from discord.ext.commands import BadArgument, has_permissions, RoleConverter, guild_only
 from discord.utils import escape_markdown
 
-from dozer.context import DozerContext
+from dozer.bot import LINKS_HOOK_ORDER, NEW_MEMBER_HOOK_ORDER
+from dozer.context import DozerContext, MessageContext
 from ._utils import *
 from .general import blurple
 from .. import db
-from ..Components.CustomJoinLeaveMessages import send_log, CustomJoinLeaveMessages
+from ..Components.CustomJoinLeaveMessages import send_log, join_leave_config
 
 __all__ = ["SafeRoleConverter", "Moderation", "NewMemPurgeConfig", "GuildNewMember"]
 
@@ -49,6 +50,13 @@ class Moderation(Cog):
         super().__init__(bot)
         self.links_config = db.ConfigCache(GuildMessageLinks)
         self.punishment_timer_tasks = []
+        bot.add_message_hook(self.links_message, LINKS_HOOK_ORDER, gate=True)
+        bot.add_message_hook(self.new_member_message, NEW_MEMBER_HOOK_ORDER)
+
+    def cog_unload(self):
+        """Stop checking messages as the cog is unloaded."""
+        self.bot.remove_message_hook(self.links_message)
+        self.bot.remove_message_hook(self.new_member_message)
 
     """=== Helper functions ==="""
 
@@ -117,8 +125,7 @@ class Moderation(Cog):
                 await orig_channel.send("Failed to DM modlog to user")
             finally:
                 modlog_embed.remove_field(2)
-        modlog_channel = await GuildModLog.get_by(guild_id=actor.guild.id) if guild_override is None else \
-            await GuildModLog.get_by(guild_id=guild_override)
+        modlog_channel = await modlog_config.query_all(actor.guild.id if guild_override is None else guild_override)
         if orig_channel is not None:
             await orig_channel.send(embed=modlog_embed)
         if len(modlog_channel) != 0:
@@ -270,7 +277,7 @@ class Moderation(Cog):
         for subscription in subscriptions:
             sub_guild = self.bot.get_guild(subscription.subscriber_id)
             if sub_guild:
-                modlog_channel = await GuildModLog.get_by(guild_id=sub_guild.id)
+                modlog_channel = await modlog_config.query_all(sub_guild.id)
                 try:
                     await sub_guild.ban(user, reason=f"User Cross Banned from \"{ctx.guild}\" for: {reason}")
                     if modlog_channel:
@@ -400,17 +407,21 @@ class Moderation(Cog):
         if users:
             await self.perm_override(member, read_messages=False)
 
-    @Cog.listener('on_message')
-    async def on_message(self, message: discord.Message):
-        """Check things when messages come in."""
+    async def links_message(self, context: MessageContext):
+        """Message hook: delete links from members who aren't allowed to send them"""
+        message = context.message
         if message.author.bot or message.guild is None or not message.guild.me.guild_permissions.manage_roles:
             return
         if await self.check_links(message):
+            context.deleted = True
+
+    async def new_member_message(self, context: MessageContext):
+        """Message hook: give the new member role to members who send the verification message"""
+        message = context.message
+        if message.author.bot or message.guild is None or not message.guild.me.guild_permissions.manage_roles:
             return
-        config = await GuildNewMember.get_by(guild_id=message.guild.id)
-        ctx = await self.bot.get_context(message)
-        if len(config) != 0:
-            config = config[0]
+        config = await context.config(new_member_config)
+        if config is not None:
             string = config.message
             content = message.content.casefold()
             if string not in content:
@@ -422,15 +433,14 @@ class Moderation(Cog):
             if config.require_team:
                 teams = await TeamNumbers.get_by(user_id=message.author.id)
                 if len(teams) == 0:
-                    if ctx.prefix is None:
-                        ctx.prefix = self.bot.config['prefix']
-                    await message.reply(f"You must set a team number first. ex: `{ctx.prefix}setteam frc 0`")
+                    prefix = context.prefix or self.bot.config['prefix']
+                    await message.reply(f"You must set a team number first. ex: `{prefix}setteam frc 0`")
                     return
 
-            custom_log_config = await CustomJoinLeaveMessages.get_by(guild_id=message.guild.id)
+            custom_log_config = await context.config(join_leave_config)
 
             await message.author.add_roles(message.guild.get_role(role_id))
-            if custom_log_config[0].send_on_verify:
+            if custom_log_config is not None and custom_log_config.send_on_verify:
                 await send_log(member=message.author)
 
     @Cog.listener('on_message_edit')
@@ -803,9 +813,9 @@ class Moderation(Cog):
     async def verifymember(self, ctx, member: discord.Member):
         """Command to verify a member who may not have a team number set, or who hasn't sent the required
         verification message. """
-        config = await GuildNewMember.get_by(guild_id=ctx.guild.id)
-        if len(config) != 0:
-            role_id = config[0].role_id
+        config = await new_member_config.query_one(ctx.guild.id)
+        if config is not None:
+            role_id = config.role_id
             role = ctx.guild.get_role(role_id)
             if role in member.roles:
                 await ctx.send("Member is already verified. ")
@@ -813,8 +823,8 @@ class Moderation(Cog):
 
             await member.add_roles(role)
 
-            custom_join_config = await CustomJoinLeaveMessages.get_by(guild_id=member.guild.id)
-            if custom_join_config[0].send_on_verify:
+            custom_join_config = await join_leave_config.query_one(member.guild.id)
+            if custom_join_config is not None and custom_join_config.send_on_verify:
                 await send_log(member=member)
             await ctx.send(f"Member verified on request of {ctx.author.display_name}")
 
@@ -982,71 +992,29 @@ class Mute(db.DatabaseTable):
     past_participle = "muted"
     finished_callback = Moderation._unmute
     __tablename__ = 'mutes'
-    __uniques__ = 'guild_id, member_id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            member_id bigint NOT NULL,
-            guild_id bigint NOT NULL,
-            PRIMARY KEY (member_id, guild_id)
-            )""")
+    __columns__ = (
+        db.Column("member_id", "bigint", primary_key=True),
+        db.Column("guild_id", "bigint", primary_key=True),
+    )
 
     def __init__(self, member_id: int, guild_id: int):
         super().__init__()
         self.member_id = member_id
         self.guild_id = guild_id
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = Mute(member_id=result.get("member_id"), guild_id=result.get("guild_id"))
-            result_list.append(obj)
-        return result_list
-
-    async def update_or_add(self):
-        """Assign the attribute to this object, then call this method to either insert the object if it doesn't exist in
-        the DB or update it if it does exist. It will update every column not specified in __uniques__."""
-        # This is its own functions because all columns must be unique, which breaks the syntax of the other one
-        keys = []
-        values = []
-        for var, value in self.__dict__.items():
-            # Done so that the two are guaranteed to be in the same order, which isn't true of keys() and values()
-            if value is not None:
-                keys.append(var)
-                values.append(value)
-        async with db.Pool.acquire() as conn:
-            statement = f"""
-            INSERT INTO {self.__tablename__} ({", ".join(keys)})
-            VALUES({','.join(f'${i + 1}' for i in range(len(values)))}) 
-            """
-            await conn.execute(statement, *values)
-
 
 class Deafen(db.DatabaseTable):
     """Holds deafens"""
     type = 2
     __tablename__ = 'deafens'
-    __uniques__ = 'member_id, guild_id'
     past_participle = "deafened"
     finished_callback = Moderation._undeafen
 
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            member_id bigint NOT NULL,
-            guild_id bigint NOT NULL,
-            self_inflicted boolean NOT NULL,
-            PRIMARY KEY (member_id, guild_id)
-            )""")
+    __columns__ = (
+        db.Column("member_id", "bigint", primary_key=True),
+        db.Column("guild_id", "bigint", primary_key=True),
+        db.Column("self_inflicted", "boolean"),
+    )
 
     def __init__(self, member_id: int, guild_id: int, self_inflicted: bool):
         super().__init__()
@@ -1054,32 +1022,15 @@ class Deafen(db.DatabaseTable):
         self.guild_id = guild_id
         self.self_inflicted = self_inflicted
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = Deafen(member_id=result.get("member_id"), guild_id=result.get("guild_id"),
-                         self_inflicted=result.get("self_inflicted"))
-            result_list.append(obj)
-        return result_list
-
 
 class GuildModLog(db.DatabaseTable):
     """Holds modlog info"""
     __tablename__ = 'modlogconfig'
-    __uniques__ = 'guild_id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            guild_id bigint PRIMARY KEY NOT NULL,
-            modlog_channel bigint null,
-            name varchar NOT NULL
-            )""")
+    __columns__ = (
+        db.Column("guild_id", "bigint", primary_key=True),
+        db.Column("modlog_channel", "bigint", nullable=True),
+        db.Column("name", "varchar"),
+    )
 
     def __init__(self, guild_id: int, modlog_channel: int, name: str):
         super().__init__()
@@ -1087,93 +1038,42 @@ class GuildModLog(db.DatabaseTable):
         self.modlog_channel = modlog_channel
         self.name = name
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = GuildModLog(guild_id=result.get("guild_id"), modlog_channel=result.get("modlog_channel"),
-                              name=result.get("name"))
-            result_list.append(obj)
-        return result_list
-
 
 class CrossBanSubscriptions(db.DatabaseTable):
     """Holds all cross ban subscriptions"""
     __tablename__ = 'cross_ban_subscriptions'
-    __uniques__ = 'subscriber_id, subscription_id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__}(
-                subscriber_id bigint NOT NULL,
-                subscription_id bigint NOT NULL,
-                UNIQUE (subscriber_id, subscription_id)
-            )""")
+    __columns__ = (
+        db.Column("subscriber_id", "bigint", unique=True),
+        db.Column("subscription_id", "bigint", unique=True),
+    )
 
     def __init__(self, subscriber_id: int, subscription_id: int):
         self.subscriber_id = subscriber_id
         self.subscription_id = subscription_id
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = CrossBanSubscriptions(subscriber_id=result.get("subscriber_id"),
-                                        subscription_id=result.get("subscription_id"))
-            result_list.append(obj)
-        return result_list
-
 
 class MemberRole(db.DatabaseTable):
     """Holds info on member roles used for timeouts"""
     __tablename__ = 'member_roles'
-    __uniques__ = 'guild_id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            guild_id bigint PRIMARY KEY NOT NULL,
-            member_role bigint null
-            )""")
+    __columns__ = (
+        db.Column("guild_id", "bigint", primary_key=True),
+        db.Column("member_role", "bigint", nullable=True),
+    )
 
     def __init__(self, guild_id: int, member_role: int = None):
         super().__init__()
         self.guild_id = guild_id
         self.member_role = member_role
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = MemberRole(member_role=result.get("member_role"), guild_id=result.get("guild_id"))
-            result_list.append(obj)
-        return result_list
-
 
 class NewMemPurgeConfig(db.DatabaseTable):
     """Holds info on member purge routines"""
     __tablename__ = 'member_purge_configs'
-    __uniques__ = 'guild_id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            guild_id bigint PRIMARY KEY NOT NULL,
-            member_role bigint not null,
-            days int not null
-            )""")
+    __columns__ = (
+        db.Column("guild_id", "bigint", primary_key=True),
+        db.Column("member_role", "bigint"),
+        db.Column("days", "int"),
+    )
 
     def __init__(self, guild_id: int, member_role: int, days: int):
         super().__init__()
@@ -1181,35 +1081,17 @@ class NewMemPurgeConfig(db.DatabaseTable):
         self.member_role = member_role
         self.days = days
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = NewMemPurgeConfig(member_role=result.get("member_role"),
-                                    guild_id=result.get("guild_id"),
-                                    days=result.get("days"))
-            result_list.append(obj)
-        return result_list
-
 
 class GuildNewMember(db.DatabaseTable):
     """Holds new member info"""
     __tablename__ = 'new_members'
-    __uniques__ = 'guild_id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            guild_id bigint PRIMARY KEY,
-            channel_id bigint NOT NULL,
-            role_id bigint NOT NULL,
-            message varchar NOT NULL,
-            require_team bool NOT NULL DEFAULT false
-            )""")
+    __columns__ = (
+        db.Column("guild_id", "bigint", primary_key=True),
+        db.Column("channel_id", "bigint"),
+        db.Column("role_id", "bigint"),
+        db.Column("message", "varchar"),
+        db.Column("require_team", "bool", default="false"),
+    )
 
     def __init__(self, guild_id: int, channel_id: int, role_id: int, message: str, require_team: bool):
         super().__init__()
@@ -1219,17 +1101,6 @@ class GuildNewMember(db.DatabaseTable):
         self.message = message
         self.require_team = require_team
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = GuildNewMember(guild_id=result.get("guild_id"), channel_id=result.get("channel_id"),
-                                 role_id=result.get("role_id"), message=result.get("message"),
-                                 require_team=result.get("require_team"))
-            result_list.append(obj)
-        return result_list
-
     async def version_1(self):
         """DB migration v1"""
         async with db.Pool.acquire() as conn:
@@ -1243,54 +1114,32 @@ class GuildNewMember(db.DatabaseTable):
 class GuildMessageLinks(db.DatabaseTable):
     """Contains information for link scrubbing"""
     __tablename__ = 'guild_msg_links'
-    __uniques__ = 'guild_id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            guild_id bigint PRIMARY KEY NOT NULL,
-            role_id bigint null
-            )""")
+    __columns__ = (
+        db.Column("guild_id", "bigint", primary_key=True),
+        db.Column("role_id", "bigint", nullable=True),
+    )
 
     def __init__(self, guild_id: int, role_id: int = None):
         super().__init__()
         self.guild_id = guild_id
         self.role_id = role_id
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = GuildMessageLinks(guild_id=result.get("guild_id"), role_id=result.get("role_id"))
-            result_list.append(obj)
-        return result_list
-
 
 class PunishmentTimerRecords(db.DatabaseTable):
     """Punishment Timer Records"""
     type_map = {p.type: p for p in (Mute, Deafen)}
     __tablename__ = 'punishment_timers'
-    __uniques__ = 'id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            id serial PRIMARY KEY NOT NULL,
-            guild_id bigint NOT NULL,
-            actor_id bigint NOT NULL,
-            target_id bigint NOT NULL,
-            orig_channel_id bigint null,
-            type_of_punishment bigint NOT NULL,
-            reason varchar null,
-            target_ts bigint NOT NULL
-            )""")
+    __columns__ = (
+        db.Column("id", "serial", primary_key=True),
+        db.Column("guild_id", "bigint"),
+        db.Column("actor_id", "bigint"),
+        db.Column("target_id", "bigint"),
+        db.Column("orig_channel_id", "bigint", nullable=True),
+        db.Column("type_of_punishment", "bigint"),
+        db.Column("reason", "varchar", nullable=True),
+        db.Column("target_ts", "bigint"),
+        db.Column("self_inflicted", "bool", default="false"),
+    )
 
     def __init__(self, guild_id: int, actor_id: int, target_id: int, type_of_punishment: int, target_ts: int,
                  orig_channel_id: int = None, reason: str = None, input_id: int = None, self_inflicted: bool =False):
@@ -1305,20 +1154,6 @@ class PunishmentTimerRecords(db.DatabaseTable):
         self.reason = reason
         self.self_inflicted = self_inflicted
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = PunishmentTimerRecords(guild_id=result.get("guild_id"), actor_id=result.get("actor_id"),
-                                         target_id=result.get("target_id"),
-                                         type_of_punishment=result.get("type_of_punishment"),
-                                         target_ts=result.get("target_ts"),
-                                         orig_channel_id=result.get("orig_channel_id"), reason=result.get("reason"),
-                                         input_id=result.get('id'), self_inflicted=result.get("self_inflicted"))
-            result_list.append(obj)
-        return result_list
-
     async def version_1(self):
         """DB migration v1"""
         async with db.Pool.acquire() as conn:
@@ -1329,6 +1164,10 @@ class PunishmentTimerRecords(db.DatabaseTable):
     __versions__ = [version_1]
 
 
+modlog_config = db.GuildConfigStore(GuildModLog)
+new_member_config = db.GuildConfigStore(GuildNewMember)
+
+
 def setup(bot):
     """Adds the moderation cog to the bot."""
     bot.add_cog(Moderation(bot))
@@ -439,21 +439,17 @@ def setup(bot):
 class NewsSubscription(db.DatabaseTable):
     """Represents a single subscription of one news source to one channel"""
     __tablename__ = 'news_subs'
-    __uniques__ = 'id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            id serial PRIMARY KEY NOT NULL,
-            channel_id bigint NOT NULL,
-            guild_id bigint NOT NULL,
-            source varchar NOT NULL,
-            data varchar,
-            kind varchar NOT NULL
-            )""")
+    __columns__ = (
+        db.Column("id", "serial", primary_key=True),
+        db.Column("channel_id", "bigint"),
+        db.Column("guild_id", "bigint"),
+        db.Column("source", "varchar"),
+        db.Column("data", "varchar", nullable=True),
+        db.Column("kind", "varchar"),
+    )
+    __indexes__ = (
+        db.Index("source"),
+    )
 
     def __init__(self, channel_id: int, guild_id: int, source: str, kind: str, data: str = None, sub_id: int = None):
         super().__init__()
@@ -463,14 +459,3 @@ class NewsSubscription(db.DatabaseTable):
         self.source = source
         self.kind = kind
         self.data = data
-
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = NewsSubscription(sub_id=result.get("id"), channel_id=result.get("channel_id"),
-                                   guild_id=result.get("guild_id"), source=result.get("source"),
-                                   kind=result.get("kind"), data=result.get("data"))
-            result_list.append(obj)
-        return result_list
@@ -12,7 +12,7 @@ from discord_slash import cog_ext, SlashContext
 
 from dozer.context import DozerContext
 from ._utils import *
-from .actionlogs import CustomJoinLeaveMessages
+from ..Components.CustomJoinLeaveMessages import join_leave_config
 from .. import db
 from ..bot import DOZER_LOGGER
 from ..db import *
@@ -163,9 +163,8 @@ class Roles(Cog):
                 cant_give.add(role.name)
             else:
                 valid.add(role)
-        for entry in restore:
-            # Not missing anymore - remove the record to free up the primary key
-            await MissingRole.delete(role_id=entry.role_id, member_id=entry.member_id)
+        # Not missing anymore - remove the records to free up the primary keys
+        await MissingRole.bulk_delete({"role_id": entry.role_id, "member_id": entry.member_id} for entry in restore)
 
         await member.add_roles(*valid)
         if not missing and not cant_give:
@@ -179,8 +178,8 @@ class Roles(Cog):
             e.add_field(name='I couldn\'t restore these roles, as I don\'t have permission.',
                         value='\n'.join(sorted(cant_give)))
         try:
-            dest_id = await CustomJoinLeaveMessages.get_by(guild_id=member.guild.id)
-            dest = member.guild.get_channel(dest_id[0].memberlog_channel)
+            dest_id = await join_leave_config.query_all(member.guild.id)
+            dest = member.guild.get_channel(dest_id[0].channel_id)
             await dest.send(embed=e)
         except discord.Forbidden:
             pass
@@ -192,9 +191,9 @@ class Roles(Cog):
         """Saves a member's roles when they leave in case they rejoin."""
         guild_id = member.guild.id
         member_id = member.id
-        for role in member.roles[1:]:  # Exclude the @everyone role
-            db_member = MissingRole(role_id=role.id, role_name=role.name, guild_id=guild_id, member_id=member_id)
-            await db_member.update_or_add()
+        await MissingRole.bulk_upsert(
+            MissingRole(role_id=role.id, role_name=role.name, guild_id=guild_id, member_id=member_id)
+            for role in member.roles[1:])  # Exclude the @everyone role
 
     async def giveme_purge(self, rolelist):
         """Purges roles in the giveme database that no longer exist. The argument is a list of GiveableRole objects."""
@@ -763,20 +762,12 @@ class Roles(Cog):
 class RoleMenu(db.DatabaseTable):
     """Contains a role menu, used for editing and initial create"""
     __tablename__ = 'role_menus'
-    __uniques__ = 'message_id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            guild_id bigint NOT NULL,
-            channel_id bigint NOT NULL,
-            message_id bigint NOT NULL,
-            name text NOT NULL,
-            PRIMARY KEY (message_id)
-            )""")
+    __columns__ = (
+        db.Column("guild_id", "bigint"),
+        db.Column("channel_id", "bigint"),
+        db.Column("message_id", "bigint", primary_key=True),
+        db.Column("name", "text"),
+    )
 
     def __init__(self, guild_id: int, channel_id: int, message_id: int, name: str):
         super().__init__()
@@ -785,35 +776,20 @@ class RoleMenu(db.DatabaseTable):
         self.message_id = message_id
         self.name = name
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = RoleMenu(guild_id=result.get("guild_id"), channel_id=result.get("channel_id"),
-                           message_id=result.get("message_id"), name=result.get("name"))
-            result_list.append(obj)
-        return result_list
-
 
 class ReactionRole(db.DatabaseTable):
     """Contains a role menu entry"""
     __tablename__ = 'reaction_roles'
-    __uniques__ = 'message_id, role_id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            guild_id bigint NOT NUll,
-            channel_id bigint NOT NULL,
-            message_id bigint NOT NULL,
-            role_id bigint NOT NULL,
-            reaction varchar NOT NULL,
-            PRIMARY KEY (message_id, role_id)
-            )""")
+    __columns__ = (
+        db.Column("guild_id", "bigint"),
+        db.Column("channel_id", "bigint"),
+        db.Column("message_id", "bigint", primary_key=True),
+        db.Column("role_id", "bigint", primary_key=True),
+        db.Column("reaction", "varchar"),
+    )
+    __indexes__ = (
+        db.Index("message_id", "reaction"),
+    )
 
     def __init__(self, guild_id: int, channel_id: int, message_id: int, role_id: int, reaction: str):
         super().__init__()
@@ -823,34 +799,16 @@ class ReactionRole(db.DatabaseTable):
         self.role_id = role_id
         self.reaction = reaction
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = ReactionRole(guild_id=result.get("guild_id"), channel_id=result.get("channel_id"),
-                               message_id=result.get("message_id"),
-                               role_id=result.get("role_id"), reaction=result.get("reaction"))
-            result_list.append(obj)
-        return result_list
-
 
 class GiveableRole(db.DatabaseTable):
     """Database object for maintaining a list of giveable roles."""
     __tablename__ = 'giveable_roles'
-    __uniques__ = 'role_id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            guild_id bigint NOT NULL,
-            role_id bigint PRIMARY KEY NOT NULL,
-            name varchar NOT NULL,
-            norm_name varchar NOT NULL
-            )""")
+    __columns__ = (
+        db.Column("guild_id", "bigint"),
+        db.Column("role_id", "bigint", primary_key=True),
+        db.Column("name", "varchar"),
+        db.Column("norm_name", "varchar"),
+    )
 
     def __init__(self, guild_id: int, role_id: int, norm_name: str, name: str):
         super().__init__()
@@ -859,16 +817,6 @@ class GiveableRole(db.DatabaseTable):
         self.name = name
         self.norm_name = norm_name
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = GiveableRole(guild_id=result.get("guild_id"), role_id=result.get("role_id"),
-                               name=result.get("name"), norm_name=result.get("norm_name"))
-            result_list.append(obj)
-        return result_list
-
     @classmethod
     def from_role(cls, role: discord.Role):
         """Creates a GiveableRole record from a discord.Role."""
@@ -878,20 +826,15 @@ class GiveableRole(db.DatabaseTable):
 class MissingRole(db.DatabaseTable):
     """Holds the roles of those who leave"""
     __tablename__ = 'missing_roles'
-    __uniques__ = 'role_id, member_id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            guild_id bigint NOT NULL,
-            member_id bigint NOT NULL,
-            role_id bigint NOT NULL,
-            role_name varchar NOT NULL,
-            PRIMARY KEY (role_id, member_id)
-            )""")
+    __columns__ = (
+        db.Column("guild_id", "bigint"),
+        db.Column("role_id", "bigint", primary_key=True),
+        db.Column("member_id", "bigint", primary_key=True),
+        db.Column("role_name", "varchar"),
+    )
+    __indexes__ = (
+        db.Index("guild_id", "member_id"),
+    )
 
     def __init__(self, guild_id: int, member_id: int, role_id: int, role_name: str):
         super().__init__()
@@ -900,35 +843,18 @@ class MissingRole(db.DatabaseTable):
         self.role_id = role_id
         self.role_name = role_name
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = MissingRole(guild_id=result.get("guild_id"), role_id=result.get("role_id"),
-                              member_id=result.get("member_id"), role_name=result.get("role_name"))
-            result_list.append(obj)
-        return result_list
-
 
 class TempRoleTimerRecords(db.DatabaseTable):
     """TempRole Timer Records"""
 
     __tablename__ = 'temp_role_timers'
-    __uniques__ = 'id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            id serial PRIMARY KEY NOT NULL,
-            guild_id bigint NOT NULL,
-            target_id bigint NOT NULL,
-            target_role_id bigint NOT NULL,
-            removal_ts bigint NOT NULL
-            )""")
+    __columns__ = (
+        db.Column("id", "serial", primary_key=True),
+        db.Column("guild_id", "bigint"),
+        db.Column("target_id", "bigint"),
+        db.Column("target_role_id", "bigint"),
+        db.Column("removal_ts", "bigint"),
+    )
 
     def __init__(self, guild_id: int, target_id: int, target_role_id: int, removal_ts: int, input_id: int = None):
         super().__init__()
@@ -938,19 +864,6 @@ class TempRoleTimerRecords(db.DatabaseTable):
         self.target_role_id = target_role_id
         self.removal_ts = removal_ts
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = TempRoleTimerRecords(guild_id=result.get("guild_id"),
-                                       target_id=result.get("target_id"),
-                                       target_role_id=result.get("target_role_id"),
-                                       removal_ts=result.get("removal_ts"),
-                                       input_id=result.get('id'))
-            result_list.append(obj)
-        return result_list
-
 
 def setup(bot):
     """Adds the roles cog to the main bot project."""
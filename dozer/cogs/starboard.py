@@ -334,20 +334,13 @@ def setup(bot):
 class StarboardConfig(db.DatabaseTable):
     """Each starboard-related setting"""
     __tablename__ = 'starboard_settings'
-    __uniques__ = 'guild_id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            guild_id bigint PRIMARY KEY NOT NULL,
-            channel_id bigint NOT NULL,
-            star_emoji varchar NOT NULL,
-            cancel_emoji varchar,
-            threshold bigint NOT NULL
-            )""")
+    __columns__ = (
+        db.Column("guild_id", "bigint", primary_key=True),
+        db.Column("channel_id", "bigint"),
+        db.Column("star_emoji", "varchar"),
+        db.Column("cancel_emoji", "varchar", nullable=True),
+        db.Column("threshold", "bigint"),
+    )
 
     def __init__(self, guild_id: int, channel_id: int, star_emoji: str, threshold: int, cancel_emoji: str = None):
         super().__init__()
@@ -357,34 +350,19 @@ class StarboardConfig(db.DatabaseTable):
         self.cancel_emoji = cancel_emoji
         self.threshold = threshold
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = StarboardConfig(guild_id=result.get("guild_id"), channel_id=result.get("channel_id"),
-                                  star_emoji=result.get('star_emoji'), cancel_emoji=result.get('cancel_emoji'),
-                                  threshold=result.get('threshold'))
-            result_list.append(obj)
-        return result_list
-
 
 class StarboardMessage(db.DatabaseTable):
     """Each starboard-related setting"""
     __tablename__ = 'starboard_message'
-    __uniques__ = 'message_id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            message_id bigint PRIMARY KEY NOT NULL,
-            channel_id bigint NOT NULL,
-            starboard_message_id bigint NOT NULL,
-            author_id bigint NOT NULL
-            )""")
+    __columns__ = (
+        db.Column("message_id", "bigint", primary_key=True),
+        db.Column("channel_id", "bigint"),
+        db.Column("starboard_message_id", "bigint"),
+        db.Column("author_id", "bigint"),
+    )
+    __indexes__ = (
+        db.Index("starboard_message_id"),
+    )
 
     def __init__(self, message_id: int, channel_id: int, starboard_message_id: int, author_id: int):
         super().__init__()
@@ -392,15 +370,3 @@ class StarboardMessage(db.DatabaseTable):
         self.channel_id = channel_id
         self.starboard_message_id = starboard_message_id
         self.author_id = author_id
-
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = StarboardMessage(message_id=result.get("message_id"),
-                                   channel_id=result.get("channel_id"),
-                                   starboard_message_id=result.get("starboard_message_id"),
-                                   author_id=result.get('author_id'))
-            result_list.append(obj)
-        return result_list
@@ -16,7 +16,7 @@ class Voice(Cog):
     async def auto_ptt_check(voice_channel: discord.VoiceChannel):
         """Handles voice activity when members join/leave voice channels"""
         total_users = len(voice_channel.channel.members)
-        config = await AutoPTT.get_by(channel_id=voice_channel.channel.id)
+        config = await autoptt_config.query_all(voice_channel.channel.id)
         if config:
             everyone = voice_channel.channel.guild.default_role  # grab the @everyone role
             perms = voice_channel.channel.overwrites_for(everyone)  # grab the @everyone overwrites
@@ -36,12 +36,12 @@ class Voice(Cog):
             # before and after are voice states
             if before.channel is not None:
                 # leave event, take role
-                config = await Voicebinds.get_by(channel_id=before.channel.id)
+                config = await voicebinds_config.query_all(before.channel.id)
                 if len(config) != 0:
                     await member.remove_roles(member.guild.get_role(config[0].role_id))
             if after.channel is not None:
                 # join event, give role
-                config = await Voicebinds.get_by(channel_id=after.channel.id)
+                config = await voicebinds_config.query_all(after.channel.id)
                 if len(config) != 0:
                     await member.add_roles(member.guild.get_role(config[0].role_id))
 
@@ -129,7 +129,7 @@ class Voice(Cog):
         config = await Voicebinds.get_by(channel_id=voice_channel.id)
         if len(config) != 0:
             role = ctx.guild.get_role(config[0].role_id)
-            await Voicebinds.delete(id=config[0].id)
+            await Voicebinds.delete(id=config[0].id, channel_id=voice_channel.id)
             await ctx.send(
                 "Role `{role}` will no longer be given to users in voice channel `{voice_channel}`!".format(
                     role=role, voice_channel=voice_channel))
@@ -160,20 +160,12 @@ class Voice(Cog):
 class Voicebinds(db.DatabaseTable):
     """DB object to keep track of voice to text channel access bindings."""
     __tablename__ = 'voicebinds'
-
-    __uniques__ = 'id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            id SERIAL PRIMARY KEY NOT NULL,
-            guild_id bigint NOT NULL,
-            channel_id bigint null,
-            role_id bigint null
-            )""")
+    __columns__ = (
+        db.Column("id", "serial", primary_key=True),
+        db.Column("guild_id", "bigint"),
+        db.Column("channel_id", "bigint", nullable=True),
+        db.Column("role_id", "bigint", nullable=True),
+    )
 
     def __init__(self, guild_id: int, channel_id: int, role_id: int, row_id: int = None):
         super().__init__()
@@ -183,49 +175,23 @@ class Voicebinds(db.DatabaseTable):
         self.channel_id = channel_id
         self.role_id = role_id
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = Voicebinds(row_id=result.get("id"),
-                             guild_id=result.get("guild_id"),
-                             channel_id=result.get("channel_id"),
-                             role_id=result.get("role_id"))
-            result_list.append(obj)
-        return result_list
-
 
 class AutoPTT(db.DatabaseTable):
     """DB object to keep track of voice to text channel access bindings."""
     __tablename__ = 'autoptt'
-    __uniques__ = 'channel_id'
-
-    @classmethod
-    async def initial_create(cls):
-        """Create the table in the database"""
-        async with db.Pool.acquire() as conn:
-            await conn.execute(f"""
-            CREATE TABLE {cls.__tablename__} (
-            channel_id bigint PRIMARY KEY NOT NULL,
-            ptt_limit bigint null
-            )""")
+    __columns__ = (
+        db.Column("channel_id", "bigint", primary_key=True),
+        db.Column("ptt_limit", "bigint", nullable=True),
+    )
 
     def __init__(self, channel_id: int, ptt_limit: int):
         super().__init__()
         self.channel_id = channel_id
         self.ptt_limit = ptt_limit
 
-    @classmethod
-    async def get_by(cls, **kwargs):
-        results = await super().get_by(**kwargs)
-        result_list = []
-        for result in results:
-            obj = AutoPTT(
-                channel_id=result.get("channel_id"),
-                ptt_limit=result.get("ptt_limit"))
-            result_list.append(obj)
-        return result_list
+
+voicebinds_config = db.GuildConfigStore(Voicebinds, key="channel_id")
+autoptt_config = db.GuildConfigStore(AutoPTT, key="channel_id")
 
 
 def setup(bot):
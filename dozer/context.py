@@ -1,4 +1,5 @@
 """Class that holds dozercontext. """
+import discord
 from discord.ext import commands
 
 from dozer import utils
@@ -12,3 +13,51 @@ class DozerContext(commands.Context):
         if content is not None:
             content = utils.clean(self, content, mass=True, member=False, role=False, channel=False)
         return await super().send(content, **kwargs)
+
+
+class MessageContext:
+    """What the message hooks share about one incoming message, worked out once before the first hook runs.
+    A hook that deletes the message sets `deleted`, and the hooks after it are skipped. `command_ctx` is None for gate
+    hooks, which run before it is worked out, and for messages sent by bots.
+    """
+    __slots__ = ("message", "command_ctx", "role_ids", "deleted", "_configs")
+
+    def __init__(self, message: discord.Message, command_ctx: DozerContext = None):
+        self.message = message
+        self.command_ctx = command_ctx
+        self.role_ids = frozenset(role.id for role in getattr(message.author, "roles", ()))
+        self.deleted = False
+        self._configs = {}  # dct[GuildConfigStore] = the guild's rows in it
+
+    @property
+    def guild(self) -> discord.Guild:
+        """The guild the message was sent in, or None in DMs"""
+        return self.message.guild
+
+    @property
+    def author(self):
+        """The message's author; a Member in guilds"""
+        return self.message.author
+
+    @property
+    def is_command(self) -> bool:
+        """Whether the message invokes a command"""
+        return self.command_ctx is not None and self.command_ctx.valid
+
+    @property
+    def prefix(self):
+        """The prefix the message starts with, or None if it doesn't start with one or its command context hasn't been
+        worked out"""
+        return self.command_ctx.prefix if self.command_ctx is not None else None
+
+    async def config_rows(self, store) -> list:
+        """The guild's rows in a GuildConfigStore, read at most once per message however many hooks ask"""
+        rows = self._configs.get(store)
+        if rows is None:
+            rows = self._configs[store] = await store.query_all(self.guild.id) if self.guild is not None else []
+        return rows
+
+    async def config(self, store):
+        """The guild's first row in a GuildConfigStore, or None"""
+        rows = await self.config_rows(store)
+        return rows[0] if rows else None
@@ -1,67 +1,344 @@
 """Provides database storage for the Dozer Discord bot"""
+import asyncio
+import contextlib
+import functools
+import json
 import logging
-from typing import List, Dict
+import time
+import typing
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import List, Dict, Tuple
 
 import asyncpg
 
+from .querystats import InstrumentedPool, sample_pool, stats as query_stats
+
 DOZER_LOGGER = logging.getLogger(__name__)
 
 Pool = None
 
+# Writes made through DatabaseTable are announced on this channel so other instances sharing the database can drop
+# whatever they have cached for the rows involved. INSTANCE_ID lets an instance ignore its own announcements.
+NOTIFY_CHANNEL = "dozer_table_changes"
+INSTANCE_ID = uuid.uuid4().hex
+_listen_conn = None
+_sampler = None  # task sampling the pool's occupancy, kept so it can be cancelled
+
+# Key of the advisory lock held while migrating, so that only one instance migrates at a time
+MIGRATION_LOCK_ID = 0x446f7a6572
+
+
+async def db_init(db_url, *, min_size: int = 10, max_size: int = 10, max_inactive_connection_lifetime: float = 300.0,
+                  statement_cache_size: int = 100, command_timeout: float = 15, sample_interval: float = 60.0):
+    """Initializes the database connection pool and starts sampling its occupancy every sample_interval seconds"""
+    global Pool, _sampler
+    Pool = InstrumentedPool(await asyncpg.create_pool(
+        dsn=db_url, min_size=min_size, max_size=max_size,
+        max_inactive_connection_lifetime=max_inactive_connection_lifetime,
+        statement_cache_size=statement_cache_size, command_timeout=command_timeout))
+    query_stats.pool_max_size = max_size
+    if _sampler is not None:
+        _sampler.cancel()
+        _sampler = None
+    if sample_interval:
+        _sampler = asyncio.ensure_future(sample_pool(sample_interval))
+
+
+async def db_close():
+    """Stops sampling the pool, then closes the change listener's connection and the pool"""
+    global Pool, _sampler, _listen_conn
+    if _sampler is not None:
+        _sampler.cancel()
+        _sampler = None
+    if _listen_conn is not None:
+        await _listen_conn.close()
+        _listen_conn = None
+    if Pool is not None:
+        await Pool.close()
+        Pool = None
+
+
+async def db_listen(db_url):
+    """Subscribes to table change notifications from other instances on a dedicated connection"""
+    global _listen_conn
+    _listen_conn = await asyncpg.connect(dsn=db_url)
+    await _listen_conn.add_listener(NOTIFY_CHANNEL, _on_table_change)
+    DOZER_LOGGER.info(f"Listening for table changes on channel {NOTIFY_CHANNEL}")
 
-async def db_init(db_url):
-    """Initializes the database connection"""
-    global Pool
-    Pool = await asyncpg.create_pool(dsn=db_url, command_timeout=15)
+
+def _on_table_change(_conn, _pid, _channel, payload):
+    """asyncpg notification callback: route a change published by another instance to the affected tables"""
+    try:
+        change = json.loads(payload)
+    except ValueError:
+        DOZER_LOGGER.warning(f"Ignoring malformed table change notification: {payload!r}")
+        return
+    if change.get("origin") == INSTANCE_ID:
+        return  # this instance already invalidated its own caches when it made the write
+    classes = list(DatabaseTable._tables.get(change.get("table"), {}).values())
+    if classes:
+        # caches of every class mapping the table are invalidated together, so one class is enough
+        classes[0]._invalidate_caches(change.get("columns", {}))
+    for cls in classes:
+        cls._apply_remote_change(change.get("columns", {}))
+
+
+def _notifiable(value):
+    """Whether a column value is worth sending in a change notification. Anything left out is treated as a wildcard by
+    the receiver, which keeps payloads well under Postgres' 8000 byte NOTIFY limit."""
+    if isinstance(value, str):
+        return len(value) <= 256
+    return value is None or isinstance(value, (bool, int, float))
 
 
 async def db_migrate():
-    """Gets all subclasses and checks their migrations."""
-    async with Pool.acquire() as conn:
-        await conn.execute("""CREATE TABLE IF NOT EXISTS versions (
-        table_name text PRIMARY KEY,
-        version_num int NOT NULL
-        )""")
+    """Gets all subclasses and checks their migrations.
+    Everything runs in one transaction holding an advisory lock, so a failed migration leaves the schema untouched
+    and a second instance starting at the same time waits for the first rather than racing it."""
+    global Pool
     DOZER_LOGGER.info("Checking for db migrations")
+    started = time.perf_counter()
+    timings = []
+    async with Pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK_ID)
+            await conn.execute("""CREATE TABLE IF NOT EXISTS versions (
+            table_name text PRIMARY KEY,
+            version_num int NOT NULL
+            )""")
+            tables = DatabaseTable.__subclasses__()
+            records = await conn.fetch("""
+            SELECT t.table_name, v.version_num
+            FROM unnest($1::text[]) AS t(table_name) LEFT JOIN versions v USING (table_name)
+            WHERE EXISTS(SELECT 1 FROM information_schema.tables i WHERE i.table_name = t.table_name)""",
+                                       list({cls.__tablename__ for cls in tables}))
+            # table name -> version, with None for tables that exist but predate the versions table
+            state = {record["table_name"]: record["version_num"] for record in records}
+            pool, Pool = Pool, _MigrationPool(conn)
+            try:
+                for cls in tables:
+                    table_start = time.perf_counter()
+                    action = await _migrate_table(cls, state)
+                    if action:
+                        timings.append((cls.__tablename__, action, time.perf_counter() - table_start))
+            finally:
+                Pool = pool
+    for table, action, elapsed in timings:
+        DOZER_LOGGER.info(f"  {table}: {action} in {elapsed * 1000:.1f}ms")
+    DOZER_LOGGER.info(f"Checked {len(tables)} tables in {(time.perf_counter() - started) * 1000:.1f}ms, "
+                      f"{len(timings)} changed")
+    await db_create_indexes()
+
+
+async def _migrate_table(cls, state):
+    """Brings one table up to date given the state read by db_migrate, which is updated to match.
+    Returns a description of what was done, or None if the table was already current."""
+    table = cls.__tablename__
+    if table not in state:
+        await cls.initial_create()
+        await cls.initial_migrate()
+        state[table] = 0
+        action = "created"
+        if cls.__columns__ and cls.__versions__:
+            # Tables created from their declaration start out at the latest version
+            await Pool.execute("""UPDATE versions SET version_num = $1 WHERE table_name = $2""",
+                               len(cls.__versions__), table)
+            state[table] = len(cls.__versions__)
+        return action
+    action = None
+    if state[table] is None:
+        # Migration/creation required, go to the function in the subclass for it
+        await cls.initial_migrate()
+        state[table] = 0
+        action = "versioned"
+    version = int(state[table])
+    if version < len(cls.__versions__):
+        # the version in the DB is less than the version in the bot, run all the migrate scripts necessary
+        DOZER_LOGGER.info(f"Table {table} is out of date attempting to migrate")
+        for i in range(version, len(cls.__versions__)):
+            # Run the update script for this version!
+            await cls.__versions__[i](cls)
+            DOZER_LOGGER.info(f"Successfully updated table {table} from version {i} to {i + 1}")
+        await Pool.execute("""UPDATE versions SET version_num = $1 WHERE table_name = $2""",
+                           len(cls.__versions__), table)
+        state[table] = len(cls.__versions__)
+        action = f"migrated from version {version} to {len(cls.__versions__)}"
+    return action
+
+
+class _MigrationPool:
+    """Stands in for Pool while db_migrate runs. Table create and migrate functions acquire their connections from
+    db.Pool, and this hands them all the migration's connection so their statements join its transaction."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        """Yields the migration connection"""
+        yield self._conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+async def db_create_indexes():
+    """Creates the secondary indexes tables declare in __indexes__ that don't exist yet, then logs how much each one
+    is used. Indexes are built CONCURRENTLY so a large table stays writable while the bot starts."""
+    indexes = {}
     for cls in DatabaseTable.__subclasses__():
-        exists = await Pool.fetchrow("""SELECT EXISTS(
-        SELECT 1
-        FROM information_schema.tables
-        WHERE
-        table_name = $1)""", cls.__tablename__)
-        if exists['exists']:
-            version = await Pool.fetchrow("""SELECT version_num FROM versions WHERE table_name = $1""",
-                                          cls.__tablename__)
-            if version is None:
-                # Migration/creation required, go to the function in the subclass for it
-                await cls.initial_migrate()
-                version = {"version_num": 0}
-            if int(version["version_num"]) < len(cls.__versions__):
-                # the version in the DB is less than the version in the bot, run all the migrate scripts necessary
-                DOZER_LOGGER.info(f"Table {cls.__tablename__} is out of date attempting to migrate")
-                for i in range(int(version["version_num"]), len(cls.__versions__)):
-                    # Run the update script for this version!
-                    await cls.__versions__[i](cls)
-                    DOZER_LOGGER.info(f"Successfully updated table {cls.__tablename__} from version {i} to {i + 1}")
-                async with Pool.acquire() as conn:
-                    await conn.execute("""UPDATE versions SET version_num = $1 WHERE table_name = $2""",
-                                       len(cls.__versions__), cls.__tablename__)
-        else:
-            await cls.initial_create()
-            await cls.initial_migrate()
+        for index in cls.__indexes__:
+            indexes[index.name_for(cls.__tablename__)] = (cls.__tablename__, index)
+    if not indexes:
+        return
+    present = {record["indexname"]: record["indisvalid"] for record in await Pool.fetch("""
+    SELECT c.relname AS indexname, i.indisvalid
+    FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE c.relname = ANY($1::text[])""", list(indexes))}
+    for name, (table, index) in indexes.items():
+        if present.get(name):
+            continue
+        if name in present:
+            # a concurrent build that was interrupted leaves an invalid index behind which is never used
+            DOZER_LOGGER.warning(f"Index {name} on {table} is invalid, rebuilding it")
+            await Pool.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        start = time.perf_counter()
+        try:
+            await Pool.execute(index.definition(name, table))
+        except asyncpg.PostgresError as err:
+            DOZER_LOGGER.error(f"Failed to create index {name} on {table}: {err}")
+            continue
+        DOZER_LOGGER.info(f"Created index {name} on {table} in {time.perf_counter() - start:.2f}s")
+    for record in await index_usage(list(indexes)):
+        level = logging.INFO if record["idx_scan"] else logging.WARNING
+        DOZER_LOGGER.log(level, f"Index {record['indexname']} on {record['tablename']}: {record['idx_scan']} scans, "
+                                f"{record['idx_tup_read']} tuples read, table has had {record['seq_scan']} "
+                                f"sequential scans")
+
+
+async def index_usage(index_names=None):
+    """Returns scan counts for the given indexes (or every index in the schema) alongside their table's sequential
+    scan count, busiest first. The counters are cumulative since Postgres' statistics were last reset."""
+    return await Pool.fetch("""
+    SELECT s.relname AS tablename, s.indexrelname AS indexname, s.idx_scan, s.idx_tup_read, t.seq_scan
+    FROM pg_stat_user_indexes s JOIN pg_stat_user_tables t ON t.relid = s.relid
+    WHERE $1::text[] IS NULL OR s.indexrelname = ANY($1::text[])
+    ORDER BY s.idx_scan DESC, s.indexrelname""", index_names)
+
+
+class Column:
+    """A column of a DatabaseTable, declared in the table's __columns__"""
+    __slots__ = ("name", "sql_type", "primary_key", "unique", "nullable", "default")
+
+    def __init__(self, name: str, sql_type: str, *, primary_key: bool = False, unique: bool = False,
+                 nullable: bool = False, default: str = None):
+        self.name = name
+        self.sql_type = sql_type
+        self.primary_key = primary_key
+        self.unique = unique  # all columns flagged unique form one UNIQUE constraint together
+        self.nullable = nullable
+        self.default = default  # SQL expression
+
+    def definition(self) -> str:
+        """The column's definition as it appears in CREATE TABLE"""
+        definition = f"{self.name} {self.sql_type}"
+        if not self.nullable:
+            definition += " NOT NULL"
+        if self.default is not None:
+            definition += f" DEFAULT {self.default}"
+        return definition
+
+
+class Index:
+    """A secondary index on a DatabaseTable, declared in the table's __indexes__.
+    Columns may carry an ordering, e.g. Index("guild_id", "total_xp DESC")."""
+    __slots__ = ("columns", "name", "unique", "where")
 
+    def __init__(self, *columns: str, name: str = None, unique: bool = False, where: str = None):
+        self.columns = columns
+        self.name = name
+        self.unique = unique
+        self.where = where  # SQL predicate for a partial index
 
-class DatabaseTable:
-    """Defines a database table"""
+    def name_for(self, table: str) -> str:
+        """The index's name, derived from the table and columns unless given explicitly"""
+        if self.name:
+            return self.name
+        # Postgres truncates identifiers to 63 bytes, which would make the existence check miss
+        return f"{table}_{'_'.join(column.split()[0] for column in self.columns)}_idx"[:63]
+
+    def definition(self, name: str, table: str) -> str:
+        """The CREATE INDEX statement for this index"""
+        statement = f"CREATE {'UNIQUE ' if self.unique else ''}INDEX CONCURRENTLY IF NOT EXISTS {name} " \
+                    f"ON {table} ({', '.join(self.columns)})"
+        if self.where:
+            statement += f" WHERE {self.where}"
+        return statement
+
+
+class _TableMeta(type):
+    """Gives tables that declare __columns__ a matching __slots__, so their rows don't each carry a __dict__"""
+
+    def __new__(mcs, name, bases, namespace, **kwargs):
+        columns = namespace.get("__columns__")
+        if columns and "__slots__" not in namespace:
+            namespace["__slots__"] = tuple(column.name for column in columns)
+        return super().__new__(mcs, name, bases, namespace, **kwargs)
+
+
+class DatabaseTable(metaclass=_TableMeta):
+    """Defines a database table.
+    Tables can either declare their schema in __columns__, which derives __uniques__, initial_create and the row
+    conversion in get_by from it, or write those by hand.
+    """
+    __slots__ = ()
     __tablename__: str = ''
     __versions__: List[int] = []
     __uniques__: List[str] = []
+    __columns__: Tuple[Column, ...] = ()
+    __indexes__: Tuple[Index, ...] = ()
+
+    # Compiled SQL keyed by (statement kind, column signature). Each subclass gets its own registry in
+    # __init_subclass__, so the same signature on two tables never collides.
+    _statements: Dict[Tuple[str, Tuple[str, ...]], str] = {}
+    _unique_columns: Tuple[str, ...] = ()
+    _column_names: Tuple[str, ...] = ()
+    _column_setters: Tuple[Tuple[str, typing.Callable], ...] = ()
+    # ConfigCaches reading from this table, invalidated on every write made through update_or_add/delete
+    _caches: "weakref.WeakSet[ConfigCache]" = weakref.WeakSet()
+    # Callbacks run with the column values of each write another instance makes to this table
+    _listeners: List[typing.Callable] = []
+    # __tablename__ -> {qualified class name -> class}; more than one class may map the same table
+    _tables: Dict[str, Dict[str, type]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.__columns__ and "__uniques__" not in cls.__dict__:
+            # kept in the "a, b" string form so it can still be interpolated into hand-written ON CONFLICT clauses
+            cls.__uniques__ = ", ".join([column.name for column in cls.__columns__ if column.primary_key] or
+                                        [column.name for column in cls.__columns__ if column.unique])
+        cls._column_names = tuple(column.name for column in cls.__columns__)
+        # slot descriptors' __set__, so from_record assigns without going through attribute lookup
+        cls._column_setters = tuple((name, getattr(cls, name).__set__) for name in cls._column_names)
+        cls._statements = {}
+        cls._caches = weakref.WeakSet()
+        cls._listeners = []
+        # keyed by qualified name so that reloading a cog replaces its tables rather than adding duplicates
+        DatabaseTable._tables.setdefault(cls.__tablename__, {})[f"{cls.__module__}.{cls.__qualname__}"] = cls
+        # __uniques__ is written as either "a, b" or ['a', 'b'] across the codebase; normalize it once here
+        uniques = cls.__uniques__.split(",") if isinstance(cls.__uniques__, str) else cls.__uniques__
+        cls._unique_columns = tuple(column.strip() for column in uniques if column.strip())
 
     # Declare the migrate/create functions
     @classmethod
     async def initial_create(cls):
         """Create the table in the database"""
-        raise NotImplementedError("Database schema not implemented!")
+        if not cls.__columns__:
+            raise NotImplementedError("Database schema not implemented!")
+        async with Pool.acquire() as conn:
+            await conn.execute(cls._compile("create", ()))
 
     @classmethod
     async def initial_migrate(cls):
@@ -73,12 +350,99 @@ class DatabaseTable:
     def nullify():
         """Function to be referenced when a table entry value needs to be set to null"""
 
+    @classmethod
+    def _compile(cls, kind: str, columns: Tuple[str, ...]) -> str:
+        """Return the SQL for a statement of the given kind over the given columns, building it on first use.
+        Because the same string is handed to asyncpg every time, each pooled connection prepares it once and then
+        reuses the prepared statement from its own statement cache."""
+        key = (kind, columns)
+        statement = cls._statements.get(key)
+        if statement is None:
+            statement = cls._statements[key] = getattr(cls, f"_build_{kind}")(columns)
+        return statement
+
+    @classmethod
+    def _build_create(cls, _columns) -> str:
+        definitions = [column.definition() for column in cls.__columns__]
+        for constraint, flag in (("PRIMARY KEY", "primary_key"), ("UNIQUE", "unique")):
+            names = [column.name for column in cls.__columns__ if getattr(column, flag)]
+            if names:
+                definitions.append(f"{constraint} ({', '.join(names)})")
+        body = ",\n".join(definitions)
+        return f"CREATE TABLE {cls.__tablename__} (\n{body}\n)"
+
+    @classmethod
+    def _build_select(cls, columns: Tuple[str, ...]) -> str:
+        if not columns:
+            return f"SELECT * FROM {cls.__tablename__};"
+        conditions = " AND ".join(f"{column_name} = ${i + 1}" for (i, column_name) in enumerate(columns))
+        return f"SELECT * FROM {cls.__tablename__} WHERE {conditions};"
+
+    @classmethod
+    def _build_delete(cls, columns: Tuple[str, ...]) -> str:
+        if not columns:
+            # Should this be a warning/error? It's almost certainly not intentional
+            return f"TRUNCATE {cls.__tablename__};"
+        conditions = " AND ".join(f"{column_name} = ${i + 1}" for (i, column_name) in enumerate(columns))
+        return f"DELETE FROM {cls.__tablename__} WHERE {conditions};"
+
+    @classmethod
+    def _on_conflict(cls, columns: Tuple[str, ...]) -> str:
+        # Skip updating anything that has a unique constraint on it
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns
+                            if column not in cls._unique_columns)
+        action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        return f"ON CONFLICT ({', '.join(cls._unique_columns)}) {action}"
+
+    @classmethod
+    def _build_upsert(cls, columns: Tuple[str, ...]) -> str:
+        return f"""
+                INSERT INTO {cls.__tablename__} ({", ".join(columns)})
+                VALUES({','.join(f'${i + 1}' for i in range(len(columns)))})
+                {cls._on_conflict(columns)};
+                """
+
+    @classmethod
+    def _build_staging(cls, columns: Tuple[str, ...]) -> str:
+        # Same column types as the real table but no constraints, so partial rows and duplicates can be staged
+        return f"""
+                CREATE TEMPORARY TABLE {cls._staging_table()} ON COMMIT DROP AS
+                SELECT {", ".join(columns)} FROM {cls.__tablename__} WITH NO DATA;
+                """
+
+    @classmethod
+    def _build_bulk_upsert(cls, columns: Tuple[str, ...]) -> str:
+        return f"""
+                INSERT INTO {cls.__tablename__} ({", ".join(columns)})
+                SELECT {", ".join(columns)} FROM {cls._staging_table()}
+                {cls._on_conflict(columns)};
+                """
+
+    @classmethod
+    def _build_bulk_increment(cls, columns: Tuple[str, ...]) -> str:
+        additions = ", ".join(f"{column} = {cls.__tablename__}.{column} + EXCLUDED.{column}" for column in columns
+                              if column not in cls._unique_columns)
+        return f"""
+                INSERT INTO {cls.__tablename__} ({", ".join(columns)})
+                SELECT {", ".join(columns)} FROM {cls._staging_table()}
+                ON CONFLICT ({', '.join(cls._unique_columns)}) DO UPDATE SET {additions};
+                """
+
+    @classmethod
+    def _build_bulk_delete(cls, columns: Tuple[str, ...]) -> str:
+        conditions = " AND ".join(f"{cls.__tablename__}.{column} = staged.{column}" for column in columns)
+        return f"DELETE FROM {cls.__tablename__} USING {cls._staging_table()} staged WHERE {conditions};"
+
+    @classmethod
+    def _staging_table(cls) -> str:
+        return f"staging_{cls.__tablename__}"
+
     async def update_or_add(self):
         """Assign the attribute to this object, then call this method to either insert the object if it doesn't exist in
         the DB or update it if it does exist. It will update every column not specified in __uniques__."""
         keys = []
         values = []
-        for var, value in self.__dict__.items():
+        for var, value in self._column_items():
             # Done so that the two are guaranteed to be in the same order, which isn't true of keys() and values()
             if value is self.nullify:
                 keys.append(var)
@@ -87,36 +451,32 @@ class DatabaseTable:
                 keys.append(var)
                 values.append(value)
 
-        updates = ""
-        for key in keys:
-            if key in self.__uniques__:
-                # Skip updating anything that has a unique constraint on it
-                continue
-            updates += f"{key} = EXCLUDED.{key}"
-            if keys.index(key) == len(keys) - 1:
-                updates += " ;"
-            else:
-                updates += ", \n"
+        statement = self._compile("upsert", tuple(keys))
         async with Pool.acquire() as conn:
-            if updates:
-                statement = f"""
-                INSERT INTO {self.__tablename__} ({", ".join(keys)})
-                VALUES({','.join(f'${i + 1}' for i in range(len(values)))})
-                ON CONFLICT ({self.__uniques__}) DO UPDATE
-                SET {updates}
-                """
-            else:
-                statement = f"""
-                INSERT INTO {self.__tablename__} ({", ".join(keys)})
-                VALUES({','.join(f'${i + 1}' for i in range(len(values)))})
-                ON CONFLICT ({self.__uniques__}) DO NOTHING;
-                """
             await conn.execute(statement, *values)
+            if self._watched():
+                columns = dict(zip(keys, values))
+                await self._publish_change(conn, columns)
+                self._invalidate_caches(columns)
+
+    def _column_items(self):
+        """(column, value) pairs for this row. Declared columns that were never assigned are None."""
+        if self.__columns__:
+            return [(name, getattr(self, name, None)) for name in self._column_names]
+        return self.__dict__.items()
+
+    @classmethod
+    def from_record(cls, record):
+        """Build a row of a table with declared __columns__ straight from an asyncpg Record, without calling __init__"""
+        row = cls.__new__(cls)
+        for name, setter in cls._column_setters:
+            setter(row, record.get(name))
+        return row
 
     def __repr__(self):
         values = ""
         first = True
-        for key, value in self.__dict__.items():
+        for key, value in self._column_items():
             if not first:
                 values += ", "
                 first = False
@@ -125,33 +485,176 @@ class DatabaseTable:
 
     # Class Methods
 
+    @classmethod
+    async def bulk_upsert(cls, records: typing.Iterable["DatabaseTable"]):
+        """update_or_add for many records at once. The records are COPYed into a temporary staging table and merged with
+        a single INSERT ... SELECT ... ON CONFLICT, so the number of statements doesn't grow with the number of records.
+        A column that is set on some records but None on others is written as NULL for the latter. If several records
+        share a key, the last one wins. Returns the number of distinct records written."""
+        records = list(records)
+        if len(records) == 1:
+            await records[0].update_or_add()  # one statement beats four for a single row
+            return 1
+        columns = {}  # used as an ordered set
+        rows = []
+        for record in records:
+            row = {}
+            for var, value in record._column_items():
+                if value is cls.nullify:
+                    row[var] = None
+                elif value is not None:
+                    row[var] = value
+                columns.setdefault(var)
+            rows.append(row)
+        if not rows:
+            return 0
+        columns = tuple(column for column in columns if any(column in row for row in rows))
+        if all(column in columns for column in cls._unique_columns):
+            # ON CONFLICT DO UPDATE can't touch the same row twice in one statement
+            rows = list({tuple(row.get(column) for column in cls._unique_columns): row for row in rows}.values())
+        await cls._merge_staged("bulk_upsert", columns, [tuple(row.get(column) for column in columns) for row in rows])
+        cls._invalidate_caches(cls._common_values(rows))
+        return len(rows)
+
+    @classmethod
+    async def bulk_increment(cls, records: typing.Iterable["DatabaseTable"], conn=None):
+        """Like bulk_upsert, but every column outside the unique key is a counter: a record whose key already exists adds
+        its values to the stored ones instead of replacing them. Records sharing a key are summed first, and every column
+        must be set on every record. Pass `conn` to run inside a transaction already open on that connection.
+        Returns the number of distinct keys written."""
+        totals = {}
+        columns = None
+        for record in records:
+            row = dict(record._column_items())
+            columns = columns or tuple(row)
+            key = tuple(row[column] for column in cls._unique_columns)
+            total = totals.get(key)
+            if total is None:
+                totals[key] = row
+            else:
+                for column, value in row.items():
+                    if column not in cls._unique_columns:
+                        total[column] += value
+        if not totals:
+            return 0
+        await cls._merge_staged("bulk_increment", columns, [tuple(row[column] for column in columns)
+                                                             for row in totals.values()], conn)
+        cls._invalidate_caches(cls._common_values(totals.values()))
+        return len(totals)
+
+    @classmethod
+    async def bulk_delete(cls, keys: typing.Iterable[dict]):
+        """delete for many keys at once. Each key is a dict of column=value criteria, and every key must name the same
+        columns. Keys are COPYed into a staging table and removed with a single DELETE ... USING. Returns the status
+        string from the DELETE, like delete does."""
+        keys = list(keys)
+        if not keys:
+            return "DELETE 0"
+        columns = tuple(keys[0])
+        result = await cls._merge_staged("bulk_delete", columns, [tuple(key[column] for column in columns) for key in keys])
+        cls._invalidate_caches(cls._common_values(keys))
+        return result
+
+    @classmethod
+    async def _merge_staged(cls, kind: str, columns: Tuple[str, ...], rows: List[tuple], conn=None):
+        """COPY rows into a fresh staging table and run the compiled statement of the given kind against it"""
+        if conn is None:
+            async with Pool.acquire() as conn:
+                return await cls._merge_staged(kind, columns, rows, conn)
+        async with conn.transaction():  # nested in the caller's transaction, if any, as a savepoint
+            await conn.execute(cls._compile("staging", columns))
+            await conn.copy_records_to_table(cls._staging_table(), records=rows, columns=columns)
+            result = await conn.execute(cls._compile(kind, columns))
+            if cls._watched():
+                await cls._publish_change(conn, cls._common_values(dict(zip(columns, row)) for row in rows))
+        return result
+
+    @staticmethod
+    def _common_values(rows: typing.Iterable[dict]) -> dict:
+        """The column values shared by every row, used to invalidate caches for a whole batch at once"""
+        rows = iter(rows)
+        common = dict(next(rows, {}))
+        for row in rows:
+            common = {column: value for column, value in common.items() if column in row and row[column] == value}
+        return common
+
     @classmethod
     async def get_by(cls, **filters):
         """Get a list of all records matching the given column=value criteria. This will grab all attributes, it's more
-        efficent to write your own SQL queries than use this one, but for a simple query this is fine."""
+        efficent to write your own SQL queries than use this one, but for a simple query this is fine.
+        Tables with declared __columns__ get rows of their own class back; others get asyncpg Records."""
+        # note: this code relies on subsequent iterations of the same dict having the same iteration order.
+        # This is an implementation detail of CPython 3.6 and a language guarantee in Python 3.7+.
+        statement = cls._compile("select", tuple(filters))
         async with Pool.acquire() as conn:
-            statement = f"SELECT * FROM {cls.__tablename__}"
-            if filters:
-                # note: this code relies on subsequent iterations of the same dict having the same iteration order.
-                # This is an implementation detail of CPython 3.6 and a language guarantee in Python 3.7+.
-                conditions = " AND ".join(f"{column_name} = ${i + 1}" for (i, column_name) in enumerate(filters))
-                statement = f"{statement} WHERE {conditions};"
-            else:
-                statement += ";"
-            return await conn.fetch(statement, *filters.values())
+            records = await conn.fetch(statement, *filters.values())
+        if cls.__columns__:
+            from_record = cls.from_record
+            return [from_record(record) for record in records]
+        return records
 
     @classmethod
     async def delete(cls, **filters):
         """Deletes by any number of criteria specified as column=value keyword arguments. Returns the number of entries deleted"""
+        # This code relies on properties of dicts - see get_by
+        statement = cls._compile("delete", tuple(filters))
         async with Pool.acquire() as conn:
-            if filters:
-                # This code relies on properties of dicts - see get_by
-                conditions = " AND ".join(f"{column_name} = ${i + 1}" for (i, column_name) in enumerate(filters))
-                statement = f"DELETE FROM {cls.__tablename__} WHERE {conditions};"
-            else:
-                # Should this be a warning/error? It's almost certainly not intentional
-                statement = f"TRUNCATE {cls.__tablename__};"
-            return await conn.execute(statement, *filters.values())
+            result = await conn.execute(statement, *filters.values())
+            if cls._watched():
+                await cls._publish_change(conn, filters)
+                cls._invalidate_caches(filters)
+        return result
+
+    @classmethod
+    def _watched(cls) -> bool:
+        """Whether anything caches or listens to this table. Writes to other tables skip invalidation and change
+        notifications entirely, which keeps the write path as cheap as the statement itself."""
+        for table in DatabaseTable._tables[cls.__tablename__].values():
+            if table._caches or table._listeners:
+                return True
+        return False
+
+    @classmethod
+    def _invalidate_caches(cls, columns: dict):
+        """Drop cached queries that a write touching rows with these column values could have changed."""
+        for table in DatabaseTable._tables.get(cls.__tablename__, {}).values():
+            for cache in table._caches:
+                if columns:
+                    cache.invalidate_matching(columns)
+                else:
+                    cache.clear()
+
+    @classmethod
+    async def _publish_change(cls, conn, columns: dict):
+        """Announce a write to other instances. Callers only announce tables something caches or listens to (see
+        _watched); every instance loads the same cogs, so that is the same set of tables on both ends."""
+        payload = json.dumps({
+            "origin": INSTANCE_ID,
+            "table": cls.__tablename__,
+            "columns": {column: value for column, value in columns.items() if _notifiable(value)},
+        })
+        await conn.execute("SELECT pg_notify($1, $2);", NOTIFY_CHANNEL, payload)
+
+    @classmethod
+    def _apply_remote_change(cls, columns: dict):
+        """Run the change listeners for a write another instance made"""
+        for listener in cls._listeners:
+            result = listener(columns)
+            if asyncio.iscoroutine(result):
+                asyncio.ensure_future(result)
+
+    @classmethod
+    def add_change_listener(cls, listener: typing.Callable):
+        """Call `listener` (a function or coroutine function) with the column values of every write another instance
+        makes to this table. Columns the writer filtered on or set are included when they are small scalars; a
+        missing column means the change could involve any value of it."""
+        cls._listeners.append(listener)
+
+    @classmethod
+    def remove_change_listener(cls, listener: typing.Callable):
+        """Stop calling a listener registered with add_change_listener"""
+        if listener in cls._listeners:
+            cls._listeners.remove(listener)
 
     @classmethod
     async def set_initial_version(cls):
@@ -160,11 +663,31 @@ class DatabaseTable:
 
 
 class ConfigCache:
-    """Class that will reduce calls to sqlalchemy as much as possible. Has no growth limit (yet)"""
+    """Class that will reduce calls to the database as much as possible.
+    Entries are kept in least-recently-used order and bounded by max_size, and expire after ttl seconds so misses
+    are eventually retried. Concurrent misses for the same query share one database round trip, and writes made
+    through the table's update_or_add/delete invalidate any entry they could have changed.
+    """
+    default_max_size = 5000
+    default_ttl = 600.0
 
-    def __init__(self, table):
-        self.cache = {}
+    def __init__(self, table, max_size: int = None, ttl: float = None):
+        self.cache = OrderedDict()  # query hash -> (expiry, records), least recently used first
         self.table = table
+        self.max_size = max_size or self.default_max_size
+        self.ttl = self.default_ttl if ttl is None else ttl
+        self._pending: Dict[tuple, asyncio.Future] = {}
+        # Every cached or pending query hash, indexed by the first unique column it filters on and that column's
+        # value, so a write only has to look at the queries it could have changed. Queries filtering on no unique
+        # column are under None, and every write drops them.
+        self._unique = frozenset(table._unique_columns)
+        self._pinned: Dict[str, Dict[typing.Any, set]] = {}
+        self._unpinned = set()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        table._caches.add(self)
 
     @staticmethod
     def _hash_dict(dic):
@@ -174,28 +697,227 @@ class ConfigCache:
 
     async def query_one(self, **kwargs):
         """Query the cache for an entry matching the kwargs, then try again using the database."""
-        query_hash = self._hash_dict(kwargs)
-        if query_hash not in self.cache:
-            self.cache[query_hash] = await self.table.get_by(**kwargs)
-            if len(self.cache[query_hash]) == 0:
-                self.cache[query_hash] = None
-            else:
-                self.cache[query_hash] = self.cache[query_hash][0]
-        return self.cache[query_hash]
+        records = await self.query_all(**kwargs)
+        return records[0] if records else None
 
     async def query_all(self, **kwargs):
         """Query the cache for all entries matching the kwargs, then try again using the database."""
         query_hash = self._hash_dict(kwargs)
-        if query_hash not in self.cache:
-            self.cache[query_hash] = await self.table.get_by(**kwargs)
-        return self.cache[query_hash]
+        entry = self.cache.get(query_hash)
+        if entry is not None:
+            expires_at, records = entry
+            if expires_at > time.monotonic():
+                self.cache.move_to_end(query_hash)
+                self.hits += 1
+                return records
+            del self.cache[query_hash]
+            self.expirations += 1
+        self.misses += 1
+
+        load = self._pending.get(query_hash)
+        if load is None:
+            load = asyncio.ensure_future(self.table.get_by(**kwargs))
+            self._pending[query_hash] = load
+            self._track(query_hash)
+            load.add_done_callback(functools.partial(self._finish_load, query_hash))
+        # shield so that one cancelled caller doesn't cancel the lookup for everyone else waiting on it
+        return await asyncio.shield(load)
+
+    def _finish_load(self, query_hash, load: asyncio.Future):
+        if self._pending.get(query_hash) is not load:
+            return  # invalidated while in flight; the result may already be stale
+        del self._pending[query_hash]
+        if load.cancelled() or load.exception() is not None:
+            self._untrack(query_hash)
+            return
+        self.cache[query_hash] = (time.monotonic() + self.ttl, load.result())
+        self.cache.move_to_end(query_hash)
+        while len(self.cache) > self.max_size:
+            evicted, _ = self.cache.popitem(last=False)
+            if evicted not in self._pending:
+                self._untrack(evicted)
+            self.evictions += 1
+
+    def _pin(self, query_hash: tuple) -> tuple:
+        """(column, value) of the first unique column the query filters on, or (None, None)"""
+        for column, value in query_hash:
+            if column in self._unique:
+                return column, value
+        return None, None
+
+    def _track(self, query_hash: tuple):
+        column, value = self._pin(query_hash)
+        if column is None:
+            self._unpinned.add(query_hash)
+        else:
+            self._pinned.setdefault(column, {}).setdefault(value, set()).add(query_hash)
+
+    def _untrack(self, query_hash: tuple):
+        column, value = self._pin(query_hash)
+        if column is None:
+            self._unpinned.discard(query_hash)
+            return
+        by_value = self._pinned[column]
+        hashes = by_value.get(value)
+        if hashes is not None:
+            hashes.discard(query_hash)
+            if not hashes:
+                del by_value[value]
+
+    def _forget(self, query_hash: tuple):
+        self.cache.pop(query_hash, None)
+        self._pending.pop(query_hash, None)
+        self._untrack(query_hash)
 
     def invalidate_entry(self, **kwargs):
         """Removes an entry from the cache if it exists - used to mark changed data."""
-        query_hash = self._hash_dict(kwargs)
-        if query_hash in self.cache:
-            del self.cache[query_hash]
+        self._forget(self._hash_dict(kwargs))
+
+    def invalidate_matching(self, columns: dict):
+        """Removes every entry whose query could match a row with the given column values, before or after the write.
+        Only the table's unique columns identify the row; any other column may have held a different value before an
+        update, so a query is kept only if it filters on a unique column in `columns` with a different value."""
+        candidates = list(self._unpinned)
+        for column, by_value in self._pinned.items():
+            if column in columns:
+                candidates.extend(by_value.get(columns[column], ()))
+            else:
+                for hashes in by_value.values():
+                    candidates.extend(hashes)
+        unique = self._unique
+        for query_hash in candidates:
+            if all(columns[column] == value for column, value in query_hash if column in columns and column in unique):
+                self._forget(query_hash)
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        self.cache.clear()
+        self._pending.clear()
+        self._pinned.clear()
+        self._unpinned.clear()
+
+    def stats(self):
+        """Returns the cache's size and hit/miss/eviction counters."""
+        lookups = self.hits + self.misses
+        return {
+            "table": self.table.__tablename__,
+            "size": len(self.cache),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
 
     __versions__: Dict[str, int] = {}
 
     __uniques__: List[str] = []
+
+
+class GuildConfigStore:
+    """Keeps every row of a small configuration table in memory, keyed by one of its columns (guild_id by default).
+    All stores are loaded together when the bot is ready; after that, reads never touch the database. Writes made
+    through the table's update_or_add/delete, here or on another instance, reload just the key they touched, and
+    reads of that key wait for the reload so a config command's change is visible immediately.
+    """
+    # every live store, so the bot can load them all at once
+    instances: "weakref.WeakSet[GuildConfigStore]" = weakref.WeakSet()
+
+    def __init__(self, table, key: str = "guild_id"):
+        self.table = table
+        self.key = key
+        self.rows: Dict[typing.Any, list] = {}
+        self.loaded = False
+        self._reloads: Dict[typing.Any, asyncio.Future] = {}  # key -> pending reload of that key
+        self._full_reload: typing.Optional[asyncio.Future] = None
+        # keys reloaded while the full reload was in flight; their reads started after its read, so they win over it
+        self._reloaded_during_full: Dict[typing.Any, list] = {}
+        table._caches.add(self)
+        GuildConfigStore.instances.add(self)
+
+    @classmethod
+    async def load_all(cls):
+        """Loads every store"""
+        stores = list(cls.instances)
+        await asyncio.gather(*(store.load() for store in stores))
+        DOZER_LOGGER.info(f"Loaded {sum(len(store.rows) for store in stores)} configuration entries from "
+                          f"{len(stores)} tables")
+
+    async def load(self):
+        """Reads the whole table into memory, replacing anything already held"""
+        self._start_full_reload()
+        while self._full_reload is not None:
+            await asyncio.shield(self._full_reload)
+
+    async def query_all(self, key) -> list:
+        """All rows for a key, without a database round trip once the store is loaded"""
+        if not self.loaded and self._full_reload is None:
+            # used before the bot was ready, or after a cog reload created this store
+            self._start_full_reload()
+        pending = self._full_reload or self._reloads.get(key)
+        while pending is not None:
+            await asyncio.shield(pending)
+            pending = self._full_reload or self._reloads.get(key)
+        return self.rows.get(key, [])
+
+    async def query_one(self, key):
+        """The first row for a key, or None"""
+        rows = await self.query_all(key)
+        return rows[0] if rows else None
+
+    def _start_full_reload(self):
+        self._reloads.clear()  # the full read supersedes any reload of a single key
+        self._reloaded_during_full.clear()
+        self._full_reload = asyncio.ensure_future(self._reload_all())
+
+    async def _reload_all(self):
+        task = asyncio.current_task()
+        rows = {}
+        try:
+            for row in await self.table.get_by():  # no filters, get all
+                key = row[self.key] if isinstance(row, asyncpg.Record) else getattr(row, self.key)
+                rows.setdefault(key, []).append(row)
+        finally:
+            # a later write started a newer reload, whose read is the one to trust
+            superseded = self._full_reload is not task
+            if not superseded:
+                self._full_reload = None
+        if not superseded:
+            for key, fresh in self._reloaded_during_full.items():
+                if fresh:
+                    rows[key] = fresh
+                else:
+                    rows.pop(key, None)
+            self._reloaded_during_full.clear()
+            self.rows = rows
+            self.loaded = True
+
+    async def _reload(self, key):
+        task = asyncio.current_task()
+        try:
+            rows = await self.table.get_by(**{self.key: key})
+        finally:
+            superseded = self._reloads.get(key) is not task
+            if not superseded:
+                del self._reloads[key]
+        if superseded:
+            return
+        if self._full_reload is not None:
+            self._reloaded_during_full[key] = rows
+        if rows:
+            self.rows[key] = rows
+        else:
+            self.rows.pop(key, None)
+
+    def invalidate_matching(self, columns: dict):
+        """Reloads the rows a write with these column values could have changed"""
+        if not self.loaded or self.key not in columns:
+            self.clear()
+        else:
+            self._reloads[columns[self.key]] = asyncio.ensure_future(self._reload(columns[self.key]))
+
+    def clear(self):
+        """Reloads the whole table, if anything has been read from it"""
+        if self.loaded or self._full_reload is not None:
+            self._start_full_reload()
@@ -0,0 +1,442 @@
+"""In-process stand-in for the Postgres pool, so cogs' database paths can be benchmarked and tested without a server.
+
+It understands the statements DatabaseTable compiles (select, delete, upsert, the staged bulk operations) and the few
+hand-written queries cogs send directly; anything else raises NotImplementedError naming the statement. Install it
+with `memorydb.install()` before exercising a cog. Transactions are accepted but never roll back.
+"""
+import contextlib
+import itertools
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+import asyncpg
+
+from . import db
+from .querystats import InstrumentedPool
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_PARAM_RE = re.compile(r"\$(\d+)")
+_CONDITION_RE = re.compile(r"^(\w+) = \$(\d+)$")
+
+_SELECT_RE = re.compile(r"^SELECT (\*|count\(\*\)) FROM (\w+)(?: WHERE (.+?))?;?$", re.IGNORECASE)
+_DELETE_RE = re.compile(r"^DELETE FROM (\w+)(?: WHERE (.+?))?;?$", re.IGNORECASE)
+_TRUNCATE_RE = re.compile(r"^TRUNCATE (\w+);?$", re.IGNORECASE)
+_INSERT_RE = re.compile(r"^INSERT INTO (\w+) \(([^)]*)\) ?(?:VALUES ?\(([^)]*)\)|SELECT (.+?) FROM (\w+))"
+                        r"(?: ON CONFLICT \(([^)]*)\) DO (NOTHING|UPDATE SET (.+?)))? ?;?$", re.IGNORECASE)
+_STAGING_RE = re.compile(r"^CREATE TEMPORARY TABLE (\w+) ON COMMIT DROP AS SELECT (.+?) FROM (\w+) WITH NO DATA;?$",
+                         re.IGNORECASE)
+_BULK_DELETE_RE = re.compile(r"^DELETE FROM (\w+) USING (\w+) staged WHERE (.+?);?$", re.IGNORECASE)
+_NOOP_RE = re.compile(r"^(?:CREATE|ALTER|DROP|SELECT pg_notify|SELECT pg_advisory)", re.IGNORECASE)
+
+
+class MemoryRecord(dict):
+    """A row as returned by a query, readable by column name or by position like an asyncpg Record"""
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self.values())[key]
+        return super().__getitem__(key)
+
+    def __iter__(self):
+        # Records unpack into their values, e.g. `for (user_id, total_xp) in records`
+        return iter(self.values())
+
+
+class MemoryTable:
+    """Rows of one table, with a dict index on its unique columns when it has any"""
+
+    def __init__(self, name: str, unique: Tuple[str, ...] = (), columns: tuple = ()):
+        self.name = name
+        self.unique = unique
+        self.columns = columns  # db.Column declarations, for serial and default values
+        self.rows: Dict[int, dict] = {}
+        self.index: Dict[tuple, int] = {}
+        self._row_ids = itertools.count()
+        self._serials = {column.name: itertools.count(1) for column in columns if column.sql_type == "serial"}
+
+    def _key(self, row: dict) -> Optional[tuple]:
+        if not self.unique:
+            return None
+        return tuple(row.get(column) for column in self.unique)
+
+    def find(self, filters: Dict[str, object]) -> List[dict]:
+        """Rows whose columns equal every filter value; like SQL, a None filter never matches"""
+        if any(value is None for value in filters.values()):
+            return []
+        if self.unique and all(column in filters for column in self.unique):
+            row_id = self.index.get(tuple(filters[column] for column in self.unique))
+            row = self.rows.get(row_id)
+            if row is None or any(row.get(column) != value for column, value in filters.items()):
+                return []
+            return [row]
+        return [row for row in self.rows.values() if all(row.get(column) == value for column, value in filters.items())]
+
+    def insert(self, values: dict) -> dict:
+        """Adds a row, filling in serial and default values for columns that weren't given"""
+        row = {}
+        for column in self.columns:
+            if column.name in values:
+                continue
+            if column.name in self._serials:
+                row[column.name] = next(self._serials[column.name])
+            else:
+                row[column.name] = _default_value(column.default)
+        row.update(values)
+        key = self._key(row)
+        if key is not None and key in self.index:
+            raise asyncpg.UniqueViolationError(f"duplicate key value violates unique constraint on {self.name}")
+        row_id = next(self._row_ids)
+        self.rows[row_id] = row
+        if key is not None:
+            self.index[key] = row_id
+        return row
+
+    def upsert(self, values: dict, conflict: Tuple[str, ...], updates: Optional[Tuple[str, ...]],
+               increments: Tuple[str, ...] = ()) -> bool:
+        """INSERT ... ON CONFLICT; updates is None for DO NOTHING, and the columns in increments are added to rather
+        than replaced. Returns whether a row was written."""
+        existing = self.find({column: values.get(column) for column in conflict})
+        if not existing:
+            self.insert(values)
+            return True
+        if updates is None:
+            return False
+        existing[0].update((column, existing[0][column] + values.get(column) if column in increments else values.get(column))
+                           for column in updates)
+        return True
+
+    def remove(self, rows: List[dict]) -> int:
+        """Deletes the given rows, returning how many there were; a row listed twice is deleted and counted once"""
+        doomed = {id(row): row for row in rows}
+        if self.unique:
+            for row in doomed.values():
+                del self.rows[self.index.pop(self._key(row))]
+            return len(doomed)
+        for row_id, row in list(self.rows.items()):
+            if id(row) in doomed:
+                del self.rows[row_id]
+        return len(doomed)
+
+    def clear(self) -> int:
+        """Deletes every row, returning how many there were"""
+        count = len(self.rows)
+        self.rows.clear()
+        self.index.clear()
+        return count
+
+
+def _default_value(default: Optional[str]):
+    """Python value of the few kinds of SQL DEFAULT expression tables declare"""
+    if default is None or default.upper() == "NULL":
+        return None
+    if default.upper() in ("TRUE", "FALSE"):
+        return default.upper() == "TRUE"
+    if default.startswith("'") and default.endswith("'"):
+        return default[1:-1]
+    try:
+        return int(default)
+    except ValueError:
+        return None
+
+
+def _parse_conditions(where: Optional[str]) -> List[Tuple[str, int]]:
+    """(column, parameter index) pairs of a `a = $1 AND b = $2` WHERE clause"""
+    if not where:
+        return []
+    conditions = []
+    for condition in re.split(r" AND ", where, flags=re.IGNORECASE):
+        match = _CONDITION_RE.match(condition.strip())
+        if match is None:
+            raise NotImplementedError(f"Memory backend can't evaluate condition {condition!r}")
+        conditions.append((match.group(1), int(match.group(2)) - 1))
+    return conditions
+
+
+def _columns(text: str) -> Tuple[str, ...]:
+    return tuple(column.strip() for column in text.split(",") if column.strip())
+
+
+class MemoryDatabase:
+    """Every table's rows, plus the compiled plan for each distinct statement seen so far"""
+    # (pattern over the whitespace-collapsed statement, handler) for hand-written queries cogs send directly
+    queries: List[Tuple["re.Pattern", Callable]] = []
+
+    def __init__(self):
+        self.tables: Dict[str, MemoryTable] = {}
+        self._plans: Dict[str, Callable] = {}
+
+    @classmethod
+    def query(cls, pattern: str):
+        """Decorator registering a handler `handler(database, args) -> list of rows` for statements matching pattern"""
+
+        def register(handler):
+            cls.queries.append((re.compile(pattern, re.IGNORECASE | re.DOTALL), handler))
+            return handler
+
+        return register
+
+    def table(self, name: str, conflict: Tuple[str, ...] = ()) -> MemoryTable:
+        """The named table, created on first use with the schema of the DatabaseTable mapping it"""
+        table = self.tables.get(name)
+        if table is None:
+            classes = list(db.DatabaseTable._tables.get(name, {}).values())
+            declared = next((cls for cls in classes if cls.__columns__), None)
+            unique = classes[0]._unique_columns if classes else conflict
+            table = self.tables[name] = MemoryTable(name, tuple(unique), declared.__columns__ if declared else ())
+        return table
+
+    def run(self, statement: str, args: tuple) -> Tuple[List[dict], str]:
+        """Runs one statement, returning its rows and command status"""
+        plan = self._plans.get(statement)
+        if plan is None:
+            plan = self._plans[statement] = self._plan(_WHITESPACE_RE.sub(" ", statement).strip())
+        return plan(args)
+
+    def _plan(self, sql: str) -> Callable:
+        for pattern, handler in self.queries:
+            if pattern.search(sql):
+                return lambda args: (handler(self, args), "SELECT")
+        match = _SELECT_RE.match(sql)
+        if match:
+            return self._plan_select(match.group(1) != "*", match.group(2), _parse_conditions(match.group(3)))
+        match = _INSERT_RE.match(sql)
+        if match:
+            return self._plan_insert(match)
+        match = _BULK_DELETE_RE.match(sql)
+        if match:
+            return self._plan_bulk_delete(match.group(1), match.group(2), match.group(3))
+        match = _DELETE_RE.match(sql)
+        if match:
+            return self._plan_delete(match.group(1), _parse_conditions(match.group(2)))
+        match = _TRUNCATE_RE.match(sql)
+        if match:
+            name = match.group(1)
+            return lambda args: ([], f"TRUNCATE {self.table(name).clear()}")
+        match = _STAGING_RE.match(sql)
+        if match:
+            name = match.group(1)
+
+            def create_staging(_args):
+                self.tables[name] = MemoryTable(name)
+                return [], "SELECT 0"
+
+            return create_staging
+        if _NOOP_RE.match(sql):
+            return lambda args: ([], sql.split(" ", 1)[0].upper())
+        raise NotImplementedError(f"Memory backend can't run {sql!r}")
+
+    def _plan_select(self, count: bool, name: str, conditions: List[Tuple[str, int]]) -> Callable:
+        def select(args):
+            rows = self.table(name).find({column: args[i] for column, i in conditions})
+            if count:
+                return [MemoryRecord(count=len(rows))], "SELECT 1"
+            return [MemoryRecord(row) for row in rows], f"SELECT {len(rows)}"
+
+        return select
+
+    def _plan_delete(self, name: str, conditions: List[Tuple[str, int]]) -> Callable:
+        def delete(args):
+            table = self.table(name)
+            return [], f"DELETE {table.remove(table.find({column: args[i] for column, i in conditions}))}"
+
+        return delete
+
+    def _plan_insert(self, match) -> Callable:
+        name, columns = match.group(1), _columns(match.group(2))
+        conflict = _columns(match.group(6)) if match.group(6) else None
+        updates = None
+        increments = ()
+        if match.group(8):
+            assignments = [assignment.split("=", 1) for assignment in match.group(8).split(",")]
+            updates = tuple(column.strip() for column, _ in assignments)
+            # `column = table.column + EXCLUDED.column`, as bulk_increment writes
+            increments = tuple(column.strip() for column, value in assignments if "+" in value)
+        if match.group(3) is not None:
+            params = [int(param) - 1 for param in _PARAM_RE.findall(match.group(3))]
+
+            def rows_of(args):
+                return [{column: args[i] for column, i in zip(columns, params)}]
+        else:
+            source, source_columns = match.group(5), _columns(match.group(4))
+
+            def rows_of(_args):
+                return [{column: row.get(source_column) for column, source_column in zip(columns, source_columns)}
+                        for row in self.tables[source].rows.values()]
+
+        def insert(args):
+            table = self.table(name, conflict or ())
+            written = 0
+            for values in rows_of(args):
+                if conflict is None:
+                    table.insert(values)
+                    written += 1
+                else:
+                    written += table.upsert(values, conflict, updates, increments)
+            return [], f"INSERT 0 {written}"
+
+        return insert
+
+    def _plan_bulk_delete(self, name: str, staging: str, conditions: str) -> Callable:
+        columns = [condition.split("=")[0].strip().split(".", 1)[1]
+                   for condition in re.split(r" AND ", conditions, flags=re.IGNORECASE)]
+
+        def bulk_delete(_args):
+            table = self.table(name)
+            doomed = []
+            for staged in self.tables[staging].rows.values():
+                doomed.extend(table.find({column: staged.get(column) for column in columns}))
+            return [], f"DELETE {table.remove(doomed)}"
+
+        return bulk_delete
+
+    def copy_records(self, name: str, records, columns) -> str:
+        """COPY ... FROM STDIN into an existing table"""
+        table = self.tables.get(name) or self.table(name)
+        count = 0
+        for record in records:
+            table.insert(dict(zip(columns, record)))
+            count += 1
+        return f"COPY {count}"
+
+
+class MemoryConnection:
+    """Connection-shaped view of a MemoryDatabase. Statements complete without yielding to the event loop."""
+
+    def __init__(self, database: MemoryDatabase):
+        self._database = database
+
+    async def execute(self, query: str, *args, **_kwargs) -> str:
+        """Connection.execute"""
+        return self._database.run(query, args)[1]
+
+    async def executemany(self, command: str, args, **_kwargs):
+        """Connection.executemany"""
+        for arguments in args:
+            self._database.run(command, tuple(arguments))
+
+    async def fetch(self, query: str, *args, **_kwargs) -> list:
+        """Connection.fetch"""
+        return self._database.run(query, args)[0]
+
+    async def fetchrow(self, query: str, *args, **_kwargs):
+        """Connection.fetchrow"""
+        records = self._database.run(query, args)[0]
+        return records[0] if records else None
+
+    async def fetchval(self, query: str, *args, column: int = 0, **_kwargs):
+        """Connection.fetchval"""
+        records = self._database.run(query, args)[0]
+        return records[0][column] if records else None
+
+    async def copy_records_to_table(self, table_name: str, *, records, columns=None, **_kwargs) -> str:
+        """Connection.copy_records_to_table"""
+        return self._database.copy_records(table_name, records, columns)
+
+    @contextlib.asynccontextmanager
+    async def transaction(self, **_kwargs):
+        """Connection.transaction, minus the rollback"""
+        yield
+
+    async def add_listener(self, channel, callback):
+        """Nothing is ever notified in-process"""
+
+    async def close(self):
+        """Connection.close"""
+
+
+class MemoryPool:
+    """Pool-shaped view of a MemoryDatabase"""
+
+    def __init__(self, database: MemoryDatabase):
+        self.database = database
+        self._conn = MemoryConnection(database)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, *, timeout: float = None):  # pylint: disable=unused-argument
+        """Yields the pool's only connection, which is never busy"""
+        yield self._conn
+
+    def __getattr__(self, name):
+        # execute, fetch and friends, same as asyncpg's pool
+        return getattr(self._conn, name)
+
+    async def close(self):
+        """Pool.close"""
+
+
+def install(instrumented: bool = True) -> MemoryDatabase:
+    """Points db.Pool at a fresh in-memory database and returns it. With instrumented, statements are timed through
+    db.querystats like they would be against Postgres."""
+    database = MemoryDatabase()
+    pool = MemoryPool(database)
+    db.Pool = InstrumentedPool(pool) if instrumented else pool
+    return database
+
+
+# Hand-written queries cogs send through db.Pool directly
+
+@MemoryDatabase.query(r"^SELECT user_id, total_xp FROM (\w+) WHERE guild_id = \$1;?$")
+def _guild_xp(database: MemoryDatabase, args):
+    """Levels._rank_index: every member's XP in a guild, to build its rank index"""
+    return [MemoryRecord(user_id=row["user_id"], total_xp=row["total_xp"])
+            for row in database.table("levels_member_xp").find({"guild_id": args[0]})]
+
+
+@MemoryDatabase.query(r"^SELECT \* FROM levels_member_xp WHERE guild_id = \$1 AND user_id = ANY\(\$2::bigint\[\]\)")
+def _members_xp(database: MemoryDatabase, args):
+    """Levels._load_pending: the XP records of several members of a guild"""
+    guild_id, user_ids = args
+    return [MemoryRecord(row) for row in database.table("levels_member_xp").find({"guild_id": guild_id})
+            if row["user_id"] in user_ids]
+
+
+@MemoryDatabase.query(r"^SELECT user_id, sum\(xp\)::bigint AS xp FROM levels_member_xp_daily WHERE guild_id = \$1 AND day >= \$2")
+def _window_xp(database: MemoryDatabase, args):
+    """Levels._window_index: the XP each member of a guild earned since a day"""
+    guild_id, since = args
+    totals = {}
+    for row in database.table("levels_member_xp_daily").find({"guild_id": guild_id}):
+        if row["day"] >= since:
+            totals[row["user_id"]] = totals.get(row["user_id"], 0) + row["xp"]
+    return [MemoryRecord(user_id=user_id, xp=xp) for user_id, xp in totals.items()]
+
+
+@MemoryDatabase.query(r"^INSERT INTO levels_member_xp_monthly .* FROM levels_member_xp_daily WHERE day < \$1")
+def _compact_months(database: MemoryDatabase, args):
+    """Levels.compact_task: fold days before a cutoff into their months"""
+    monthly = database.table("levels_member_xp_monthly", ("guild_id", "user_id", "month"))
+    for row in database.table("levels_member_xp_daily").find({}):
+        if row["day"] < args[0]:
+            monthly.upsert({"guild_id": row["guild_id"], "user_id": row["user_id"], "month": row["day"].replace(day=1),
+                            "xp": row["xp"]}, ("guild_id", "user_id", "month"), ("xp",), ("xp",))
+    return []
+
+
+@MemoryDatabase.query(r"^DELETE FROM levels_member_xp_daily WHERE day < \$1")
+def _drop_old_days(database: MemoryDatabase, args):
+    """Levels.compact_task: drop the days just folded into months"""
+    table = database.table("levels_member_xp_daily")
+    table.remove([row for row in table.find({}) if row["day"] < args[0]])
+    return []
+
+
+@MemoryDatabase.query(r"^SELECT team_type, team_number, count\(\*\) FROM team_numbers WHERE user_id = ANY\(\$1\)")
+def _top_teams(database: MemoryDatabase, args):
+    """TeamNumbers.top10: the ten teams with the most of the given members"""
+    user_ids = set(args[0])
+    counts = {}
+    for row in database.table("team_numbers").rows.values():
+        if row["user_id"] in user_ids:
+            team = (row["team_type"], row["team_number"])
+            counts[team] = counts.get(team, 0) + 1
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:10]
+    return [MemoryRecord(team_type=team_type, team_number=team_number, count=count)
+            for (team_type, team_number), count in ranked]
+
+
+@MemoryDatabase.query(r"^SELECT \* FROM reaction_roles WHERE message_id != all\(\$1\) and guild_id = \$2")
+def _unbound_reactions(database: MemoryDatabase, args):
+    """Roles.rolemenu: reaction roles whose message is not a known role menu"""
+    bound = set(args[0])
+    return [MemoryRecord(row) for row in database.table("reaction_roles").find({"guild_id": args[1]})
+            if row["message_id"] not in bound]
@@ -0,0 +1,336 @@
+"""Timing instrumentation for every statement sent through db.Pool"""
+import asyncio
+import logging
+import re
+import sys
+import time
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+DOZER_LOGGER = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets in milliseconds; the last bucket catches everything slower
+BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, float("inf"))
+
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE|JOIN)\s+(?:ONLY\s+|IF\s+(?:NOT\s+)?EXISTS\s+)?([a-z_][a-z0-9_.]*)",
+                       re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"\s+")
+# Modules whose frames are skipped when looking for the code that issued a slow query
+_INTERNAL_MODULES = ("dozer.db", __name__, "asyncpg")
+
+
+class LatencyStats:
+    """Call count, rows and a latency histogram for one statement, one table, or pool acquires"""
+    __slots__ = ("count", "total", "max", "rows", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.buckets = [0] * len(BUCKETS_MS)
+
+    def record(self, elapsed: float, rows: int = 0):
+        """Adds one call that took elapsed seconds and returned or affected the given number of rows"""
+        self.count += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.rows += rows
+        elapsed_ms = elapsed * 1000
+        for i, bound in enumerate(BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                break
+
+    @property
+    def mean(self) -> float:
+        """Mean latency in seconds"""
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound in seconds of the histogram bucket holding the given percentile, capped at the observed max"""
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.buckets):
+            seen += count
+            if count and seen >= target:
+                return min(bound / 1000, self.max)
+        return self.max
+
+
+class PoolSample:
+    """Pool occupancy and acquire latency over one sampling interval"""
+    __slots__ = ("timestamp", "in_use", "peak_in_use", "peak_waiting", "acquires", "mean_wait", "max_wait")
+
+    def __init__(self, *, timestamp: float, in_use: int, peak_in_use: int, peak_waiting: int, acquires: int,
+                 mean_wait: float, max_wait: float):
+        self.timestamp = timestamp
+        self.in_use = in_use
+        self.peak_in_use = peak_in_use
+        self.peak_waiting = peak_waiting
+        self.acquires = acquires
+        self.mean_wait = mean_wait
+        self.max_wait = max_wait
+
+
+class QueryStats:
+    """Aggregates the latency of statements sent through an InstrumentedPool"""
+    # Statements beyond this many distinct query strings are lumped together, so ad-hoc SQL can't grow this forever
+    max_statements = 1000
+
+    def __init__(self):
+        self.statements: Dict[str, LatencyStats] = {}
+        self.tables: Dict[str, LatencyStats] = {}
+        self.acquire_wait = LatencyStats()
+        self.slow_query_threshold = 0.25  # seconds, None to disable the slow query log
+        self._normalized: Dict[str, Tuple[str, str]] = {}  # raw query -> (statement key, table)
+        # Pool health: connections currently checked out and acquires currently blocked, plus per-interval samples
+        self.pool_max_size = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.acquire_warning_threshold = 0.1  # seconds, None to disable
+        self.pool_samples: Deque[PoolSample] = deque(maxlen=1440)
+        self._window = LatencyStats()
+        self._peak_in_use = 0
+        self._peak_waiting = 0
+        self._last_acquire_warning = 0.0
+        self._suppressed_acquire_warnings = 0
+
+    def _describe(self, query: str) -> Tuple[str, str]:
+        described = self._normalized.get(query)
+        if described is None:
+            if len(self._normalized) >= self.max_statements:
+                return "<other>", "<other>"
+            match = _TABLE_RE.search(query)
+            described = self._normalized[query] = (_WHITESPACE_RE.sub(" ", query).strip(),
+                                                   match.group(1).lower() if match else "<none>")
+        return described
+
+    def record(self, query: str, elapsed: float, rows: int = 0):
+        """Adds one execution of a statement"""
+        statement, table = self._describe(query)
+        stats = self.statements.get(statement)
+        if stats is None:
+            stats = self.statements[statement] = LatencyStats()
+        stats.record(elapsed, rows)
+        stats = self.tables.get(table)
+        if stats is None:
+            stats = self.tables[table] = LatencyStats()
+        stats.record(elapsed, rows)
+        if self.slow_query_threshold is not None and elapsed >= self.slow_query_threshold:
+            DOZER_LOGGER.warning(f"Slow query ({elapsed * 1000:.0f}ms, {rows} rows) from {_call_site()}: "
+                                 f"{statement[:200]}")
+
+    def acquire_started(self):
+        """Counts an acquire that is now waiting on the pool"""
+        self.waiting += 1
+        self._peak_waiting = max(self._peak_waiting, self.waiting)
+
+    def acquire_finished(self, elapsed: float, acquired: bool):
+        """Records how long an acquire waited and whether it got a connection"""
+        self.waiting -= 1
+        if not acquired:
+            return
+        self.in_use += 1
+        self._peak_in_use = max(self._peak_in_use, self.in_use)
+        self.acquire_wait.record(elapsed)
+        self._window.record(elapsed)
+        if self.acquire_warning_threshold is not None and elapsed >= self.acquire_warning_threshold:
+            now = time.monotonic()
+            if now - self._last_acquire_warning < 10:
+                # during a burst every acquire is slow; one warning every few seconds is enough
+                self._suppressed_acquire_warnings += 1
+                return
+            DOZER_LOGGER.warning(f"Waited {elapsed * 1000:.0f}ms for a database connection from {_call_site()} "
+                                 f"({self.in_use}/{self.pool_max_size} in use, {self.waiting} waiting, "
+                                 f"{self._suppressed_acquire_warnings} similar warnings suppressed)")
+            self._last_acquire_warning = now
+            self._suppressed_acquire_warnings = 0
+
+    def released(self):
+        """Counts a connection going back to the pool"""
+        self.in_use -= 1
+
+    def sample_pool(self) -> PoolSample:
+        """Closes the current sampling interval, recording its peak occupancy and acquire latency"""
+        sample = PoolSample(timestamp=time.time(), in_use=self.in_use, peak_in_use=self._peak_in_use,
+                            peak_waiting=self._peak_waiting, acquires=self._window.count, mean_wait=self._window.mean,
+                            max_wait=self._window.max)
+        self.pool_samples.append(sample)
+        self._window = LatencyStats()
+        self._peak_in_use = self.in_use
+        self._peak_waiting = self.waiting
+        return sample
+
+    def top(self, count: int = 10) -> List[Tuple[str, LatencyStats]]:
+        """The statements with the most total time spent in them"""
+        return sorted(self.statements.items(), key=lambda item: item[1].total, reverse=True)[:count]
+
+    def reset(self):
+        """Forgets everything recorded so far"""
+        self.statements.clear()
+        self.tables.clear()
+        self.acquire_wait = LatencyStats()
+        self.pool_samples.clear()
+
+
+async def sample_pool(interval: float):
+    """Samples pool occupancy every `interval` seconds, logging intervals in which the pool ran out of connections"""
+    while True:
+        await asyncio.sleep(interval)
+        sample = stats.sample_pool()
+        level = logging.WARNING if stats.pool_max_size and sample.peak_in_use >= stats.pool_max_size else logging.DEBUG
+        DOZER_LOGGER.log(level, f"Database pool: {sample.in_use}/{stats.pool_max_size} in use, peak "
+                                f"{sample.peak_in_use} in use and {sample.peak_waiting} waiting, {sample.acquires} "
+                                f"acquires waiting {sample.mean_wait * 1000:.1f}ms mean, "
+                                f"{sample.max_wait * 1000:.0f}ms max")
+
+
+def _call_site() -> str:
+    """The first frame up the stack outside the database layer, i.e. the code that issued the query"""
+    frame = sys._getframe(2)  # pylint: disable=protected-access
+    while frame is not None and frame.f_globals.get("__name__", "").startswith(_INTERNAL_MODULES):
+        frame = frame.f_back
+    if frame is None:
+        return "<unknown>"
+    return f"{frame.f_code.co_filename}:{frame.f_lineno} in {frame.f_code.co_name}"
+
+
+def _status_rows(status) -> int:
+    """Row count from a command status such as 'INSERT 0 5' or 'DELETE 3'"""
+    count = status.rsplit(" ", 1)[-1] if isinstance(status, str) else ""
+    return int(count) if count.isdigit() else 0
+
+
+stats = QueryStats()
+
+
+class InstrumentedConnection:
+    """Wraps an asyncpg connection, timing the statements sent through it"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    async def execute(self, query: str, *args, **kwargs):
+        """Times Connection.execute"""
+        start = time.perf_counter()
+        status = None
+        try:
+            status = await self._conn.execute(query, *args, **kwargs)
+            return status
+        finally:
+            stats.record(query, time.perf_counter() - start, _status_rows(status))
+
+    async def executemany(self, command: str, args, **kwargs):
+        """Times Connection.executemany"""
+        args = list(args)
+        start = time.perf_counter()
+        try:
+            return await self._conn.executemany(command, args, **kwargs)
+        finally:
+            stats.record(command, time.perf_counter() - start, len(args))
+
+    async def fetch(self, query: str, *args, **kwargs):
+        """Times Connection.fetch"""
+        start = time.perf_counter()
+        records = []
+        try:
+            records = await self._conn.fetch(query, *args, **kwargs)
+            return records
+        finally:
+            stats.record(query, time.perf_counter() - start, len(records))
+
+    async def fetchrow(self, query: str, *args, **kwargs):
+        """Times Connection.fetchrow"""
+        start = time.perf_counter()
+        record = None
+        try:
+            record = await self._conn.fetchrow(query, *args, **kwargs)
+            return record
+        finally:
+            stats.record(query, time.perf_counter() - start, int(record is not None))
+
+    async def fetchval(self, query: str, *args, **kwargs):
+        """Times Connection.fetchval"""
+        start = time.perf_counter()
+        try:
+            return await self._conn.fetchval(query, *args, **kwargs)
+        finally:
+            stats.record(query, time.perf_counter() - start, 1)
+
+    async def copy_records_to_table(self, table_name: str, **kwargs):
+        """Times Connection.copy_records_to_table"""
+        start = time.perf_counter()
+        status = None
+        try:
+            status = await self._conn.copy_records_to_table(table_name, **kwargs)
+            return status
+        finally:
+            stats.record(f"COPY {table_name} FROM STDIN", time.perf_counter() - start, _status_rows(status))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class _InstrumentedAcquire:
+    """Async context manager returned by InstrumentedPool.acquire"""
+    __slots__ = ("_acquire",)
+
+    def __init__(self, acquire):
+        self._acquire = acquire
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        stats.acquire_started()
+        acquired = False
+        try:
+            conn = await self._acquire.__aenter__()
+            acquired = True
+        finally:
+            stats.acquire_finished(time.perf_counter() - start, acquired)
+        return InstrumentedConnection(conn)
+
+    async def __aexit__(self, *exc_info):
+        try:
+            return await self._acquire.__aexit__(*exc_info)
+        finally:
+            stats.released()
+
+
+class InstrumentedPool:
+    """Wraps an asyncpg pool so every statement run through it, directly or on an acquired connection, is timed"""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def acquire(self, *, timeout: float = None):
+        """Acquires a connection, recording how long the pool took to hand it out"""
+        return _InstrumentedAcquire(self._pool.acquire(timeout=timeout))
+
+    async def execute(self, query: str, *args, **kwargs):
+        """Pool.execute"""
+        async with self.acquire() as conn:
+            return await conn.execute(query, *args, **kwargs)
+
+    async def executemany(self, command: str, args, **kwargs):
+        """Pool.executemany"""
+        async with self.acquire() as conn:
+            return await conn.executemany(command, args, **kwargs)
+
+    async def fetch(self, query: str, *args, **kwargs):
+        """Pool.fetch"""
+        async with self.acquire() as conn:
+            return await conn.fetch(query, *args, **kwargs)
+
+    async def fetchrow(self, query: str, *args, **kwargs):
+        """Pool.fetchrow"""
+        async with self.acquire() as conn:
+            return await conn.fetchrow(query, *args, **kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs):
+        """Pool.fetchval"""
+        async with self.acquire() as conn:
+            return await conn.fetchval(query, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
@@ -0,0 +1,168 @@
+"""Tests for the Filter cog's regex safety check and worker pool"""
+import asyncio
+import re
+import time
+
+import pytest
+
+from dozer import memorydb
+from dozer.cogs.filter import Filter, FilterMatcher, RegexPool, WordFilter, exponential_risk
+
+EXPONENTIAL = [
+    r"(a+)+$",
+    r"(a*)*",
+    r"(a|aa)+!",  # the parser hoists the shared `a`, leaving a(|a) inside the repeat
+    r"(a|a)*b",
+    r"(\d+x|\d)*",
+    r"(a{1,3})+!",
+    r"(\s*\w+)*x",
+    r"(\w+\d+)+",
+    r"((ab)+c?)+",
+    r"(x+x+)+y",
+    r"(?=(a+)+b)",
+    r"([\u4e00-\u9fff]+\s?)+",
+]
+
+LINEAR = [
+    r"[a-z]+(\s[a-z]+)*",
+    r"(?:ab+)+c",
+    r"(a+b)+",
+    r"(\w+\s)+$",
+    r"(?:[^\s]+\s)+",
+    r"(\d{3}-)+\d{4}",
+    r"(?:foo|bar)+",
+    r"(?:https?://)?\S+",
+    r"\bf[o0]+\b",
+    r"[a@4][s$5]{2}",
+    r"(\u4e00+\u4e01)+",
+]
+
+
+@pytest.mark.parametrize("pattern", EXPONENTIAL)
+def test_exponential_patterns_are_rejected(pattern):
+    assert exponential_risk(pattern) is not None
+
+
+@pytest.mark.parametrize("pattern", LINEAR)
+def test_linear_patterns_pass(pattern):
+    assert exponential_risk(pattern) is None
+
+
+def test_queued_searches_get_the_whole_budget():
+    """Searches waiting for the only worker don't spend their time budget in the queue"""
+    pattern, text = r"(a|aa)+!", "a" * 28
+    start = time.perf_counter()
+    re.search(pattern, text)
+    search_time = time.perf_counter() - start
+
+    async def scenario():
+        pool = RegexPool(1, search_time * 3)
+        try:
+            await pool.run("warm up", ((1, "warm up"),), "")  # starts the worker, which isn't timed
+            # together they need far longer than one budget, so they only pass if each is timed on its own
+            searches = [pool.run("slow", ((1, pattern),), text) for _ in range(5)]
+            return await asyncio.gather(*searches)
+        finally:
+            pool.close()
+
+    assert asyncio.run(scenario()) == [[]] * 5
+
+
+def test_overrun_only_stops_its_own_worker():
+    """A search that overruns doesn't fail the searches running next to it"""
+    async def scenario():
+        pool = RegexPool(2, 0.5)
+        try:
+            await asyncio.gather(pool.run(1, ((1, "a"),), "a"), pool.run(1, ((1, "a"),), "a"))  # start both workers
+            slow = pool.run(2, ((2, r"(a|aa)+!"),), "a" * 40)
+            quick = [pool.run(1, None, "xa") for _ in range(3)]  # both workers already know key 1
+            results = await asyncio.gather(slow, *quick, return_exceptions=True)
+            after = await pool.run(1, ((1, "a"),), "a")
+            return results, after
+        finally:
+            pool.close()
+
+    (slow, *quick), after = asyncio.run(scenario())
+    assert isinstance(slow, asyncio.TimeoutError)
+    assert quick == [[1]] * 3
+    assert after == [1]
+
+
+class _StubBot:
+    """Just enough of Dozer to load the Filter cog"""
+
+    def __init__(self, ready: asyncio.Event):
+        self.loop = asyncio.get_event_loop()
+        self.config = {'filter': {'regex_timeout_ms': 1000, 'regex_workers': 1}}
+        self._ready = ready
+
+    async def wait_until_ready(self):
+        await self._ready.wait()
+
+    def add_message_hook(self, hook, order, *, gate=False):
+        pass
+
+    def remove_message_hook(self, hook):
+        pass
+
+
+def test_snapshots_load_before_preloading_and_preloading_retries():
+    async def scenario():
+        memorydb.install(instrumented=False)
+        await WordFilter(guild_id=1, friendly_name="one", pattern="bad", filter_id=1).update_or_add()
+        await WordFilter(guild_id=2, friendly_name="two", pattern="worse", filter_id=2).update_or_add()
+        ready = asyncio.Event()
+        cog = Filter(_StubBot(ready))
+        try:
+            # not ready yet, so nothing is preloaded; the guild's filters are read when its first message is checked
+            assert (await cog.snapshot(1)).matcher.filter_ids == {1}
+            assert not cog.loaded
+
+            failures = []
+            get_by = WordFilter.get_by.__func__
+
+            async def flaky_get_by(cls, **filters):
+                if not failures:
+                    failures.append(filters)
+                    raise ConnectionError("database unavailable")
+                return await get_by(cls, **filters)
+
+            WordFilter.get_by = classmethod(flaky_get_by)
+            try:
+                ready.set()
+                for _ in range(300):  # the first retry comes a second after the failure
+                    if cog.loaded:
+                        break
+                    await asyncio.sleep(0.01)
+            finally:
+                WordFilter.get_by = classmethod(get_by)
+            assert failures and cog.loaded
+            assert (await cog.snapshot(2)).matcher.filter_ids == {2}
+        finally:
+            cog.cog_unload()
+
+    asyncio.run(scenario())
+
+
+MIXED_PATTERNS = {
+    1: "bad",
+    2: "Worse",
+    3: r"\bf[o0]+\b",
+    4: r"(x)y",
+    5: r"(a)?(?(1)b|c)z",  # its group 1 would be filter 4's group in the alternation
+    6: r"(\w)\1",
+    7: r"(?P<word>cat)s?",
+    8: r"(?i)dog",
+    9: r"sn[a4]ke+",
+    10: r"^start",
+}
+TEXTS = ["", "abz", "cz", "xy", "this is bad", "WORSE", "f00 bar", "foo!", "aabbz", "cats", "hotdog", "snaakee",
+         "snakeee", "start here", "not start", "bz", "ABZ", "x y", "b a d"]
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_matcher_agrees_with_each_pattern(text):
+    matcher = FilterMatcher(MIXED_PATTERNS)
+    expected = [filter_id for filter_id, pattern in sorted(MIXED_PATTERNS.items())
+                if re.search(pattern, text, re.IGNORECASE)]
+    assert matcher.matches(text) == expected
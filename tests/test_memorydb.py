@@ -0,0 +1,129 @@
+"""Runs DatabaseTable's compiled statements and the Levels cog's hand-written queries through the in-memory backend"""
+import asyncio
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+
+from dozer import db, memorydb
+from dozer.Components.XPJournal import XPJournal
+from dozer.cogs.levels import DAILY_RETENTION_DAYS, Levels, MemberXP, MemberXPCache, MemberXPDaily, MemberXPMonthly
+
+NOW = datetime(2021, 3, 4, tzinfo=timezone.utc)
+
+
+def _run(coroutine):
+    memorydb.install(instrumented=False)
+    return asyncio.run(coroutine)
+
+
+def _member(guild_id, user_id, total_xp, total_messages=1):
+    return MemberXP(guild_id=guild_id, user_id=user_id, total_xp=total_xp, total_messages=total_messages,
+                    last_given_at=NOW)
+
+
+def test_get_by_and_upsert():
+    async def scenario():
+        await _member(1, 10, 5).update_or_add()
+        await _member(1, 11, 7).update_or_add()
+        await _member(2, 10, 9).update_or_add()
+        await _member(1, 10, 6, total_messages=2).update_or_add()  # same key, replaces the first row
+
+        assert sorted(row.user_id for row in await MemberXP.get_by(guild_id=1)) == [10, 11]
+        (row,) = await MemberXP.get_by(guild_id=1, user_id=10)
+        assert (row.total_xp, row.total_messages) == (6, 2)
+        assert await MemberXP.get_by(guild_id=1, user_id=None) == []
+
+        await MemberXP.delete(guild_id=1, user_id=11)
+        assert [row.user_id for row in await MemberXP.get_by(guild_id=1)] == [10]
+
+    _run(scenario())
+
+
+def test_bulk_operations():
+    async def scenario():
+        assert await MemberXP.bulk_upsert([_member(1, user_id, user_id) for user_id in range(5)]) == 5
+        assert await MemberXP.bulk_upsert([_member(1, 0, 100), _member(1, 0, 200), _member(1, 9, 9)]) == 2
+        assert {row.user_id: row.total_xp for row in await MemberXP.get_by(guild_id=1)} == \
+            {0: 200, 1: 1, 2: 2, 3: 3, 4: 4, 9: 9}
+
+        day = date(2021, 3, 4)
+        await MemberXPDaily.bulk_increment([MemberXPDaily(1, 10, day, 5), MemberXPDaily(1, 10, day, 3)])
+        await MemberXPDaily.bulk_increment([MemberXPDaily(1, 10, day, 2), MemberXPDaily(1, 11, day, 1)])
+        assert {row.user_id: row.xp for row in await MemberXPDaily.get_by(guild_id=1, day=day)} == {10: 10, 11: 1}
+
+        await MemberXP.bulk_delete([{"guild_id": 1, "user_id": 0}, {"guild_id": 1, "user_id": 9},
+                                    {"guild_id": 1, "user_id": 9}])
+        assert sorted(row.user_id for row in await MemberXP.get_by(guild_id=1)) == [1, 2, 3, 4]
+
+    _run(scenario())
+
+
+def _levels():
+    """A Levels cog with just the state its queries read, since building a real one needs a running bot"""
+    cog = Levels.__new__(Levels)
+    cog._xp_cache = {}
+    cog._daily_xp = {}
+    cog._rank_indexes = OrderedDict()
+    return cog
+
+
+def test_levels_queries():
+    async def scenario():
+        cog = _levels()
+        await MemberXP.bulk_upsert([_member(1, 10, 50), _member(1, 11, 70), _member(2, 10, 90)])
+        index = await cog._build_rank_index(1)
+        assert (len(index), index.rank(11), index.rank(10)) == (2, 1, 2)
+
+        records = await db.Pool.fetch(f"SELECT * FROM {MemberXP.__tablename__} "
+                                      f"WHERE guild_id = $1 AND user_id = ANY($2::bigint[]);", 1, [11, 12])
+        assert [(record['user_id'], record['total_xp']) for record in records] == [(11, 70)]
+
+        today = datetime.now(tz=timezone.utc).date()
+        old = today - timedelta(days=DAILY_RETENTION_DAYS + 1)
+        await MemberXPDaily.bulk_increment([MemberXPDaily(1, 10, old, 4), MemberXPDaily(1, 10, old - timedelta(days=1), 6),
+                                            MemberXPDaily(1, 10, today - timedelta(days=1), 1),
+                                            MemberXPDaily(1, 11, today, 2), MemberXPDaily(2, 11, today, 8)])
+        cog._daily_xp[(1, 11, today)] = 3  # earned since the last sync
+        window = await cog._window_index(1, 7)
+        assert (window.rank(11), window.rank(10)) == (1, 2)
+
+        await Levels.compact_task.coro(cog)
+        assert sorted(row.day for row in await MemberXPDaily.get_by(guild_id=1)) == [today - timedelta(days=1), today]
+        assert sum(row.xp for row in await MemberXPMonthly.get_by(guild_id=1, user_id=10)) == 10
+
+    _run(scenario())
+
+
+def test_journal_replay_counts_daily_xp_once(tmp_path):
+    def journaled(path):
+        cog = _levels()
+        cog._journal = XPJournal(str(path), asyncio.get_running_loop())
+        replayed, cog._replayed_daily = cog._journal.replay()
+        cog._xp_cache.update((key, MemberXPCache(*entry, dirty=True)) for key, entry in replayed.items())
+        cog._sync_lock = asyncio.Lock()
+        return cog
+
+    def earn(cog, xp):
+        cached_member = cog._xp_cache.setdefault((1, 10), MemberXPCache(0, NOW, 0, True))
+        cached_member.total_xp += xp
+        cached_member.dirty = True
+        cog._daily_xp[(1, 10, NOW.date())] = cog._daily_xp.get((1, 10, NOW.date()), 0) + xp
+        cog._journal.append(1, 10, cached_member, NOW.date(), xp)
+
+    async def scenario():
+        cog = journaled(tmp_path)
+        earn(cog, 5)
+        cog._journal.discard = lambda segments: None  # crash after the database has the XP, before the cleanup
+        await cog.sync_to_database()
+        cog._journal.close()
+
+        cog = journaled(tmp_path)
+        earn(cog, 2)
+        await cog.sync_to_database()
+        cog._journal.close()
+        assert list(tmp_path.iterdir()) == []
+        (row,) = await MemberXPDaily.get_by(guild_id=1, user_id=10)
+        assert row.xp == 7
+        (row,) = await MemberXP.get_by(guild_id=1, user_id=10)
+        assert row.total_xp == 7
+
+    _run(scenario())